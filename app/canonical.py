@@ -0,0 +1,154 @@
+#
+# URL canonicalization
+#
+import collections
+import logging
+import re
+import urllib.parse
+
+LOGGER = logging.getLogger(__name__)
+
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+_PATH_SESSION = re.compile(r';(jsessionid|phpsessid|sid)=[^/?#]*', re.I)
+
+
+class Canonicalizer(object):
+    """Rewrite URLs that name the same page to one canonical URL.
+
+    canonicalize() lowercases the scheme and host, drops the default
+    port, the fragment, ';jsessionid=...' path parameters and a trailing
+    index page (index_pages), drops the query parameters named in
+    drop_params or starting with one of drop_prefixes, and sorts the
+    remaining ones by name.  Results are cached, cache_size of them.
+
+    The rules can be set per crawl job; rules is a dict that may hold
+    'drop_params', 'drop_prefixes', 'keep_params' (never dropped, not
+    even when learnt) and 'index_pages', each a list replacing (or for
+    drop_params, extending) the defaults.
+
+    It also learns which parameters do not change a page: observe() is
+    given the body digest of every fetched page, and once min_evidence
+    URLs of a host that differ from an URL already fetched only in the
+    value of a parameter have had the same content, and none had other
+    content, that parameter is dropped from the URLs of that host too.
+    """
+
+    # Only parameters that never name a page: on shops ref= and the
+    # like often pick the product, so they are left to learning.
+    DROP_PARAMS = ('phpsessid', 'sid', 'sessionid', 'session_id',
+                   'jsessionid', 'aspsessionid', 'gclid', 'fbclid', 'msclkid',
+                   'yclid', 'dclid', '_ga', 'mc_cid', 'mc_eid')
+    DROP_PREFIXES = ('utm_',)
+    INDEX_PAGES = ('index.html', 'index.htm', 'index.php', 'index.asp',
+                   'default.asp', 'default.aspx')
+
+    def __init__(self, rules=None, learn=True, min_evidence=3,
+                 cache_size=10000, max_observations=100000):
+        rules = rules or {}
+        self.drop_params = set(p.lower() for p in self.DROP_PARAMS)
+        self.drop_params.update(p.lower() for p in rules.get('drop_params', ()))
+        self.keep_params = set(p.lower() for p in rules.get('keep_params', ()))
+        self.drop_params -= self.keep_params
+        self.drop_prefixes = tuple(p.lower() for p in
+                                   rules.get('drop_prefixes',
+                                             self.DROP_PREFIXES))
+        self.index_pages = tuple(rules.get('index_pages', self.INDEX_PAGES))
+        self.learn = learn
+        self.min_evidence = min_evidence
+        self.cache_size = cache_size
+        self.max_observations = max_observations
+        self._cache = collections.OrderedDict()
+        # host -> parameters learnt to be irrelevant
+        self.learnt = {}
+        # (host, param) -> [same content, other content]
+        self._votes = {}
+        # (url without param, param) -> {value: digest}
+        self._observations = collections.OrderedDict()
+
+    def _drop(self, host, name):
+        name = name.lower()
+        if name in self.keep_params:
+            return False
+        return (name in self.drop_params or
+                name.startswith(self.drop_prefixes) or
+                name in self.learnt.get(host, ()))
+
+    def canonicalize(self, url):
+        """Return the canonical form of an absolute URL."""
+        canonical = self._cache.get(url)
+        if canonical is not None:
+            return canonical
+        canonical = self._canonicalize(url)
+        self._cache[url] = canonical
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return canonical
+
+    def _canonicalize(self, url):
+        try:
+            parts = urllib.parse.urlsplit(url)
+            port = parts.port
+        except ValueError:
+            return url.split('#', 1)[0]
+        scheme = parts.scheme.lower()
+        if scheme not in DEFAULT_PORTS:
+            return urllib.parse.urldefrag(url)[0]
+        host = (parts.hostname or '').rstrip('.')
+        netloc = '[%s]' % host if ':' in host else host
+        if port is not None and port != DEFAULT_PORTS[scheme]:
+            netloc = '%s:%d' % (netloc, port)
+        if '@' in parts.netloc:
+            netloc = parts.netloc.rsplit('@', 1)[0] + '@' + netloc
+        path = _PATH_SESSION.sub('', parts.path) or '/'
+        for index_page in self.index_pages:
+            if path.endswith('/' + index_page):
+                path = path[:-len(index_page)]
+                break
+        query = parts.query
+        if query:
+            params = urllib.parse.parse_qsl(query, keep_blank_values=True)
+            params = [(name, value) for name, value in params
+                      if not self._drop(host, name)]
+            params.sort(key=lambda param: param[0])
+            query = urllib.parse.urlencode(params)
+        return urllib.parse.urlunsplit((scheme, netloc, path, query, ''))
+
+    def canonicalize_all(self, urls):
+        """Return the set of the canonical forms of urls."""
+        return {self.canonicalize(url) for url in urls}
+
+    def observe(self, url, digest):
+        """Learn from the content digest of the page at canonical url."""
+        if not self.learn:
+            return
+        parts = urllib.parse.urlsplit(url)
+        if not parts.query:
+            return
+        host = (parts.hostname or '').rstrip('.')
+        params = urllib.parse.parse_qsl(parts.query, keep_blank_values=True)
+        for i, (name, value) in enumerate(params):
+            if name.lower() in self.keep_params:
+                continue
+            others = urllib.parse.urlencode(params[:i] + params[i + 1:])
+            key = (urllib.parse.urlunsplit(parts[:3] + (others, '')), name)
+            values = self._observations.get(key)
+            if values is None:
+                values = self._observations[key] = {}
+                if len(self._observations) > self.max_observations:
+                    self._observations.popitem(last=False)
+            if value in values:
+                continue
+            if values:
+                self._vote(host, name, digest in values.values())
+            values[value] = digest
+
+    def _vote(self, host, name, same):
+        votes = self._votes.setdefault((host, name), [0, 0])
+        votes[0 if same else 1] += 1
+        if (not votes[1] and votes[0] >= self.min_evidence and
+                name.lower() not in self.learnt.get(host, ())):
+            LOGGER.info('query parameter %r does not change pages of %r',
+                        name, host)
+            self.learnt.setdefault(host, set()).add(name.lower())
+            self._cache.clear()
@@ -0,0 +1,133 @@
+#
+# Adaptive per-host concurrency
+#
+import collections
+import logging
+
+LOGGER = logging.getLogger(__name__)
+
+# Statuses a server sends when it is overloaded or throttling us.
+THROTTLE_STATUSES = (429, 503)
+
+
+class _HostLimit(object):
+    """Concurrency limit and recent latencies of one host."""
+
+    __slots__ = ('limit', 'latencies', 'baseline', 'since_decrease',
+                 'observed')
+
+    def __init__(self, limit, window):
+        self.limit = float(limit)
+        self.latencies = collections.deque(maxlen=window)
+        self.baseline = None
+        self.since_decrease = 0
+        self.observed = 0
+
+
+class AimdController(object):
+    """Tune the concurrency of every host while the crawl runs (AIMD).
+
+    observe() is given the outcome of every fetch.  A host's limit grows
+    by increase per limit successful fetches (so by about increase per
+    round of requests), up to max_limit, and is multiplied by decrease,
+    down to min_limit, when the host shows congestion:
+
+    - a fetch failed or timed out, or the server answered 429 or 503;
+    - or the 90th percentile of the last window latencies exceeds
+      latency_factor times the host's baseline, the lowest median
+      latency seen (raised by 5% every window so a host that got slower
+      for good gets a new baseline).
+
+    After a decrease the limit does not decrease again until limit more
+    fetches have completed, so one burst of errors from the requests
+    already in flight counts once.  At most max_hosts hosts are
+    tracked, least recently seen first out.
+    """
+
+    def __init__(self, initial=3, min_limit=1, max_limit=16, increase=1.0,
+                 decrease=0.5, latency_factor=3.0, window=20,
+                 max_hosts=10000):
+        self.initial = initial
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.increase = increase
+        self.decrease = decrease
+        self.latency_factor = latency_factor
+        self.window = window
+        self.max_hosts = max_hosts
+        self.hosts = collections.OrderedDict()
+        self.increases = 0
+        self.decreases = 0
+
+    def _state(self, host):
+        state = self.hosts.get(host)
+        if state is None:
+            state = self.hosts[host] = _HostLimit(self.initial, self.window)
+            if len(self.hosts) > self.max_hosts:
+                self.hosts.popitem(last=False)
+        else:
+            self.hosts.move_to_end(host)
+        return state
+
+    def limit(self, host):
+        """Current concurrency limit of host."""
+        state = self.hosts.get(host)
+        return int(state.limit) if state is not None else self.initial
+
+    def limits(self):
+        """Map every tracked host to its current limit."""
+        return {host: int(state.limit) for host, state in self.hosts.items()}
+
+    def _congested(self, state, latency):
+        if latency is None:
+            return False
+        latencies = state.latencies
+        latencies.append(latency)
+        state.observed += 1
+        if len(latencies) < self.window:
+            return False
+        ordered = sorted(latencies)
+        median = ordered[len(ordered) // 2]
+        if state.observed % self.window == 0 and state.baseline is not None:
+            state.baseline *= 1.05
+        if state.baseline is None or median < state.baseline:
+            state.baseline = median
+        p90 = ordered[int(0.9 * (len(ordered) - 1))]
+        return p90 > self.latency_factor * state.baseline
+
+    def observe(self, host, latency=None, status=None, error=None):
+        """Record the outcome of a fetch; return the new limit of host.
+
+        latency is the seconds to the response (None if there was none),
+        status its HTTP status and error the exception the fetch raised.
+        """
+        state = self._state(host)
+        state.since_decrease += 1
+        congested = (error is not None or status in THROTTLE_STATUSES or
+                     self._congested(state, latency))
+        if congested:
+            if (state.since_decrease >= state.limit and
+                    state.limit > self.min_limit):
+                state.limit = max(self.min_limit, state.limit * self.decrease)
+                state.since_decrease = 0
+                # The old latencies were measured under the old load.
+                state.latencies.clear()
+                self.decreases += 1
+                LOGGER.info('concurrency of %r down to %d', host,
+                            int(state.limit))
+        elif state.limit < self.max_limit:
+            before = int(state.limit)
+            state.limit = min(self.max_limit,
+                              state.limit + self.increase / state.limit)
+            if int(state.limit) > before:
+                self.increases += 1
+                LOGGER.debug('concurrency of %r up to %d', host,
+                             int(state.limit))
+        return int(state.limit)
+
+    def report(self, file=None, top=10):
+        limits = sorted(self.limits().items(), key=lambda item: -item[1])
+        print('Concurrency: %d hosts, %d increases, %d decreases' %
+              (len(limits), self.increases, self.decreases), file=file)
+        for host, limit in limits[:top]:
+            print('    %s: %d' % (host, limit), file=file)
@@ -9,9 +9,24 @@ import argparse
 import asyncio
 import logging
 import sys
+import asyncio_redis
 import redis
+import canonical
+import concurrency
 import crawling
+import dnscache
+import frontier
+import neardup
+import pagecache
+import redis_frontier
 import reporting
+import robots
+import seen
+import sink
+import sitemaps
+import metrics
+import sharding
+from retry import RetryPolicy
 import json
 import functools
 from scraper import Scraper
@@ -23,6 +38,35 @@ ARGS.add_argument(
 ARGS.add_argument(
     '--select', action='store_true', dest='select',
     default=False, help='Use Select event loop instead of default')
+ARGS.add_argument(
+    '--daemon', action='store_true',
+    default=False, help='Keep crawling jobs from Redis until interrupted')
+ARGS.add_argument(
+    '--max_jobs', action='store', type=int, metavar='N',
+    default=4, help='Limit crawl jobs running at once in --daemon mode')
+ARGS.add_argument(
+    '--job_batch', action='store', type=int, metavar='N',
+    default=10, help='Pop up to N jobs per Redis round-trip in --daemon mode')
+ARGS.add_argument(
+    '--sink_batch', action='store', type=int, metavar='N',
+    default=100, help='Push scraped records to Redis in batches of N '
+    '(--daemon mode only: other crawls do not scrape)')
+ARGS.add_argument(
+    '--sink_interval', action='store', type=float, metavar='SECS',
+    default=1.0, help='Push buffered scraped records at least this often '
+    'in --daemon mode')
+ARGS.add_argument(
+    '--metrics_port', action='store', type=int, metavar='PORT',
+    default=0, help='Serve Prometheus metrics on PORT (0: disabled)')
+ARGS.add_argument(
+    '--metrics_host', action='store', metavar='HOST',
+    default='127.0.0.1', help='Address of the metrics endpoint')
+ARGS.add_argument(
+    '--redis_host', action='store', metavar='HOST',
+    default='localhost', help='Redis host holding the job queue')
+ARGS.add_argument(
+    '--redis_port', action='store', type=int, metavar='PORT',
+    default=6379, help='Redis port')
 ARGS.add_argument(
     'roots', nargs='*',
     default=[], help='Root URL (may be repeated)')
@@ -32,9 +76,101 @@ ARGS.add_argument(
 ARGS.add_argument(
     '--max_tries', action='store', type=int, metavar='N',
     default=4, help='Limit retries on network errors')
+ARGS.add_argument(
+    '--retry_base_delay', action='store', type=float, metavar='SECS',
+    default=1.0, help='Backoff delay before the first retry')
+ARGS.add_argument(
+    '--retry_max_delay', action='store', type=float, metavar='SECS',
+    default=300.0, help='Longest backoff delay between retries')
 ARGS.add_argument(
     '--max_tasks', action='store', type=int, metavar='N',
     default=100, help='Limit concurrent connections')
+ARGS.add_argument(
+    '--max_connections_per_host', action='store', type=int, metavar='N',
+    default=3, help='Limit concurrent connections to a single host (the '
+                    'starting limit, unless --fixed_concurrency)')
+ARGS.add_argument(
+    '--max_host_concurrency', action='store', type=int, metavar='N',
+    default=16, help='Highest concurrency a host may be tuned up to')
+ARGS.add_argument(
+    '--fixed_concurrency', action='store_false', dest='adaptive',
+    default=True, help='Do not tune the concurrency of each host from its '
+                       'latency and errors')
+ARGS.add_argument(
+    '--timeout', action='store', type=float, metavar='SECONDS',
+    default=10.0, help='Give up on a response after this long')
+ARGS.add_argument(
+    '--host_delay', action='store', type=float, metavar='SECS',
+    default=0.0, help='Minimum delay between two fetches from a host')
+ARGS.add_argument(
+    '--frontier', action='store', metavar='PATH',
+    help='Keep the frontier and seen URLs in an SQLite file')
+ARGS.add_argument(
+    '--resume', action='store_true',
+    default=False, help='Resume the crawl stored in --frontier')
+ARGS.add_argument(
+    '--priority', action='store_true',
+    default=False, help='Fetch the URLs most likely to be product pages '
+                        'first, from an in-memory frontier')
+ARGS.add_argument(
+    '--max_frontier', action='store', type=int, metavar='N',
+    default=100000, help='Keep at most N URLs in the --priority frontier, '
+                         'dropping the lowest ranked')
+ARGS.add_argument(
+    '--shared_frontier', action='store', metavar='NAME',
+    help='Share the frontier and seen URLs of crawl NAME in Redis '
+         'with other nodes')
+ARGS.add_argument(
+    '--lease_time', action='store', type=float, metavar='SECS',
+    default=600.0, help='Re-queue URLs a --shared_frontier node took '
+                        'and did not finish after this long')
+ARGS.add_argument(
+    '--page_cache', action='store', metavar='PATH',
+    help='Keep validators, links and data of pages in an SQLite file and '
+         'skip parsing pages unchanged since the last crawl')
+ARGS.add_argument(
+    '--dup_distance', action='store', type=int, metavar='BITS',
+    help='Skip pages whose text SimHash is within BITS of a page '
+         'already processed (e.g. 3; default: off)')
+ARGS.add_argument(
+    '--drop_params', action='store', metavar='NAMES',
+    help='Comma-separated query parameters to drop from URLs, besides '
+         'session ids and utm_* (jobs may set {"canonical": {...}} rules)')
+ARGS.add_argument(
+    '--no_learn_params', action='store_false', dest='learn_params',
+    default=True, help='Do not drop query parameters found not to change '
+                       'pages')
+ARGS.add_argument(
+    '--ignore_robots', action='store_false', dest='robots',
+    default=True, help='Do not fetch nor obey robots.txt')
+ARGS.add_argument(
+    '--max_crawl_delay', action='store', type=float, metavar='SECONDS',
+    default=30.0, help='Cap on the robots.txt Crawl-delay obeyed')
+ARGS.add_argument(
+    '--sitemaps', action='store_true',
+    default=False, help='Also crawl the URLs listed in the sitemaps of '
+                        'the roots (found through robots.txt)')
+ARGS.add_argument(
+    '--max_sitemap_urls', action='store', type=int, metavar='N',
+    default=1000000, help='Take at most N URLs from the sitemaps of a site')
+ARGS.add_argument(
+    '--seen_store', action='store', choices=('exact', 'bloom'),
+    default='exact', help='Seen-URL store: 64-bit fingerprints or a Bloom filter')
+ARGS.add_argument(
+    '--bloom_error_rate', action='store', type=float, metavar='P',
+    default=0.001, help='False-positive rate of --seen_store=bloom')
+ARGS.add_argument(
+    '--parse_workers', action='store', type=int, metavar='N',
+    default=0, help='Parse pages in N worker processes (0: on the event loop)')
+ARGS.add_argument(
+    '--processes', action='store', type=int, metavar='N',
+    default=1, help='Crawl in N processes, each owning a share of the hosts')
+ARGS.add_argument(
+    '--max_body_size', action='store', type=int, metavar='BYTES',
+    default=10 * 1024 * 1024, help='Drop HTML bodies larger than this')
+ARGS.add_argument(
+    '--stats_log', action='store', metavar='PATH',
+    help='Write one JSON line per fetched URL to PATH (rotated)')
 ARGS.add_argument(
     '--exclude', action='store', metavar='REGEX',
     help='Exclude matching URLs')
@@ -57,16 +193,226 @@ def fix_url(url):
         url = 'http://' + url
     return url
 
+JOB_QUEUE = 'queue:urls_to_crawl'
+
+def parse_job(value):
+    """Decode one job popped from JOB_QUEUE (bytes or str JSON)."""
+    if isinstance(value, bytes):
+        value = value.decode('utf-8')
+    return json.loads(value)
+
 def init_data(data_list):
     roots = set()
     scrape_data = {}
-    json_data_list = map(lambda d: json.loads(d[1].decode('utf-8')), data_list)
+    json_data_list = map(lambda d: parse_job(d[1]), data_list)
     for d in json_data_list:
         url = fix_url(d['url'])
         roots.add(url)
         scrape_data.update({url:d['selectors']})
     return (roots, scrape_data)
 
+def make_seen_store(args):
+    if args.seen_store == 'bloom':
+        return seen.ScalableBloomFilter(error_rate=args.bloom_error_rate)
+    return seen.FingerprintSet()
+
+def make_canonicalizer(args, rules=None):
+    """Canonicalizer with --drop_params added to the rules of a job."""
+    rules = dict(rules or {})
+    if args.drop_params:
+        rules['drop_params'] = (list(rules.get('drop_params', ())) +
+                                args.drop_params.split(','))
+    return canonical.Canonicalizer(rules, learn=args.learn_params)
+
+def make_robots(args, loop):
+    return robots.RobotsCache(max_crawl_delay=args.max_crawl_delay, loop=loop)
+
+def make_crawler(args, roots, scraper=None, data_handler=None, loop=None,
+                 stats_log=None, **kwargs):
+    """Create a Crawler configured from the command line arguments.
+
+    With --priority, and no other frontier given, it gets a
+    PriorityFrontier and only a couple of URLs per task are moved from
+    it to the crawler's queue at a time, so the queue stays in
+    priority order.
+    """
+    seen_store = make_seen_store(args)
+    if args.priority and kwargs.get('frontier') is None:
+        kwargs['frontier'] = frontier.PriorityFrontier(
+            max_size=args.max_frontier, seen_store=seen_store)
+        kwargs.setdefault('frontier_buffer', 2 * args.max_tasks)
+    near_duplicates = None
+    if args.dup_distance is not None:
+        near_duplicates = neardup.SimHashIndex(args.dup_distance)
+    if kwargs.get('canonicalizer') is None:
+        kwargs['canonicalizer'] = make_canonicalizer(args)
+    if args.robots and kwargs.get('robots') is None:
+        kwargs['robots'] = make_robots(args, loop)
+    if args.adaptive and kwargs.get('concurrency') is None:
+        kwargs['concurrency'] = concurrency.AimdController(
+            initial=args.max_connections_per_host,
+            max_limit=max(args.max_host_concurrency,
+                          args.max_connections_per_host))
+    if args.sitemaps and kwargs.get('sitemaps') is None:
+        kwargs['sitemaps'] = sitemaps.SitemapSeeder(
+            max_urls=args.max_sitemap_urls, loop=loop)
+    return crawling.Crawler(roots,
+                            scraper=scraper,
+                            data_handler=data_handler,
+                            exclude=args.exclude,
+                            strict=args.strict,
+                            max_redirect=args.max_redirect,
+                            max_tries=args.max_tries,
+                            retry_policy=RetryPolicy(
+                                base_delay=args.retry_base_delay,
+                                max_delay=args.retry_max_delay),
+                            max_tasks=args.max_tasks,
+                            max_connections_per_host=args.max_connections_per_host,
+                            host_delay=args.host_delay,
+                            timeout=args.timeout,
+                            seen_store=seen_store,
+                            near_duplicates=near_duplicates,
+                            parse_workers=args.parse_workers,
+                            max_body_size=args.max_body_size,
+                            keep_done=False,
+                            stats_log=stats_log,
+                            loop=loop,
+                            **kwargs)
+
+def make_shard_crawler(args, roots, *, loop, shard):
+    """Create the Crawler of one --processes shard.
+
+    Each shard writes its own --stats_log and --page_cache, suffixed
+    with its index.
+    """
+    stats_log = page_cache = None
+    if args.stats_log:
+        stats_log = reporting.JsonLog('%s.shard%d' % (args.stats_log,
+                                                       shard.index))
+    if args.page_cache:
+        page_cache = pagecache.PageCache('%s.shard%d' % (args.page_cache,
+                                                          shard.index))
+    return make_crawler(args, roots, loop=loop, stats_log=stats_log,
+                        page_cache=page_cache, shard=shard)
+
+@asyncio.coroutine
+def run_job(args, value, session, resolver, robots_cache, data_handler,
+            stats_log, page_cache, crawl_metrics, crawlers, loop):
+    """Crawl one job popped from JOB_QUEUE and report on it."""
+    roots, scrape_data = init_data([(JOB_QUEUE, value)])
+    canonicalizer = make_canonicalizer(args, parse_job(value).get('canonical'))
+    crawler = make_crawler(args, roots, scraper=Scraper(scrape_data),
+                           data_handler=data_handler, loop=loop,
+                           stats_log=stats_log, page_cache=page_cache,
+                           crawl_metrics=crawl_metrics,
+                           session=session, resolver=resolver,
+                           robots=robots_cache, canonicalizer=canonicalizer)
+    crawlers.add(crawler)
+    try:
+        yield from crawler.crawl()
+    finally:
+        crawlers.discard(crawler)
+        reporting.report(crawler)
+        crawler.close()
+
+@asyncio.coroutine
+def pop_jobs(connection, n):
+    """Pop up to n jobs, blocking for the first one.
+
+    The others are popped in one pipelined MULTI/EXEC round-trip.
+    """
+    reply = yield from connection.blpop([JOB_QUEUE], timeout=0)
+    values = [reply.value]
+    if n > 1:
+        transaction = yield from connection.multi()
+        futures = []
+        for _ in range(n - 1):
+            futures.append((yield from transaction.lpop(JOB_QUEUE)))
+        yield from transaction.exec()
+        for future in futures:
+            value = yield from future
+            if value is not None:
+                values.append(value)
+    return values
+
+@asyncio.coroutine
+def run_jobs(connection, start_job, max_jobs, job_batch, *, loop):
+    """Run start_job(value) for every job popped, max_jobs at once.
+
+    Up to job_batch jobs are popped at a time, and never more than
+    there are free slots.  Runs until cancelled, which cancels the jobs
+    still running.
+    """
+    running = set()
+    try:
+        while True:
+            if len(running) >= max_jobs:
+                yield from asyncio.wait(
+                    running, return_when=asyncio.FIRST_COMPLETED, loop=loop)
+            finished = {job for job in running if job.done()}
+            for job in finished:
+                if job.exception():
+                    logging.error('crawl job failed: %r', job.exception())
+            running -= finished
+            free = min(max_jobs - len(running), job_batch)
+            for value in (yield from pop_jobs(connection, free)):
+                running.add(asyncio.Task(start_job(value), loop=loop))
+    finally:
+        for job in running:
+            job.cancel()
+        if running:
+            yield from asyncio.wait(running, loop=loop)
+
+@asyncio.coroutine
+def run_daemon(args, loop):
+    """Crawl jobs from JOB_QUEUE forever, up to args.max_jobs at once.
+
+    All jobs share one event loop, one ClientSession (and DNS cache), one
+    robots.txt cache and one RedisDataHandler, which has its own
+    connection since the job connection blocks in BLPOP.
+    """
+    connection = yield from asyncio_redis.Connection.create(
+        host=args.redis_host, port=args.redis_port, loop=loop)
+    sink_connection = yield from asyncio_redis.Connection.create(
+        host=args.redis_host, port=args.redis_port, loop=loop)
+    data_handler = sink.RedisDataHandler(sink_connection,
+                                         batch_size=args.sink_batch,
+                                         flush_interval=args.sink_interval,
+                                         loop=loop)
+    crawl_metrics = metrics.Metrics()
+    resolver = dnscache.CachingResolver(loop=loop)
+    session = crawl_metrics.session(loop, resolver=resolver)
+    robots_cache = make_robots(args, loop) if args.robots else None
+    stats_log = reporting.JsonLog(args.stats_log) if args.stats_log else None
+    page_cache = pagecache.PageCache(args.page_cache) if args.page_cache else None
+    crawlers = set()
+    server = None
+    if args.metrics_port:
+        server = yield from metrics.start_server(
+            crawl_metrics, crawlers, args.metrics_host, args.metrics_port,
+            loop=loop)
+
+    def start_job(value):
+        return run_job(args, value, session, resolver, robots_cache,
+                       data_handler, stats_log, page_cache, crawl_metrics,
+                       crawlers, loop)
+
+    try:
+        yield from run_jobs(connection, start_job, args.max_jobs,
+                            args.job_batch, loop=loop)
+    finally:
+        yield from data_handler.close()
+        session.close()
+        yield from resolver.close()
+        connection.close()
+        sink_connection.close()
+        if stats_log is not None:
+            stats_log.close()
+        if page_cache is not None:
+            page_cache.close()
+        if server is not None:
+            server.close()
+
 def main():
     """Main program.
 
@@ -86,25 +432,75 @@ def main():
     else:
         loop = asyncio.get_event_loop()
 
+    if args.daemon:
+        if args.roots or args.frontier or args.shared_frontier:
+            ARGS.error('--daemon takes its roots from Redis, not from '
+                       'the command line or a frontier')
+        if args.processes > 1:
+            ARGS.error('--daemon does not support --processes')
+        daemon = asyncio.Task(run_daemon(args, loop), loop=loop)
+        try:
+            loop.run_until_complete(daemon)
+        except KeyboardInterrupt:
+            sys.stderr.flush()
+            print('\nInterrupted\n')
+            daemon.cancel()
+            try:
+                loop.run_until_complete(daemon)
+            except asyncio.CancelledError:
+                pass
+        finally:
+            loop.stop()
+            loop.run_forever()
+            loop.close()
+        return
+
     if not args.roots:
-        r = redis.StrictRedis(host='localhost', port=6379, db=0)
-        data = [r.blpop('queue:urls_to_crawl')]
+        r = redis.StrictRedis(host=args.redis_host, port=args.redis_port, db=0)
+        data = [r.blpop(JOB_QUEUE)]
         # data.append(r.blpop('queue:urls_to_crawl'))
         # data.append(r.blpop('queue:urls_to_crawl'))
         roots, scrape_data = init_data(data)
+        # Only --daemon jobs are scraped, and sent to the Redis sink.
         s = None#Scraper(scrape_data)
     else:
         roots = {fix_url(root) for root in args.roots}
         s = None
 
-    crawler = crawling.Crawler(roots,
-                               scraper=s,
-                               data_handler=None,
-                               exclude=args.exclude,
-                               strict=args.strict,
-                               max_redirect=args.max_redirect,
-                               max_tries=args.max_tries,
-                               max_tasks=args.max_tasks)
+    if args.processes > 1:
+        if args.frontier or args.shared_frontier or args.metrics_port:
+            ARGS.error('--processes does not support --frontier, '
+                       '--shared_frontier or --metrics_port')
+        loop.close()
+        sharding.crawl(args.processes,
+                       functools.partial(make_shard_crawler, args, roots))
+        return
+
+    if sum(map(bool, (args.frontier, args.shared_frontier,
+                      args.priority))) > 1:
+        ARGS.error('--frontier, --shared_frontier and --priority are '
+                   'exclusive')
+    if args.frontier:
+        url_frontier = frontier.SqliteFrontier(args.frontier, resume=args.resume)
+    elif args.shared_frontier:
+        url_frontier = redis_frontier.RedisFrontier(
+            redis.StrictRedis(host=args.redis_host, port=args.redis_port),
+            args.shared_frontier, lease_time=args.lease_time)
+    elif args.resume:
+        ARGS.error('--resume requires --frontier')
+    else:
+        url_frontier = None
+
+    stats_log = reporting.JsonLog(args.stats_log) if args.stats_log else None
+    page_cache = pagecache.PageCache(args.page_cache) if args.page_cache else None
+    crawler = make_crawler(args, roots, scraper=s, loop=loop,
+                           stats_log=stats_log, page_cache=page_cache,
+                           frontier=url_frontier)
+    server = None
+    if args.metrics_port:
+        server = loop.run_until_complete(metrics.start_server(
+            crawler.metrics, [crawler], args.metrics_host, args.metrics_port,
+            loop=loop))
     try:
         loop.run_until_complete(crawler.crawl())  # Crawler gonna crawl.
     except KeyboardInterrupt:
@@ -113,6 +509,14 @@ def main():
     finally:
         reporting.report(crawler) ########## REPORTING
         crawler.close()
+        if url_frontier is not None:
+            url_frontier.close()
+        if stats_log is not None:
+            stats_log.close()
+        if page_cache is not None:
+            page_cache.close()
+        if server is not None:
+            server.close()
 
         # next two lines are required for actual aiohttp resource cleanup
         loop.stop()
@@ -1,12 +1,10 @@
 import asyncio
 import cgi
-from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
 import logging
 import re
 import time
 import urllib.parse
-import aiohttp
-from asyncio import Queue
 import asyncio_redis
 import json
 import sys
@@ -14,9 +12,30 @@ import os
 sys.path.append(os.path.dirname(__file__)+'../app')
 try:
     import app.verify as verify
+    import app.scheduler as scheduler
+    import app.seen as seen
+    import app.parsing as parsing
+    from app.retry import RetryPolicy, parse_retry_after
+    import app.reporting as reporting
+    import app.metrics as metrics
+    import app.dnscache as dnscache
+    import app.pagecache as pagecache
+    import app.canonical as canonical
+    import app.robots as robots
+    from app.frontier import has_data
 except:
     import verify
-from lxml import html
+    import scheduler
+    import seen
+    import parsing
+    from retry import RetryPolicy, parse_retry_after
+    import reporting
+    import metrics
+    import dnscache
+    import pagecache
+    import canonical
+    import robots
+    from frontier import has_data
 
 LOGGER = logging.getLogger(__name__)
 
@@ -24,60 +43,185 @@ def lenient_host(host):
     parts = host.split('.')[-2:]
     return ''.join(parts)
 
-FetchStatistic = namedtuple('FetchStatistic',
-                            ['url',
-                             'next_url',
-                             'status',
-                             'exception',
-                             'size',
-                             'content_type',
-                             'encoding',
-                             'num_urls',
-                             'num_new_urls'])
+# Bodies are read in chunks of this size.
+CHUNK_SIZE = 64 * 1024
+
+# fetch() returns this instead of the page when the page cache says the
+# page has not changed since it was last parsed.
+NOT_MODIFIED = 'not_modified'
+
+# fetch() returns this instead of the page when it put the URL back on
+# the queue for another try.
+RETRYING = 'retrying'
+
+class BodyTooLarge(Exception):
+    """A response body was larger than the crawler's max_body_size."""
+
+class FetchStatistic(object):
+    """Outcome of fetching one URL."""
+
+    __slots__ = ('url',
+                 'next_url',
+                 'status',
+                 'exception',
+                 'size',
+                 'content_type',
+                 'encoding',
+                 'num_urls',
+                 'num_new_urls',
+                 'unchanged',
+                 'duplicate_of',
+                 'robots_disallowed')
+
+    def __init__(self, **kwargs):
+        for name in self.__slots__:
+            setattr(self, name, kwargs.get(name))
+
+    def _asdict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __repr__(self):
+        return 'FetchStatistic(%s)' % ', '.join(
+            '%s=%r' % (name, getattr(self, name)) for name in self.__slots__)
 
 def is_redirect(response):
     return response.status in (300, 301, 302, 303, 307)
 
-def get_content_type_and_encoding(response):
+def get_content_type_and_encoding(response, default='utf-8'):
     _content_type = None
     _url = response.url
     _content_type = response.headers.get('content-type')
     pdict = {}
     if _content_type:
         _content_type, pdict = cgi.parse_header(_content_type)
-    _encoding = pdict.get('charset', 'utf-8')
+    _encoding = pdict.get('charset', default)
     return (_url, _content_type, _encoding)
 
 class Crawler(object):
     """Crawl a set of URLs.
 
     This manages two sets of URLs: 'urls' and 'done'.  'urls' is a set of
-    URLs seen, and 'done' is a list of FetchStatistics.
+    URLs seen (a seen.FingerprintSet unless another seen_store is given),
+    and 'done' is a list of FetchStatistics.  Every FetchStatistic is also
+    summarized in 'stats', a reporting.StatsAggregator; long crawls
+    should pass keep_done=False and send per-URL records to stats_log
+    (a reporting.JsonLog, which the caller closes) instead of keeping
+    them in 'done'.
+
+    Every URL is rewritten by canonicalizer (a canonical.Canonicalizer)
+    before it is checked against the seen URLs.
+
+    With robots (a robots.RobotsCache) the robots.txt of a host is
+    fetched before its first page, the URLs it disallows are skipped and
+    its Crawl-delay spaces the fetches of the host.
+
+    Every host may have max_connections_per_host fetches in progress,
+    unless a concurrency.AimdController is given as concurrency: it then
+    tunes the limit of each host from the latency, errors and throttling
+    of its fetches.  A fetch waits at most timeout seconds for the
+    response.
+
+    With sitemaps (a sitemaps.SitemapSeeder) the URLs listed in the
+    sitemaps of the roots' sites are added while the crawl starts, the
+    most recently modified first.
+
+    Host names are looked up through a dnscache.CachingResolver, which
+    starts resolving the hosts of new links as soon as they are found.
+
+    Pages are parsed once for both links and scraped data, in a pool of
+    parse_workers processes if that is non-zero and on the loop otherwise.
+
+    With a frontier (see frontier.SqliteFrontier) the seen URLs and the
+    URLs still to fetch live on disk, and only up to frontier_buffer of
+    them are held in the in-memory queue at a time.  A
+    redis_frontier.RedisFrontier keeps them in Redis instead, shared
+    with the crawlers of other nodes: the crawler then keeps polling it,
+    every frontier_poll seconds, until no URL is pending or leased to any
+    node, as the nodes still fetching may find more.  A
+    frontier.PriorityFrontier
+    keeps them in memory, handing out the likely product pages first.
+
+    With a page_cache (see pagecache.PageCache) pages are fetched with
+    conditional GETs, and pages that did not change since the crawl that
+    stored them are not parsed or scraped again: their stored links and
+    data are used instead.
+
+    With near_duplicates (a neardup.SimHashIndex) a fetched page whose
+    text is close to that of a page already processed is recorded as a
+    duplicate and neither parsed nor scraped.
+
+    With a shard (see sharding.Shard) the crawler only fetches the hosts
+    its shard owns and forwards other URLs to the shards owning them.
     """
     def __init__(self, roots, scraper= None, data_handler=None,
                  exclude=None, strict=True,  # What to crawl.
                  max_redirect=5, max_tries=10,  # Per-url limits.
-                 max_tasks=10, max_connections_per_host=3,*, loop=None):
+                 max_tasks=10, max_connections_per_host=3,
+                 host_delay=0.0, frontier=None, frontier_buffer=1000,
+                 seen_store=None, parse_workers=0,
+                 max_body_size=10 * 1024 * 1024, session=None,
+                 retry_policy=None, keep_done=True, stats_log=None,
+                 crawl_metrics=None, shard=None, resolver=None,
+                 page_cache=None, near_duplicates=None, canonicalizer=None,
+                 robots=None, sitemaps=None, concurrency=None, timeout=10.0,
+                 frontier_poll=1.0, *, loop=None):
         self.loop = loop or asyncio.get_event_loop()
         self.roots = roots
+        self.shard = shard
         self.max_connections_per_host = max_connections_per_host
+        self.host_delay = host_delay
         self.scraper = scraper
         self.data_handler = data_handler
         self.exclude = exclude
         self.strict = strict
         self.max_redirect = max_redirect
         self.max_tries = max_tries
+        self.retry_policy = retry_policy or RetryPolicy()
         self.max_tasks = max_tasks
-        self.q = Queue(loop=self.loop)
-        self.seen_urls = set()
+        self.max_body_size = max_body_size
+        self.q = scheduler.HostScheduler(max_per_host=max_connections_per_host,
+                                         min_delay=host_delay,
+                                         loop=self.loop)
+        self.frontier = frontier
+        self.page_cache = page_cache
+        self.near_duplicates = near_duplicates
+        self.canonicalizer = canonicalizer or canonical.Canonicalizer()
+        self.robots = robots
+        self.sitemaps = sitemaps
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.frontier_buffer = frontier_buffer
+        self.frontier_poll = frontier_poll
+        if frontier is not None:
+            self.seen_urls = frontier
+        elif seen_store is not None:
+            self.seen_urls = seen_store
+        else:
+            self.seen_urls = seen.FingerprintSet()
+        self.keep_done = keep_done
         self.done = []
-        self.session = aiohttp.ClientSession(loop=self.loop)
+        self.stats = reporting.StatsAggregator(log=stats_log)
+        self.parse_executor = None
+        if parse_workers:
+            self.parse_executor = ProcessPoolExecutor(parse_workers)
+        # A session passed in is shared with other crawlers; close() leaves
+        # it open.  resolver is then the one its connector uses, if any.
+        self.metrics = crawl_metrics or metrics.Metrics()
+        self.own_session = session is None
+        self.own_resolver = session is None and resolver is None
+        if self.own_resolver:
+            resolver = dnscache.CachingResolver(loop=self.loop)
+        self.resolver = resolver
+        self.session = session or self.metrics.session(self.loop,
+                                                       resolver=resolver)
         self.root_domains = set()
+        self.root_by_site = {}
         for root in roots:
             parts = urllib.parse.urlparse(root)
             host, port = urllib.parse.splitport(parts.netloc)
             if not host:
                 continue
+            self.root_by_site.setdefault(self.site_key(host), root)
             if re.match(r'\A[\d\.]*\Z', host):
                 self.root_domains.add(host)
             else:
@@ -86,30 +230,61 @@ class Crawler(object):
                     self.root_domains.add(host)
                 else:
                     self.root_domains.add(lenient_host(host))
+        self.url_filter = verify.UrlFilter(self.root_domains,
+                                           exclude=self.exclude,
+                                           strict=self.strict,
+                                           robots=robots)
         for root in roots:
             self.add_urls(root)
         self.t0 = time.time()
         self.t1 = None
 
+    def site_key(self, host):
+        """Return the key under which host and its root share a site."""
+        host = host.lower()
+        if re.match(r'\A[\d\.]*\Z', host):
+            return host
+        if not self.strict:
+            return lenient_host(host)
+        return host[4:] if host.startswith('www.') else host
+
+    def root_for(self, url):
+        """Return the root URL of the site url belongs to."""
+        host, port = urllib.parse.splitport(urllib.parse.urlparse(url).netloc)
+        root = self.root_by_site.get(self.site_key(host or ''))
+        if root is None:
+            root = urllib.parse.urlunparse(urllib.parse.urlparse(url)[:2] +
+                                           ('', '', '', ''))
+        return root
+
     def record_statistic(self, url=None,
                          next_url=None,
                          status=None,
                          exception=None,
+                         size=0,
                          content_type=None,
                          encoding=None,
                          num_urls=0,
-                         num_new_urls=0):
+                         num_new_urls=0,
+                         unchanged=False,
+                         duplicate_of=None,
+                         robots_disallowed=False):
         """Record the FetchStatistic for completed / failed URL."""
         fetch_statistic = FetchStatistic(url=url,
                                          next_url=next_url,
                                          status=status,
-                                         size=0,
+                                         size=size,
                                          exception=exception,
                                          content_type=content_type,
                                          encoding=encoding,
                                          num_urls=num_urls,
-                                         num_new_urls=num_new_urls)
-        self.done.append(fetch_statistic)
+                                         num_new_urls=num_new_urls,
+                                         unchanged=unchanged,
+                                         duplicate_of=duplicate_of,
+                                         robots_disallowed=robots_disallowed)
+        self.stats.add(fetch_statistic)
+        if self.keep_done:
+            self.done.append(fetch_statistic)
 
     
     def extract_data(self,root_url, html):
@@ -118,36 +293,98 @@ class Crawler(object):
     def close(self):
         """Close resources."""
         LOGGER.debug("closing resources")
-        self.session.close()
+        if self.own_session:
+            self.session.close()
+        if self.own_resolver:
+            self.resolver.cancel()
+        if self.parse_executor is not None:
+            self.parse_executor.shutdown()
 
     @asyncio.coroutine
     def parse_links(self, web_page_html, base_url, _content_type, _encoding):
-        """Return a list of links."""
-        links = set()
-        tree = html.fromstring(web_page_html)
-        tree.make_links_absolute(base_url)
-        urls = [link[2] for link in tree.iterlinks()]
-        for url in urls:
-            defragmented, frag = urllib.parse.urldefrag(url)
-            if verify.url_allowed(defragmented,self.root_domains,exclude=self.exclude): # Select Valid links, testing against regexp and root_domains
-                links.add(defragmented)
-        if urls:
+        """Return a list of the links not seen before, marking them seen."""
+        new_links, data = yield from self.process_page(
+            web_page_html, base_url, _content_type, _encoding, scrape=False)
+        return new_links
+
+    @asyncio.coroutine
+    def process_page(self, web_page_html, base_url, _content_type, _encoding,
+                     scrape=True, size=0):
+        """Parse a page once; return (new links, scraped data or None)."""
+        css_selectors = None
+        if scrape and self.scraper:
+            css_selectors = self.scraper.selectors_for(base_url) or None
+        if self.parse_executor is not None:
+            urls, data, timings = yield from self.loop.run_in_executor(
+                self.parse_executor, parsing.parse_page,
+                web_page_html, base_url, css_selectors, _encoding)
+        else:
+            urls, data, timings = parsing.parse_page(
+                web_page_html, base_url, css_selectors, _encoding)
+        self.metrics.observe('parse', timings['parse'])
+        if css_selectors is not None:
+            self.metrics.observe('scrape', timings['scrape'])
+        if scrape and self.scraper and css_selectors is None:
+            data = {'error': None}
+        # Select valid links, testing against exclude and root_domains.
+        links = set(self.url_filter.filter(
+            self.canonicalizer.canonicalize_all(urls)))
+        if self.page_cache is not None:
+            self.page_cache.parsed(base_url, links, data)
+        new_links = self.admit_links(base_url, links, size, _content_type,
+                                     _encoding)
+        return new_links, data
+
+    def reuse_page(self, url, content_type, encoding, size=0):
+        """Return (new links, data) of an unchanged page from the cache."""
+        cached = self.page_cache.get(url)
+        links = set(self.url_filter.filter(
+            self.canonicalizer.canonicalize_all(cached.links)))
+        new_links = self.admit_links(url, links, size, content_type, encoding,
+                                     unchanged=True)
+        return new_links, cached.data
+
+    def is_near_duplicate(self, web_page, url, content_type, encoding,
+                          size=0):
+        """Record and return True if the page nearly duplicates another."""
+        if self.near_duplicates is None:
+            return False
+        original = self.near_duplicates.check(web_page, url, encoding)
+        if original is None:
+            return False
+        LOGGER.info('%r is a near duplicate of %r', url, original)
+        if self.page_cache is not None:
+            # Stored without links, it stays skipped while unchanged.
+            self.page_cache.parsed(url, [], None)
+        self.record_statistic(url=url, size=size, content_type=content_type,
+                              encoding=encoding, duplicate_of=original)
+        return True
+
+    def admit_links(self, base_url, links, size, content_type, encoding,
+                    unchanged=False):
+        """Mark the links of a page seen, record it; return the new links."""
+        new_links = self.filter_unseen(links, parent=base_url)
+        if self.resolver is not None:
+            self.resolver.prefetch_urls(new_links)
+        if links:
             LOGGER.info('got %r urls from %r new links: %i visited: %i',
-                        len(urls), base_url,
-                        len(links - self.seen_urls), len(self.seen_urls))
-        new_links = [link for link in links.difference(self.seen_urls)]
+                        len(links), base_url,
+                        len(new_links), len(self.seen_urls))
 
         self.record_statistic(
             url=base_url,
-            content_type=_content_type,
-            encoding=_encoding,
+            size=size,
+            content_type=content_type,
+            encoding=encoding,
             num_urls=len(links),
-            num_new_urls=len(links - self.seen_urls))
+            num_new_urls=len(new_links),
+            unchanged=unchanged)
         return new_links
 
     def handle_redirect(self, response, url, max_redirect):
         location = response.headers['location']
-        next_url = urllib.parse.urljoin(url, location)
+        next_url = self.canonicalizer.canonicalize(
+            urllib.parse.urljoin(url, location))
         self.record_statistic(url=url,
                               next_url=next_url,
                               status=response.status)
@@ -156,99 +393,373 @@ class Crawler(object):
         if max_redirect > 0:
             LOGGER.info('redirect to %r from %r max_redir: %i', 
                         next_url, url, max_redirect - 1)
-            self.add_urls(next_url, max_redirect - 1)
+            self.add_urls(next_url, max_redirect - 1, parent=url)
         else:
             LOGGER.error('redirect limit reached for %r from %r',
                          next_url, url)
         return
 
     @asyncio.coroutine
-    def fetch(self, url, max_redirect, sem):
-        """Fetch one URL."""
-        tries = 0
+    def read_body(self, response):
+        """Read a response body in chunks; return (body, size).
+
+        body is None when the body is larger than max_body_size, in which
+        case reading stops as soon as that is known and size is the number
+        of bytes read so far.
+        """
+        length = response.headers.get('content-length')
+        if length and length.isdigit() and int(length) > self.max_body_size:
+            return None, 0
+        chunks = []
+        size = 0
+        while True:
+            chunk = yield from response.content.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > self.max_body_size:
+                return None, size
+            chunks.append(chunk)
+        return b''.join(chunks), size
+
+    @asyncio.coroutine
+    def fetch(self, url, max_redirect, tries=0):
+        """Fetch one URL, as try number tries.
+
+        Return (web_page, url, content_type, encoding, size).  Only HTML
+        and XML bodies are downloaded; other responses are dropped
+        without reading their body.  web_page is the body as bytes: it
+        is not decoded here but parsed in encoding, the charset of the
+        Content-Type header or else the one the page declares.  A failed
+        try is put back on the queue with retry() instead of being
+        waited for here, and web_page is RETRYING.
+        """
         web_page = None
-        exception = None
         _url = None
         _encoding = None
         _content_type = None
-        sleep_time = 0
-        while tries < self.max_tries:
-            try:
-                with (yield from sem):
-                    response = yield from asyncio.wait_for(
-                        self.session.get(url, allow_redirects=False), 10,loop=self.loop)
-                if tries > 1:
-                    LOGGER.debug('try %r for %r success', tries, url)
-                break
-            except Exception as client_error:
-                sleep_time += 5
-                yield from asyncio.sleep(sleep_time)
-                LOGGER.error('try %r for %r raised %r', tries, url, client_error)
-                exception = client_error
-            tries += 1
-        else:
-            # We never broke out of the loop: all tries failed.
-            LOGGER.error('%r failed after %r tries',
-                         url, self.max_tries)
-            self.record_statistic(url=url, exception=exception)
-            return (web_page, _url, _content_type, _encoding)
+        size = 0
+        cached = headers = None
+        if self.robots is not None:
+            allowed = yield from self.robots_allow(url, max_redirect, tries)
+            if allowed is not True:
+                if allowed is RETRYING:
+                    web_page = RETRYING
+                return (web_page, _url, _content_type, _encoding, size)
+        if self.page_cache is not None:
+            cached = self.page_cache.get(url)
+            if cached is not None:
+                headers = cached.conditional_headers()
+        t0 = time.monotonic()
+        try:
+            response = yield from asyncio.wait_for(
+                self.session.get(url, allow_redirects=False, headers=headers),
+                self.timeout, loop=self.loop)
+            self.metrics.observe('ttfb', time.monotonic() - t0)
+            if tries > 1:
+                LOGGER.debug('try %r for %r success', tries, url)
+        except Exception as client_error:
+            LOGGER.error('try %r for %r raised %r', tries, url, client_error)
+            self.adapt(url, error=client_error)
+            if self.retry(url, max_redirect, tries, exception=client_error):
+                web_page = RETRYING
+            else:
+                self.record_statistic(url=url, exception=client_error)
+            return (web_page, _url, _content_type, _encoding, size)
+        self.adapt(url, latency=time.monotonic() - t0, status=response.status)
+        if self.retry_policy.retry_status(response.status):
+            retry_after = parse_retry_after(response.headers.get('retry-after'))
+            if self.retry(url, max_redirect, tries, status=response.status,
+                          retry_after=retry_after):
+                response.close()
+                return (RETRYING, _url, _content_type, _encoding, size)
+        drain = False
         try:
-            _url, _content_type, _encoding = get_content_type_and_encoding(response)
+            _url, _content_type, declared = get_content_type_and_encoding(
+                response, default=None)
+            _encoding = declared or 'utf-8'
             if is_redirect(response):
                 self.handle_redirect(response, url, max_redirect)
                 web_page = 'redirect'
+                drain = True
+            elif response.status == 304 and cached is not None:
+                self.page_cache.unchanged(url, response.headers.get('etag'),
+                                          response.headers.get('last-modified'))
+                _url, _content_type, _encoding = (url, cached.content_type,
+                                                  cached.encoding)
+                web_page = NOT_MODIFIED
+                drain = True
             elif response.status == 200 and _content_type in ('text/html', 'application/xml'):
-                web_page = yield from response.text()
+                t0 = time.monotonic()
+                body, size = yield from self.read_body(response)
+                self.metrics.observe('body', time.monotonic() - t0)
+                if body is None:
+                    LOGGER.warning('%r is larger than %i bytes, dropped',
+                                   url, self.max_body_size)
+                    self.record_statistic(url=response.url, status=response.status,
+                                          exception=BodyTooLarge(self.max_body_size),
+                                          size=size, content_type=_content_type,
+                                          encoding=_encoding)
+                else:
+                    drain = True
+                    _encoding = parsing.detect_encoding(body, declared)
+                    digest = pagecache.content_hash(body)
+                    self.canonicalizer.observe(url, digest)
+                    if self.page_cache is not None:
+                        web_page = self.check_page_cache(
+                            url, _url, cached, response, digest,
+                            _content_type, _encoding)
+                        if web_page is NOT_MODIFIED:
+                            _url = url
+                    if web_page is None:
+                        web_page = body
             else:
-                self.record_statistic(url=response.url, status=response.status, 
-                                      content_type=_content_type, encoding=_encoding)
+                # The body is not read: its size is the one announced.
+                # Keep the connection only if the body is small to drain.
+                length = response.headers.get('content-length')
+                if length and length.isdigit():
+                    size = int(length)
+                drain = bool(length and length.isdigit() and
+                             size <= CHUNK_SIZE)
+                self.record_statistic(url=response.url, status=response.status,
+                                      size=size, content_type=_content_type,
+                                      encoding=_encoding)
         except Exception as e:
-            print('*******error**********')
+            LOGGER.error('reading %r raised %r', url, e)
+            self.record_statistic(url=url, exception=e)
+            web_page = None
         finally:
-            yield from response.release()
-        return (web_page, _url, _content_type, _encoding)
+            if drain:
+                yield from response.release()
+            else:
+                response.close()
+        return (web_page, _url, _content_type, _encoding, size)
+
+    def adapt(self, url, latency=None, status=None, error=None):
+        """Feed the outcome of a fetch to the concurrency controller."""
+        if self.concurrency is None:
+            return
+        host = scheduler.url_host(url)
+        self.q.set_limit(host, self.concurrency.observe(host, latency,
+                                                        status, error))
+
+    @asyncio.coroutine
+    def robots_allow(self, url, max_redirect, tries):
+        """Fetch the robots.txt of url's host if needed; apply its rules.
+
+        Return True if url may be fetched.  A disallowed URL is recorded
+        and False returned.  While the robots.txt cannot be fetched the
+        URL is put back on the queue, with the same number of tries, for
+        the robots.txt to be fetched again after error_ttl seconds, and
+        RETRYING returned; the URL is given up when the robots cache has.
+        """
+        rules = yield from self.robots.rules(url, self.session)
+        if rules.unavailable:
+            if not self.robots.gave_up(url):
+                LOGGER.info('robots.txt of %r unavailable, retrying in '
+                            '%.0f secs', url, self.robots.error_ttl)
+                self.q.put_later((url, max_redirect, tries),
+                                 self.robots.error_ttl)
+                return RETRYING
+            LOGGER.error('%r dropped: robots.txt unavailable after %r '
+                         'tries', url, self.robots.max_failures)
+            self.record_statistic(url=url,
+                                  exception=robots.RobotsUnavailable(url))
+            return False
+        delay = self.robots.crawl_delay(rules)
+        if delay is not None:
+            self.q.set_delay(scheduler.url_host(url), delay)
+        if self.robots.allowed(url):
+            return True
+        LOGGER.info('%r disallowed by robots.txt', url)
+        self.robots.disallowed += 1
+        self.record_statistic(url=url, robots_disallowed=True)
+        return False
+
+    def check_page_cache(self, url, response_url, cached, response, digest,
+                         content_type, encoding):
+        """Return NOT_MODIFIED if digest is that of the cached page of url.
+
+        Otherwise the validators of the response are kept for process_page
+        and None is returned.
+        """
+        etag = response.headers.get('etag')
+        last_modified = response.headers.get('last-modified')
+        if cached is not None and cached.digest == digest:
+            self.page_cache.unchanged(url, etag, last_modified)
+            return NOT_MODIFIED
+        self.page_cache.fetched(response_url, etag, last_modified, digest,
+                                content_type, encoding)
+        return None
+
+    def retry(self, url, max_redirect, tries, status=None, exception=None,
+              retry_after=None):
+        """Queue try number tries + 1 of url after a backoff delay.
+
+        Return False, after logging it, when the url is out of tries.
+        """
+        if tries + 1 >= self.max_tries:
+            LOGGER.error('%r failed after %r tries',
+                         url, self.max_tries)
+            return False
+        delay = self.retry_policy.delay(tries, status=status,
+                                        exception=exception,
+                                        retry_after=retry_after)
+        LOGGER.debug('retrying %r in %.3f secs', url, delay)
+        self.q.put_later((url, max_redirect, tries + 1), delay)
+        return True
 
-    def add_urls(self, urls, max_redirect=None):
-        """Add a URL to the queue if not seen before."""
+    def filter_unseen(self, urls, max_redirect=None, parent=None,
+                      lastmod=None):
+        """Return the URLs not seen before and mark them seen.
+
+        With a frontier they are also stored there as pending; parent is
+        the URL of the page they were found on and lastmod maps URLs to
+        their last modification time, which a
+        frontier.PriorityFrontier ranks them by.  With a
+        shard, URLs of hosts other shards own are forwarded to them
+        instead.
+        """
+        if self.shard is not None:
+            urls = self.shard.keep_own(urls, max_redirect)
+        if self.frontier is not None:
+            if max_redirect is None:
+                max_redirect = self.max_redirect
+            return self.frontier.filter_unseen(urls, max_redirect,
+                                               parent=parent, lastmod=lastmod)
+        return self.seen_urls.filter_unseen(urls)
+
+    def schedule(self, urls, max_redirect=None):
+        """Queue URLs that filter_unseen() returned."""
+        if self.frontier is not None:
+            self.fill_queue()
+            return
         if max_redirect is None:
             max_redirect = self.max_redirect
-        if not isinstance(urls, str):
-            urls = set(urls)
-            for link in urls.difference(self.seen_urls):
-                self.q.put_nowait((link, max_redirect))
-            self.seen_urls.update(urls)
-        elif urls not in self.seen_urls: 
-            self.q.put_nowait((urls, max_redirect))
-            self.seen_urls.add(urls)
+        for url in urls:
+            self.q.put_nowait((url, max_redirect, 0))
+
+    def add_urls(self, urls, max_redirect=None, parent=None, lastmod=None):
+        """Add a URL to the queue if not seen before.
+
+        lastmod, if given, maps canonical URLs to their last modification
+        time (a POSIX timestamp).
+        """
+        if isinstance(urls, str):
+            urls = [urls]
+        urls = [self.canonicalizer.canonicalize(url) for url in urls]
+        self.schedule(self.filter_unseen(urls, max_redirect, parent, lastmod),
+                      max_redirect)
+
+    def add_sitemap_urls(self, entries):
+        """Add the allowed URLs of (url, lastmod) pairs, newest first."""
+        lastmod = {}
+        for url, modified in entries:
+            lastmod[self.canonicalizer.canonicalize(url)] = modified
+        urls = sorted(self.url_filter.filter(lastmod),
+                      key=lambda url: -(lastmod[url] or 0))
+        self.add_urls(urls, lastmod={url: lastmod[url] for url in urls
+                                     if lastmod[url] is not None})
 
     @asyncio.coroutine
-    def work(self,sem):
+    def seed_sitemaps(self):
+        """Add the URLs of the sitemaps of the roots' sites.
+
+        With a shard, only the sites the shard owns are seeded.
+        """
+        for root in self.roots:
+            if self.shard is not None and not self.shard.owns(root):
+                continue
+            try:
+                yield from self.sitemaps.seed(root, self.session,
+                                              self.add_sitemap_urls,
+                                              self.robots)
+            except Exception as e:
+                LOGGER.error('seeding from the sitemaps of %r failed: %r',
+                             root, e)
+
+    def fill_queue(self):
+        """Move pending URLs from the frontier into the in-memory queue."""
+        if self.q.qsize() > self.frontier_buffer // 2:
+            return
+        for url, max_redirect in self.frontier.take(
+                self.frontier_buffer - self.q.qsize()):
+            self.q.put_nowait((url, max_redirect, 0))
+
+    def frontier_busy(self):
+        """True while a shared frontier has URLs pending or leased.
+
+        Only a frontier shared between nodes (one with leased()) can get
+        URLs once this crawler's queue is empty.  Its own leases are
+        acknowledged first, so they do not count.
+        """
+        leased = getattr(self.frontier, 'leased', None)
+        if leased is None:
+            return False
+        self.frontier.checkpoint()
+        return bool(self.frontier.pending() or leased())
+
+    @asyncio.coroutine
+    def work(self):
         """Process queue items forever."""
         try:
             while True:
-                url, max_redirect = yield from self.q.get()
+                queued_url, max_redirect, tries = yield from self.q.get()
+                data = None
                 #assert url in self.seen_urls
-                web_page,url,content_type,encoding = yield from self.fetch(url, max_redirect, sem)
+                self.metrics.in_flight += 1
+                try:
+                    web_page,url,content_type,encoding,size = yield from self.fetch(queued_url, max_redirect, tries)
+                finally:
+                    self.metrics.in_flight -= 1
+                    self.q.release(queued_url)
+                # A URL put back for another try is not done yet.
+                retrying = web_page is RETRYING
+                if retrying:
+                    web_page = None
+                if web_page is NOT_MODIFIED:
+                    new_links, data = self.reuse_page(url, content_type,
+                                                      encoding, size=size)
+                elif web_page and web_page != 'redirect':
+                    if self.is_near_duplicate(web_page, url, content_type,
+                                              encoding, size):
+                        web_page = None
+                    else:
+                        new_links, data = yield from self.process_page(web_page,url,content_type,encoding,size=size)
                 if web_page and web_page != 'redirect':
-                    new_links = yield from self.parse_links(web_page,url,content_type,encoding)
-                    if self.scraper:
-                        data = self.scraper.scrape(url,web_page)
-                    if self.data_handler:
-                        self.data_handler.handle(data)
-                    self.add_urls(new_links)
+                    self.metrics.pages += 1
+                    if self.data_handler and has_data(data):
+                        try:
+                            yield from self.data_handler.handle(
+                                self.root_for(url), url, data)
+                        except Exception as e:
+                            LOGGER.error('handling data of %r failed: %r', url, e)
+                    self.schedule(new_links)
+                if self.frontier is not None:
+                    if not retrying:
+                        self.frontier.done(queued_url, data)
+                    self.fill_queue()
                 self.q.task_done()
         except (asyncio.CancelledError,):
             print('error')
 
     @asyncio.coroutine
     def crawl(self):
-        sem = asyncio.Semaphore(value=self.max_connections_per_host,loop=self.loop)
         """Run the crawler until all finished."""
         LOGGER.info('Starting crawl...')
-        workers = [asyncio.Task(self.work(sem), loop=self.loop)
+        workers = [asyncio.Task(self.work(), loop=self.loop)
                    for _ in range(self.max_tasks)]
         self.t0 = time.time()
-        yield from self.q.join()
+        if self.sitemaps is not None:
+            yield from self.seed_sitemaps()
+        if self.shard is not None:
+            yield from self.shard.run(self)
+        else:
+            yield from self.q.join()
+            while self.frontier_busy():
+                yield from asyncio.sleep(self.frontier_poll, loop=self.loop)
+                self.fill_queue()
+                yield from self.q.join()
         self.t1 = time.time()
         for w in workers:
             w.cancel()
@@ -0,0 +1,216 @@
+#
+# Caching DNS resolver for the crawler's ClientSession
+#
+import asyncio
+import collections
+import logging
+import socket
+import time
+import urllib.parse
+from aiohttp.abc import AbstractResolver
+from aiohttp.resolver import DefaultResolver
+try:
+    import aiodns
+except ImportError:
+    aiodns = None
+
+LOGGER = logging.getLogger(__name__)
+
+
+class TtlResolver(AbstractResolver):
+    """aiodns resolver that also returns the record TTLs ('ttl' keys)."""
+
+    def __init__(self, loop=None):
+        self._loop = loop or asyncio.get_event_loop()
+        self._resolver = aiodns.DNSResolver(loop=self._loop)
+
+    @asyncio.coroutine
+    def resolve(self, host, port=0, family=socket.AF_INET):
+        qtype = 'AAAA' if family == socket.AF_INET6 else 'A'
+        try:
+            records = yield from self._resolver.query(host, qtype)
+        except aiodns.error.DNSError as e:
+            raise OSError(*e.args)
+        return [{'hostname': host,
+                 'host': record.host, 'port': port,
+                 'family': socket.AF_INET6 if qtype == 'AAAA'
+                 else socket.AF_INET,
+                 'proto': 0,
+                 'flags': socket.AI_NUMERICHOST,
+                 'ttl': getattr(record, 'ttl', None)}
+                for record in records]
+
+    @asyncio.coroutine
+    def close(self):
+        self._resolver.cancel()
+
+
+def default_resolver(loop=None):
+    """A TtlResolver if aiodns is installed, else aiohttp's getaddrinfo one."""
+    if aiodns is not None:
+        return TtlResolver(loop=loop)
+    return DefaultResolver(loop=loop)
+
+
+def url_address(url):
+    """Return the (host, port) a connection to url goes to, or None."""
+    parts = urllib.parse.urlparse(url)
+    if parts.scheme not in ('http', 'https') or not parts.hostname:
+        return None
+    try:
+        port = parts.port
+    except ValueError:
+        return None
+    return parts.hostname, port or (443 if parts.scheme == 'https' else 80)
+
+
+class CachingResolver(AbstractResolver):
+    """Resolver caching the answers (and failures) of another resolver.
+
+    Answers are kept for the smallest 'ttl' of their records, capped at
+    max_ttl, or for max_ttl when the records carry no TTL (getaddrinfo
+    does not tell).  Failed lookups are cached for negative_ttl so a
+    dead host does not cost a lookup per URL.  Concurrent lookups of the
+    same name share one query, and at most max_size names are cached,
+    least recently used first out.
+
+    prefetch() starts a background lookup, so the names of newly found
+    hosts are usually resolved by the time their first URL is fetched.
+    hits, misses, negative_hits and prefetches count what happened.
+    """
+
+    def __init__(self, resolver=None, max_ttl=300.0, negative_ttl=30.0,
+                 max_size=10000, max_prefetch=10, family=0, *, loop=None):
+        self.loop = loop or asyncio.get_event_loop()
+        self.resolver = resolver or default_resolver(loop=self.loop)
+        self.max_ttl = max_ttl
+        self.negative_ttl = negative_ttl
+        self.max_size = max_size
+        self.family = family
+        self.cache = collections.OrderedDict()
+        self.pending = {}
+        self._prefetching = {}
+        self._prefetch_slots = asyncio.Semaphore(max_prefetch, loop=self.loop)
+        self.hits = 0
+        self.misses = 0
+        self.negative_hits = 0
+        self.prefetches = 0
+
+    def _cached(self, key):
+        """Return the live cache entry (expires, hosts, error) of key."""
+        entry = self.cache.get(key)
+        if entry is None:
+            return None
+        if entry[0] <= time.monotonic():
+            del self.cache[key]
+            return None
+        self.cache.move_to_end(key)
+        return entry
+
+    def _store(self, key, hosts, error):
+        if error is not None:
+            ttl = self.negative_ttl
+        else:
+            ttls = [h['ttl'] for h in hosts if h.get('ttl') is not None]
+            ttl = min([self.max_ttl] + ttls)
+        if ttl > 0:
+            self.cache[key] = (time.monotonic() + ttl, hosts, error)
+            self.cache.move_to_end(key)
+            if len(self.cache) > self.max_size:
+                self.cache.popitem(last=False)
+
+    @asyncio.coroutine
+    def _lookup(self, key):
+        # The query runs in a task of its own that every caller waits on
+        # through shield(): a caller cancelled (e.g. by a fetch timeout)
+        # neither cancels the query of the others nor leaves it pending.
+        task = self.pending.get(key)
+        if task is None:
+            task = self.pending[key] = asyncio.Task(self._query(key),
+                                                    loop=self.loop)
+        return (yield from asyncio.shield(task, loop=self.loop))
+
+    @asyncio.coroutine
+    def _query(self, key):
+        host, port, family = key
+        try:
+            hosts = yield from self.resolver.resolve(host, port,
+                                                     family=family)
+        except OSError as e:
+            self._store(key, None, e)
+            return None, e
+        finally:
+            del self.pending[key]
+        self._store(key, hosts, None)
+        return hosts, None
+
+    @asyncio.coroutine
+    def resolve(self, host, port=0, family=socket.AF_INET):
+        key = (host, port, family)
+        entry = self._cached(key)
+        if entry is not None:
+            _, hosts, error = entry
+            if error is not None:
+                self.negative_hits += 1
+                raise error
+            self.hits += 1
+            return hosts
+        self.misses += 1
+        hosts, error = yield from self._lookup(key)
+        if error is not None:
+            raise error
+        return hosts
+
+    def prefetch(self, host, port):
+        """Resolve host in the background unless it is cached or pending."""
+        key = (host, port, self.family)
+        if (key in self._prefetching or key in self.pending or
+                self._cached(key) is not None):
+            return
+        self.prefetches += 1
+        task = self._prefetching[key] = asyncio.Task(self._prefetch(key),
+                                                     loop=self.loop)
+        task.add_done_callback(lambda task: self._prefetching.pop(key, None))
+
+    @asyncio.coroutine
+    def _prefetch(self, key):
+        with (yield from self._prefetch_slots):
+            if self._cached(key) is not None:
+                return
+            try:
+                yield from self._lookup(key)
+            except Exception as e:
+                LOGGER.debug('prefetching %r failed: %r', key[0], e)
+
+    def prefetch_urls(self, urls):
+        """prefetch() the address of every URL."""
+        for address in {url_address(url) for url in urls}:
+            if address is not None:
+                self.prefetch(*address)
+
+    def hit_rate(self):
+        lookups = self.hits + self.negative_hits + self.misses
+        return (self.hits + self.negative_hits) / lookups if lookups else 0.0
+
+    def report(self, file=None):
+        print('DNS cache: %d hits, %d negative hits, %d misses '
+              '(%.1f%% hit rate), %d prefetched, %d cached' %
+              (self.hits, self.negative_hits, self.misses,
+               100 * self.hit_rate(), self.prefetches, len(self.cache)),
+              file=file)
+
+    def cancel(self):
+        """Cancel the prefetches in progress."""
+        for task in list(self._prefetching.values()):
+            task.cancel()
+
+    @asyncio.coroutine
+    def close(self):
+        self.cancel()
+        tasks = list(self._prefetching.values())
+        for task in self.pending.values():
+            task.cancel()
+            tasks.append(task)
+        if tasks:
+            yield from asyncio.wait(tasks, loop=self.loop)
+        yield from self.resolver.close()
@@ -0,0 +1,316 @@
+#
+# Crawl frontiers: disk-backed, and in-memory by priority
+#
+import heapq
+import logging
+import os
+import re
+import sqlite3
+import time
+import urllib.parse
+try:
+    import app.seen as seen
+except ImportError:
+    import seen
+
+LOGGER = logging.getLogger(__name__)
+
+PENDING, SCHEDULED, DONE = 0, 1, 2
+
+
+class SqliteFrontier(object):
+    """Persistent frontier and seen-store kept in an SQLite WAL database.
+
+    Every URL ever discovered has one row, so the table doubles as the
+    seen-store.  A row is PENDING while it only lives on disk, SCHEDULED
+    once it was handed to the crawler's in-memory queue and DONE once it
+    was fetched.  Writes are grouped in transactions that are committed
+    by checkpoint(), either explicitly or every checkpoint_ops writes /
+    checkpoint_interval seconds.
+
+    When resume is true an existing database is reopened and the URLs
+    that were scheduled but not done when the previous run stopped are
+    made pending again; otherwise any existing database is discarded.
+    """
+
+    def __init__(self, path, resume=False,
+                 checkpoint_interval=30.0, checkpoint_ops=10000):
+        if not resume:
+            for suffix in ('', '-wal', '-shm'):
+                if os.path.exists(path + suffix):
+                    os.remove(path + suffix)
+        self.path = path
+        self.checkpoint_interval = checkpoint_interval
+        self.checkpoint_ops = checkpoint_ops
+        self.db = sqlite3.connect(path)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS urls ('
+                        'url TEXT PRIMARY KEY, '
+                        'max_redirect INTEGER, '
+                        'state INTEGER)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS urls_state '
+                        'ON urls (state)')
+        reset = self.db.execute('UPDATE urls SET state=? WHERE state=?',
+                                (PENDING, SCHEDULED)).rowcount
+        self._pending = self.db.execute(
+            'SELECT COUNT(*) FROM urls WHERE state=?',
+            (PENDING,)).fetchone()[0]
+        self._count = self.db.execute(
+            'SELECT COUNT(*) FROM urls').fetchone()[0]
+        self.db.commit()
+        if resume:
+            LOGGER.info('resuming %r: %i pending urls (%i rescheduled)',
+                        path, self._pending, reset)
+        self._ops = 0
+        self._last_checkpoint = time.time()
+
+    def __contains__(self, url):
+        return self.db.execute('SELECT 1 FROM urls WHERE url=?',
+                               (url,)).fetchone() is not None
+
+    def __len__(self):
+        return self._count
+
+    def pending(self):
+        """Number of URLs waiting on disk."""
+        return self._pending
+
+    def filter_unseen(self, urls, max_redirect=None, parent=None,
+                      lastmod=None):
+        """Store the URLs not seen before as pending and return them.
+
+        parent, the page the URLs were found on, and lastmod are not used.
+        """
+        new_urls = []
+        for url in urls:
+            cursor = self.db.execute(
+                'INSERT OR IGNORE INTO urls (url, max_redirect, state) '
+                'VALUES (?, ?, ?)', (url, max_redirect, PENDING))
+            if cursor.rowcount == 1:
+                new_urls.append(url)
+        self._pending += len(new_urls)
+        self._count += len(new_urls)
+        self._written(len(new_urls))
+        return new_urls
+
+    def take(self, n):
+        """Mark up to n pending URLs scheduled and return (url, max_redirect)."""
+        if n <= 0 or not self._pending:
+            return []
+        rows = self.db.execute(
+            'SELECT rowid, url, max_redirect FROM urls WHERE state=? '
+            'ORDER BY rowid LIMIT ?', (PENDING, n)).fetchall()
+        self.db.executemany('UPDATE urls SET state=? WHERE rowid=?',
+                            [(SCHEDULED, row[0]) for row in rows])
+        self._pending -= len(rows)
+        self._written(len(rows))
+        return [(url, max_redirect) for _, url, max_redirect in rows]
+
+    def done(self, url, data=None):
+        """Mark a URL fetched so a resumed crawl will not fetch it again."""
+        self.db.execute('UPDATE urls SET state=? WHERE url=?', (DONE, url))
+        self._written(1)
+
+    def _written(self, count):
+        self._ops += count
+        if (self._ops >= self.checkpoint_ops or
+                time.time() - self._last_checkpoint >= self.checkpoint_interval):
+            self.checkpoint()
+
+    def checkpoint(self):
+        """Commit pending writes and fold the WAL back into the database."""
+        self.db.commit()
+        self.db.execute('PRAGMA wal_checkpoint(PASSIVE)')
+        self._ops = 0
+        self._last_checkpoint = time.time()
+
+    def close(self):
+        self.checkpoint()
+        self.db.close()
+
+
+def has_data(data):
+    """True if scraped data (see Scraper.get_data) found anything."""
+    return bool(data) and any(value for key, value in data.items()
+                              if key != 'error')
+
+
+class UrlScorer(object):
+    """Rank URLs by how likely they are to lead to scraped data.
+
+    The score of a URL found at link depth depth is
+
+        - depth_weight * depth
+        + pattern_weight * (matches of good_patterns - matches of bad_patterns)
+        + feedback_weight * (2 * yield - 1)
+        + freshness_weight * 2 ** (-age / half_life)
+
+    where yield is the share of pages fetched under the same path prefix
+    (first one or two path segments, the longer one once it has
+    min_samples pages) that had scraped data, smoothed to 0.5 for
+    prefixes not seen yet.  feedback() records those outcomes.  The
+    last term only counts for URLs whose last modification time is
+    known (e.g. from a sitemap): age and half_life are in seconds.
+    """
+
+    GOOD_PATTERNS = (r'/(products?|produits?|items?|articles?|p)/',
+                     r'\.html?$',
+                     r'[-_/]\d{3,}(\.html?)?$')
+    BAD_PATTERNS = (r'/(cart|panier|basket|login|account|compte|checkout|'
+                    r'search|recherche|contact|cgv|terms)\b',
+                    r'[?&](sort|order|orderby|dir|limit|filter)=')
+
+    def __init__(self, good_patterns=None, bad_patterns=None,
+                 depth_weight=1.0, pattern_weight=2.0, feedback_weight=4.0,
+                 min_samples=3, freshness_weight=2.0,
+                 half_life=30 * 24 * 3600.0):
+        if good_patterns is None:
+            good_patterns = self.GOOD_PATTERNS
+        if bad_patterns is None:
+            bad_patterns = self.BAD_PATTERNS
+        self.good_patterns = [re.compile(p, re.I) for p in good_patterns]
+        self.bad_patterns = [re.compile(p, re.I) for p in bad_patterns]
+        self.depth_weight = depth_weight
+        self.pattern_weight = pattern_weight
+        self.feedback_weight = feedback_weight
+        self.min_samples = min_samples
+        self.freshness_weight = freshness_weight
+        self.half_life = half_life
+        # prefix -> [pages, pages with data]
+        self.prefixes = {}
+
+    @staticmethod
+    def _prefixes(url):
+        segments = urllib.parse.urlparse(url).path.split('/')[1:-1]
+        netloc = urllib.parse.urlparse(url).netloc.lower()
+        return [netloc + '/' + '/'.join(segments[:n]) for n in (1, 2)
+                if len(segments) >= n]
+
+    def feedback(self, url, useful):
+        """Record whether the page at url had scraped data."""
+        for prefix in self._prefixes(url):
+            counts = self.prefixes.setdefault(prefix, [0, 0])
+            counts[0] += 1
+            if useful:
+                counts[1] += 1
+
+    def yield_rate(self, url):
+        """Smoothed share of pages with data under url's path prefix."""
+        for prefix in reversed(self._prefixes(url)):
+            counts = self.prefixes.get(prefix)
+            if counts is not None and counts[0] >= self.min_samples:
+                return (counts[1] + 1) / (counts[0] + 2)
+        return 0.5
+
+    def score(self, url, depth, lastmod=None):
+        patterns = (sum(1 for p in self.good_patterns if p.search(url)) -
+                    sum(1 for p in self.bad_patterns if p.search(url)))
+        score = (-self.depth_weight * depth +
+                 self.pattern_weight * patterns +
+                 self.feedback_weight * (2 * self.yield_rate(url) - 1))
+        if lastmod is not None:
+            age = max(0.0, time.time() - lastmod)
+            score += self.freshness_weight * 2 ** (-age / self.half_life)
+        return score
+
+
+class PriorityFrontier(object):
+    """In-memory frontier handing out the best scored URLs first.
+
+    URLs are scored by scorer (a UrlScorer) when they are found, at the
+    link depth of their parent plus one, and take() returns the best
+    ones.  At most max_size URLs are kept: past that, the lowest scored
+    one is evicted and will not be crawled (it stays in the seen_store).
+    done(url, data) feeds the scraped data of each page back to the
+    scorer, which affects the URLs scored after it.
+
+    Entries live on two heaps, by best and by worst score; an entry
+    taken from or evicted off one heap is marked dead and skipped when
+    reached on the other.
+    """
+
+    def __init__(self, scorer=None, max_size=100000, seen_store=None):
+        self.scorer = scorer or UrlScorer()
+        self.max_size = max_size
+        self.seen = seen_store if seen_store is not None else seen.FingerprintSet()
+        self._best = []
+        self._worst = []
+        self._seq = 0
+        self._live = 0
+        self.depths = {}
+        self.evicted = 0
+
+    def __contains__(self, url):
+        return url in self.seen
+
+    def __len__(self):
+        return len(self.seen)
+
+    def pending(self):
+        return self._live
+
+    def filter_unseen(self, urls, max_redirect=None, parent=None,
+                      lastmod=None):
+        """Score and keep the URLs not seen before; return them.
+
+        lastmod, if given, maps URLs to their last modification time.
+        """
+        new_urls = self.seen.filter_unseen(urls)
+        depth = self.depths.get(parent, -1) + 1 if parent else 0
+        lastmod = lastmod or {}
+        for url in new_urls:
+            self._push(self.scorer.score(url, depth, lastmod.get(url)), url,
+                       max_redirect, depth)
+        return new_urls
+
+    def _push(self, score, url, max_redirect, depth):
+        self._seq += 1
+        # [score, url, max_redirect, depth, alive]
+        entry = [score, url, max_redirect, depth, True]
+        heapq.heappush(self._best, (-score, self._seq, entry))
+        heapq.heappush(self._worst, (score, -self._seq, entry))
+        self._live += 1
+        if self._live > self.max_size:
+            self._evict()
+        if len(self._best) > 2 * self._live + 1024:
+            self._compact()
+
+    def _evict(self):
+        while self._worst:
+            entry = heapq.heappop(self._worst)[2]
+            if entry[4]:
+                entry[4] = False
+                self._live -= 1
+                self.evicted += 1
+                LOGGER.debug('evicted %r (score %.2f)', entry[1], entry[0])
+                return
+
+    def _compact(self):
+        self._best = [item for item in self._best if item[2][4]]
+        self._worst = [item for item in self._worst if item[2][4]]
+        heapq.heapify(self._best)
+        heapq.heapify(self._worst)
+
+    def take(self, n):
+        """Return up to n (url, max_redirect) pairs, best scored first."""
+        taken = []
+        while len(taken) < n and self._live:
+            entry = heapq.heappop(self._best)[2]
+            if not entry[4]:
+                continue
+            entry[4] = False
+            self._live -= 1
+            _, url, max_redirect, depth, _ = entry
+            self.depths[url] = depth
+            taken.append((url, max_redirect))
+        return taken
+
+    def done(self, url, data=None):
+        """Forget a fetched URL's depth and learn from its scraped data."""
+        self.depths.pop(url, None)
+        if data is not None:
+            self.scorer.feedback(url, has_data(data))
+
+    def close(self):
+        pass
@@ -0,0 +1,93 @@
+#
+# Link extraction from raw HTML, without building a tree
+#
+import html
+import re
+import urllib.parse
+
+# One pass over the page: comments, script and style elements are
+# skipped whole (links in them are not followed); the start tags of a,
+# base and link are captured with their attributes.  A quote only opens
+# a quoted value right after '=', as in title="x > y"; elsewhere it is
+# text, as in title=l'article.
+_TOKENS = re.compile(
+    rb'<!--.*?-->'
+    rb'|<(script|style)\b[^>]*>.*?</\1\s*>'
+    rb'|<(a|base|link)\s((?:=\s*"[^"]*"|=\s*\'[^\']*\'|=(?!\s*["\'])'
+    rb'|[^>=])*)>',
+    re.I | re.S)
+
+_ATTRIBUTES = re.compile(
+    rb'([^\s=/>"\']+)(?:\s*=\s*(?:"([^"]*)"|\'([^\']*)\'|([^\s>]+)))?')
+
+_WHITESPACE = ' \t\n\r\f'
+
+
+def _attributes(text):
+    """Map the lowercased names of the attributes of a tag to raw values."""
+    attributes = {}
+    for match in _ATTRIBUTES.finditer(text):
+        name, double, single, bare = match.groups()
+        name = name.lower()
+        if name not in attributes:
+            value = double if double is not None else single
+            if value is None:
+                value = bare if bare is not None else b''
+            attributes[name] = value
+    return attributes
+
+
+def _decode(value, encoding):
+    value = value.decode(encoding, 'replace').strip(_WHITESPACE)
+    if '&' in value:
+        value = html.unescape(value)
+    return value
+
+
+def iter_link_tags(page):
+    """Yield (tag, attributes) of the a, base and link tags of page (bytes).
+
+    tag is lowercased bytes; attributes holds the raw attribute values.
+    """
+    for match in _TOKENS.finditer(page):
+        tag = match.group(2)
+        if tag is not None:
+            yield tag.lower(), _attributes(match.group(3))
+
+
+def extract_links(page, base_url, encoding='utf-8'):
+    """Return the targets of <a href> and <link rel=next> of an HTML page.
+
+    page is the raw body (bytes in encoding, or str).  The links are
+    made absolute only once the whole page is scanned, against the
+    first <base href> if the page has one and base_url otherwise.
+    Unlike lxml's iterlinks() this skips images, scripts, stylesheets
+    and the like, which a crawler of pages does not want.
+    """
+    if isinstance(page, str):
+        page = page.encode('utf-8', 'surrogatepass')
+        encoding = 'utf-8'
+    base = None
+    hrefs = []
+    for tag, attributes in iter_link_tags(page):
+        href = attributes.get(b'href')
+        if href is None:
+            continue
+        if tag == b'a':
+            hrefs.append(href)
+        elif tag == b'link':
+            rel = attributes.get(b'rel', b'').lower().split()
+            if b'next' in rel:
+                hrefs.append(href)
+        elif base is None:
+            base = urllib.parse.urljoin(base_url, _decode(href, encoding))
+    if base is None:
+        base = base_url
+    links = []
+    for href in hrefs:
+        href = _decode(href, encoding)
+        if href.startswith(('http://', 'https://')):
+            links.append(href)
+        else:
+            links.append(urllib.parse.urljoin(base, href))
+    return links
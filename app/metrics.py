@@ -0,0 +1,154 @@
+#
+# Per-phase latency metrics and a Prometheus text endpoint
+#
+import asyncio
+import time
+import aiohttp
+from aiohttp import web
+try:
+    from app.reporting import Histogram, exponential_bounds
+except ImportError:
+    from reporting import Histogram, exponential_bounds
+
+# dns and connect come from aiohttp trace hooks, when aiohttp has them
+# (TraceConfig, aiohttp >= 3); otherwise they are part of ttfb.
+PHASES = ('dns', 'connect', 'ttfb', 'body', 'parse', 'scrape')
+
+# 1 ms to ~33 s.
+LATENCY_BOUNDS = exponential_bounds(0.001, 2, 16)
+
+
+class Metrics(object):
+    """Latency histograms per crawl phase plus a few live counters.
+
+    One instance may be shared by several crawlers.
+    """
+
+    def __init__(self):
+        self.latency = {phase: Histogram(LATENCY_BOUNDS) for phase in PHASES}
+        self.in_flight = 0
+        self.pages = 0
+        self.t0 = time.time()
+
+    def observe(self, phase, seconds):
+        self.latency[phase].add(seconds)
+
+    def pages_per_second(self):
+        dt = time.time() - self.t0
+        return self.pages / dt if dt else 0.0
+
+    def trace_config(self):
+        """Return an aiohttp TraceConfig timing dns and connect, or None."""
+        if not hasattr(aiohttp, 'TraceConfig'):
+            return None
+        trace_config = aiohttp.TraceConfig()
+
+        def start(name):
+            @asyncio.coroutine
+            def on_start(session, ctx, params):
+                setattr(ctx, name, time.monotonic())
+            return on_start
+
+        def end(name):
+            @asyncio.coroutine
+            def on_end(session, ctx, params):
+                t0 = getattr(ctx, name, None)
+                if t0 is not None:
+                    self.observe(name, time.monotonic() - t0)
+            return on_end
+
+        trace_config.on_dns_resolvehost_start.append(start('dns'))
+        trace_config.on_dns_resolvehost_end.append(end('dns'))
+        trace_config.on_connection_create_start.append(start('connect'))
+        trace_config.on_connection_create_end.append(end('connect'))
+        return trace_config
+
+    def session(self, loop, resolver=None):
+        """Create a ClientSession reporting to these metrics.
+
+        If resolver is given (e.g. a dnscache.CachingResolver) the
+        session's connector looks host names up with it, bypassing
+        aiohttp's own DNS cache.
+        """
+        kwargs = {}
+        if resolver is not None:
+            kwargs['connector'] = aiohttp.TCPConnector(
+                loop=loop, resolver=resolver, use_dns_cache=False)
+        trace_config = self.trace_config()
+        if trace_config is not None:
+            kwargs['trace_configs'] = [trace_config]
+        return aiohttp.ClientSession(loop=loop, **kwargs)
+
+
+def _format(value):
+    if value == float('inf'):
+        return '+Inf'
+    return '%g' % value
+
+
+def render(metrics, crawlers=()):
+    """Return metrics and the crawlers' queue state as Prometheus text."""
+    lines = ['# HELP crawler_phase_seconds Latency of each crawl phase.',
+             '# TYPE crawler_phase_seconds histogram']
+    for phase in PHASES:
+        histogram = metrics.latency[phase]
+        cumulative = 0
+        for bound, count in zip(histogram.bounds + [float('inf')],
+                                histogram.counts):
+            cumulative += count
+            lines.append('crawler_phase_seconds_bucket{phase="%s",le="%s"} %d'
+                         % (phase, _format(bound), cumulative))
+        lines.append('crawler_phase_seconds_sum{phase="%s"} %g'
+                     % (phase, histogram.sum))
+        lines.append('crawler_phase_seconds_count{phase="%s"} %d'
+                     % (phase, histogram.count))
+    crawlers = list(crawlers)
+    gauges = (
+        ('crawler_queue_depth', 'gauge', 'URLs waiting to be fetched.',
+         sum(crawler.q.qsize() for crawler in crawlers)),
+        ('crawler_in_flight', 'gauge', 'Fetches in progress.',
+         metrics.in_flight),
+        ('crawler_pages_total', 'counter', 'Pages fetched and parsed.',
+         metrics.pages),
+        ('crawler_pages_per_second', 'gauge', 'Average page rate.',
+         metrics.pages_per_second()),
+        ('crawler_crawls', 'gauge', 'Crawls running.', len(crawlers)),
+    )
+    for name, kind, help_text, value in gauges:
+        lines.append('# HELP %s %s' % (name, help_text))
+        lines.append('# TYPE %s %s' % (name, kind))
+        lines.append('%s %g' % (name, value))
+    limits = {}
+    for crawler in crawlers:
+        if crawler.concurrency is not None:
+            limits.update(crawler.concurrency.limits())
+    if limits:
+        lines.append('# HELP crawler_host_concurrency Concurrency limit '
+                     'of each host.')
+        lines.append('# TYPE crawler_host_concurrency gauge')
+        for host, limit in sorted(limits.items()):
+            lines.append('crawler_host_concurrency{host="%s"} %d'
+                         % (host.replace('\\', '\\\\').replace('"', '\\"'),
+                            limit))
+    return '\n'.join(lines) + '\n'
+
+
+@asyncio.coroutine
+def start_server(metrics, crawlers, host, port, *, loop=None):
+    """Serve render(metrics, crawlers) on http://host:port/metrics.
+
+    crawlers is read on every request, so it may be a set that changes
+    while the server runs.  Return the asyncio server.
+    """
+    loop = loop or asyncio.get_event_loop()
+
+    @asyncio.coroutine
+    def handler(request):
+        body = render(metrics, crawlers).encode('utf-8')
+        return web.Response(body=body, headers={
+            'CONTENT-TYPE': 'text/plain; version=0.0.4; charset=utf-8'})
+
+    app = web.Application(loop=loop)
+    app.router.add_route('GET', '/metrics', handler)
+    server = yield from loop.create_server(app.make_handler(), host, port)
+    return server
@@ -0,0 +1,119 @@
+#
+# Near-duplicate page detection with SimHash
+#
+import collections
+import hashlib
+import re
+
+_MARKUP = re.compile(r'<script.*?</script>|<style.*?</style>|<!--.*?-->|<[^>]*>',
+                     re.S | re.I)
+_WORD = re.compile(r'\w+')
+
+# Byte values with bit b set, for b in 0..7.
+_WITH_BIT = [[value for value in range(256) if value & (1 << bit)]
+             for bit in range(8)]
+
+
+def page_features(web_page, shingle=3):
+    """Count the shingles (runs of words) of the text of an HTML page.
+
+    Tags, comments, scripts and styles are dropped, so pages that differ
+    only in their links or markup (e.g. session parameters in every URL)
+    have the same features.
+    """
+    words = _WORD.findall(_MARKUP.sub(' ', web_page).lower())
+    return collections.Counter(' '.join(words[i:i + shingle])
+                               for i in range(len(words) - shingle + 1))
+
+
+def simhash(features):
+    """64-bit SimHash of a mapping of features to weights.
+
+    Bit i is set when the features whose (md5) hash has bit i set weigh
+    more than half the total.  Rather than adding every feature's weight
+    to 64 counters, weights are added per byte value for each of the 8
+    bytes of the hash, and the 64 sums are taken from those tables.
+    """
+    tables = [[0] * 256 for _ in range(8)]
+    total = 0
+    for feature, weight in features.items():
+        digest = hashlib.md5(feature.encode('utf-8')).digest()
+        for table, byte in zip(tables, digest[:8]):
+            table[byte] += weight
+        total += weight
+    value = 0
+    for i, table in enumerate(tables):
+        for bit, with_bit in enumerate(_WITH_BIT):
+            if 2 * sum(table[byte] for byte in with_bit) > total:
+                value |= 1 << (8 * i + bit)
+    return value
+
+
+def distance(a, b):
+    """Number of bits that differ between two fingerprints."""
+    return bin(a ^ b).count('1')
+
+
+class SimHashIndex(object):
+    """Find pages whose SimHash is within max_distance bits of a known one.
+
+    The 64 bits are cut into max_distance + 1 bands; two fingerprints
+    that differ in at most max_distance bits are equal on at least one
+    band, so only the fingerprints sharing a band with the page are
+    compared.  Pages with fewer than min_features shingles have too
+    little text to compare and are never reported as duplicates.
+
+    max_distance is the similarity threshold: 0 only matches pages with
+    the same text, and a few bits (3 is a usual choice) also match pages
+    differing by some words.  Product pages sharing most of a template
+    get close as it grows, so keep it small.
+    """
+
+    def __init__(self, max_distance=3, min_features=8, shingle=3):
+        if not 0 <= max_distance < 16:
+            raise ValueError('max_distance must be in 0..15')
+        self.max_distance = max_distance
+        self.min_features = min_features
+        self.shingle = shingle
+        bands = max_distance + 1
+        width = 64 // bands
+        self.bands = []
+        for i in range(bands):
+            shift = i * width
+            bits = width if i < bands - 1 else 64 - shift
+            self.bands.append((shift, (1 << bits) - 1))
+        self.tables = [{} for _ in self.bands]
+        self.pages = 0
+        self.duplicates = 0
+
+    def find(self, value):
+        """Return the URL of a page near fingerprint value, or None."""
+        for (shift, mask), table in zip(self.bands, self.tables):
+            for other, url in table.get((value >> shift) & mask, ()):
+                if distance(value, other) <= self.max_distance:
+                    return url
+        return None
+
+    def add(self, value, url):
+        for (shift, mask), table in zip(self.bands, self.tables):
+            table.setdefault((value >> shift) & mask, []).append((value, url))
+        self.pages += 1
+
+    def check(self, web_page, url, encoding='utf-8'):
+        """Return the URL of a known page near web_page, or None.
+
+        web_page is the page text, or its bytes in encoding.  A page
+        that is not a near duplicate is added to the index.
+        """
+        if isinstance(web_page, bytes):
+            web_page = web_page.decode(encoding, 'replace')
+        features = page_features(web_page, self.shingle)
+        if len(features) < self.min_features:
+            return None
+        value = simhash(features)
+        original = self.find(value)
+        if original is not None:
+            self.duplicates += 1
+            return original
+        self.add(value, url)
+        return None
@@ -0,0 +1,139 @@
+#
+# Validators, links and data of fetched pages, for incremental re-crawls
+#
+import hashlib
+import json
+import logging
+import sqlite3
+import time
+
+LOGGER = logging.getLogger(__name__)
+
+
+def content_hash(body):
+    """Digest of a page body (bytes)."""
+    return hashlib.md5(body).hexdigest()
+
+
+class CachedPage(object):
+    """What a previous crawl learnt about one URL."""
+
+    __slots__ = ('url', 'etag', 'last_modified', 'digest', 'content_type',
+                 'encoding', 'links', 'data')
+
+    def __init__(self, url, etag, last_modified, digest, content_type,
+                 encoding, links, data):
+        self.url = url
+        self.etag = etag
+        self.last_modified = last_modified
+        self.digest = digest
+        self.content_type = content_type
+        self.encoding = encoding
+        self.links = links
+        self.data = data
+
+    def conditional_headers(self):
+        """Headers asking the server for the page only if it changed."""
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+
+class PageCache(object):
+    """Per-URL ETag, Last-Modified, content hash, links and scraped data.
+
+    Kept in an SQLite WAL database across crawls.  The crawler sends the
+    stored validators as a conditional GET; when the server answers 304,
+    or the body hashes to the stored digest, it reuses the stored links
+    and data instead of parsing and scraping the page again.
+
+    A fetched page is stored in two steps: fetched() records the
+    validators of the response when its body is read, and parsed() adds
+    the links and data once the page is processed.  Writes are committed
+    every checkpoint_ops pages / checkpoint_interval seconds and by
+    close().
+    """
+
+    def __init__(self, path, checkpoint_interval=30.0, checkpoint_ops=1000):
+        self.path = path
+        self.checkpoint_interval = checkpoint_interval
+        self.checkpoint_ops = checkpoint_ops
+        self.db = sqlite3.connect(path)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS pages ('
+                        'url TEXT PRIMARY KEY, '
+                        'etag TEXT, '
+                        'last_modified TEXT, '
+                        'digest TEXT, '
+                        'content_type TEXT, '
+                        'encoding TEXT, '
+                        'links TEXT, '
+                        'data TEXT, '
+                        'fetched REAL)')
+        self.db.commit()
+        self._fetched = {}
+        self._ops = 0
+        self._last_checkpoint = time.time()
+
+    def __len__(self):
+        return self.db.execute('SELECT COUNT(*) FROM pages').fetchone()[0]
+
+    def get(self, url):
+        """Return the CachedPage of url, or None."""
+        row = self.db.execute(
+            'SELECT etag, last_modified, digest, content_type, encoding, '
+            'links, data FROM pages WHERE url=?', (url,)).fetchone()
+        if row is None:
+            return None
+        etag, last_modified, digest, content_type, encoding, links, data = row
+        return CachedPage(url, etag, last_modified, digest, content_type,
+                          encoding, json.loads(links),
+                          json.loads(data) if data else None)
+
+    def fetched(self, url, etag, last_modified, digest, content_type,
+                encoding):
+        """Remember the validators of a page until parsed() stores it."""
+        self._fetched[url] = (etag, last_modified, digest, content_type,
+                              encoding)
+
+    def parsed(self, url, links, data):
+        """Store a page given to fetched() with its links and data."""
+        validators = self._fetched.pop(url, None)
+        if validators is None:
+            return
+        self.db.execute(
+            'INSERT OR REPLACE INTO pages (url, etag, last_modified, digest, '
+            'content_type, encoding, links, data, fetched) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (url,) + validators + (json.dumps(sorted(links)),
+                                   json.dumps(data) if data is not None
+                                   else None,
+                                   time.time()))
+        self._written()
+
+    def unchanged(self, url, etag, last_modified):
+        """Refresh the validators of a page found unchanged."""
+        self.db.execute(
+            'UPDATE pages SET etag=COALESCE(?, etag), '
+            'last_modified=COALESCE(?, last_modified), fetched=? '
+            'WHERE url=?', (etag, last_modified, time.time(), url))
+        self._written()
+
+    def _written(self):
+        self._ops += 1
+        if (self._ops >= self.checkpoint_ops or
+                time.time() - self._last_checkpoint >= self.checkpoint_interval):
+            self.checkpoint()
+
+    def checkpoint(self):
+        self.db.commit()
+        self._ops = 0
+        self._last_checkpoint = time.time()
+
+    def close(self):
+        self.checkpoint()
+        self.db.close()
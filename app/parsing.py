@@ -0,0 +1,128 @@
+#
+# Page parsing, run inline or in a worker process
+#
+import codecs
+import re
+import time
+from lxml import etree, html
+try:
+    from app.links import extract_links
+    from app.scraper import Scraper
+except ImportError:
+    from links import extract_links
+    from scraper import Scraper
+
+# Selectors are looked up in the crawler process; workers only query.
+_scraper = Scraper({})
+
+# How much of a body is searched for a <meta charset> or an XML
+# declaration.  HTML requires it within the first 1024 bytes; some
+# pages put it after a long <title> or comment.
+SNIFF_SIZE = 4096
+
+_DECLARED_CHARSET = re.compile(
+    rb'<meta\s[^>]*?charset\s*=\s*["\']?\s*([-\w.:]+)'
+    rb'|<\?xml\s[^>]*?encoding\s*=\s*["\']([-\w.:]+)',
+    re.I)
+
+_BOMS = ((codecs.BOM_UTF8, 'utf-8'),
+         (codecs.BOM_UTF32_LE, 'utf-32-le'),
+         (codecs.BOM_UTF32_BE, 'utf-32-be'),
+         (codecs.BOM_UTF16_LE, 'utf-16-le'),
+         (codecs.BOM_UTF16_BE, 'utf-16-be'))
+
+# Labels browsers read as another encoding: shops that say latin-1 or
+# ascii mostly write windows-1252 (a euro sign, curly quotes).
+_BROWSER_ENCODINGS = {'latin-1': 'cp1252', 'iso8859-1': 'cp1252',
+                      'ascii': 'cp1252'}
+
+# lxml parsers, one per encoding, as building one has a cost.
+_parsers = {}
+
+
+def normalize_encoding(label):
+    """Return the Python codec name of a charset label, or None."""
+    if not label:
+        return None
+    try:
+        name = codecs.lookup(label.strip()).name
+    except LookupError:
+        return None
+    return _BROWSER_ENCODINGS.get(name, name)
+
+
+def detect_encoding(body, declared=None, default='utf-8'):
+    """Return the encoding of an HTML or XML body (bytes).
+
+    As browsers do, a byte order mark wins, then the charset declared
+    in the Content-Type header (declared), then a <meta charset> or XML
+    declaration found in the first SNIFF_SIZE bytes, then default.
+    Unknown labels are skipped.
+    """
+    for bom, encoding in _BOMS:
+        if body.startswith(bom):
+            return encoding
+    encoding = normalize_encoding(declared)
+    if encoding is not None:
+        return encoding
+    match = _DECLARED_CHARSET.search(body[:SNIFF_SIZE])
+    if match is not None:
+        label = (match.group(1) or match.group(2)).decode('ascii')
+        encoding = normalize_encoding(label)
+        # A page cannot declare itself UTF-16 in a markup it could read.
+        if encoding is not None and not encoding.startswith('utf-16'):
+            return encoding
+    return default
+
+
+def parse_tree(body, encoding='utf-8'):
+    """Build the lxml tree of an HTML body (bytes) in encoding.
+
+    libxml2 decodes the bytes itself, so the page is not decoded to a
+    str first.  Bodies that are not valid in their encoding, or in an
+    encoding libxml2 does not know, are decoded by Python instead, with
+    undecodable bytes replaced.
+    """
+    if isinstance(body, str):
+        return html.fromstring(body)
+    parser = _parsers.get(encoding)
+    if parser is None:
+        try:
+            parser = html.HTMLParser(encoding=encoding)
+        except LookupError:
+            parser = False
+        _parsers[encoding] = parser
+    if parser:
+        tree = html.fromstring(body, parser=parser)
+        if not any(error.type == etree.ErrorTypes.ERR_INVALID_ENCODING
+                   for error in parser.error_log):
+            return tree
+    return html.fromstring(body.decode(encoding, 'replace'))
+
+
+def parse_page(web_page, base_url, css_selectors=None, encoding='utf-8'):
+    """Parse a page once and return (urls, data, timings).
+
+    web_page is the body as fetched, bytes in encoding (or a str).  The
+    links are taken by links.extract_links, which scans the page
+    without building a tree.  An lxml tree is only built when there are
+    css_selectors to scrape: data is what Scraper.get_data returns for
+    them, or None when no selectors are given.  timings maps 'parse'
+    (link extraction) and 'scrape' (tree and queries) to the seconds
+    they took.
+
+    This is a module-level function so it can be sent to a
+    ProcessPoolExecutor.
+    """
+    t0 = time.perf_counter()
+    if (isinstance(web_page, bytes) and
+            encoding.startswith(('utf-16', 'utf-32'))):
+        # Markup is not ASCII bytes in these; scan and parse it as text.
+        web_page = web_page.decode(encoding, 'replace')
+    urls = extract_links(web_page, base_url, encoding)
+    t1 = time.perf_counter()
+    data = None
+    if css_selectors is not None:
+        data = _scraper.get_data(parse_tree(web_page, encoding), css_selectors)
+    t2 = time.perf_counter()
+    return urls, data, {'parse': t1 - t0, 'scrape': t2 - t1}
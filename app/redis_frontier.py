@@ -0,0 +1,200 @@
+#
+# Crawl frontier shared by several crawler nodes through Redis
+#
+import json
+import logging
+import time
+try:
+    from app.scheduler import url_host
+    from app.seen import fingerprint
+except ImportError:
+    from scheduler import url_host
+    from seen import fingerprint
+
+LOGGER = logging.getLogger(__name__)
+
+# KEYS: seen, hosts, pending, host set.  ARGV: queue key prefix, then
+# triples of (fingerprint, host, entry).  Returns the indexes (from 0)
+# of the new triples.  The host set holds the hosts of the hosts list,
+# so a host whose queue was emptied but is still listed is not listed
+# twice.
+_ADD = """
+local new = {}
+local added = 0
+for i = 2, #ARGV, 3 do
+    if redis.call('SADD', KEYS[1], ARGV[i]) == 1 then
+        redis.call('RPUSH', ARGV[1] .. ARGV[i + 1], ARGV[i + 2])
+        if redis.call('SADD', KEYS[4], ARGV[i + 1]) == 1 then
+            redis.call('RPUSH', KEYS[2], ARGV[i + 1])
+        end
+        added = added + 1
+        new[added] = (i - 2) / 3
+    end
+end
+if added > 0 then
+    redis.call('INCRBY', KEYS[3], added)
+end
+return new
+"""
+
+# KEYS: hosts, pending, leases, host set.  ARGV: queue key prefix, n,
+# now, lease deadline.  Leases that expired (their node died or hung) are handed
+# out again first; then up to n entries are popped from the host queues
+# round-robin, one host after the other.
+_TAKE = """
+local n = tonumber(ARGV[2])
+local taken = redis.call('ZRANGEBYSCORE', KEYS[3], '-inf', ARGV[3],
+                         'LIMIT', 0, n)
+for _, entry in ipairs(taken) do
+    redis.call('ZADD', KEYS[3], ARGV[4], entry)
+end
+local hosts = redis.call('LLEN', KEYS[1])
+local popped = 0
+while #taken < n and hosts > 0 do
+    local host = redis.call('RPOPLPUSH', KEYS[1], KEYS[1])
+    if not host then
+        break
+    end
+    local entry = redis.call('LPOP', ARGV[1] .. host)
+    if entry then
+        redis.call('ZADD', KEYS[3], ARGV[4], entry)
+        taken[#taken + 1] = entry
+        popped = popped + 1
+    else
+        redis.call('LREM', KEYS[1], 0, host)
+        redis.call('SREM', KEYS[4], host)
+        hosts = hosts - 1
+    end
+end
+if popped > 0 then
+    redis.call('DECRBY', KEYS[2], popped)
+end
+return taken
+"""
+
+
+class RedisFrontier(object):
+    """Frontier and seen-store in Redis, shared by the nodes of one crawl.
+
+    A drop-in for frontier.SqliteFrontier: the crawler calls
+    filter_unseen() with the links it finds, take() to fill its queue and
+    done() once a URL is fetched.  Several crawler nodes given frontiers
+    with the same name (and Redis) cooperate on one crawl without
+    fetching a URL twice:
+
+    - the seen-set holds the 64-bit fingerprints (see seen.fingerprint)
+      of every URL discovered by any node;
+    - pending URLs wait in one list per host, and take() pops them from
+      the hosts round-robin so a node's queue holds many hosts;
+    - a URL taken is leased to the node for lease_time seconds.  done()
+      acknowledges it; acknowledgements are sent ack_batch at a time (or
+      by checkpoint()).  URLs whose lease expires unacknowledged are
+      handed out again by a later take(), so the URLs of a node that
+      died are not lost.
+
+    filter_unseen() and take() are each one Lua script call, i.e. one
+    round-trip for a whole batch of links.  The keys, prefixed with
+    'frontier:<name>:', persist until clear() so nodes may join or
+    restart a crawl at any time.  A node stops once nothing is pending
+    and no node holds a lease, since the URLs leased may yet lead to
+    more.
+
+    client is a redis.StrictRedis (redis-py) client.
+    """
+
+    def __init__(self, client, name, lease_time=600.0, ack_batch=100):
+        self.client = client
+        self.name = name
+        self.lease_time = lease_time
+        self.ack_batch = ack_batch
+        self.prefix = 'frontier:%s:' % name
+        self.seen_key = self.prefix + 'seen'
+        self.hosts_key = self.prefix + 'hosts'
+        self.host_set_key = self.prefix + 'host_set'
+        self.pending_key = self.prefix + 'pending'
+        self.leases_key = self.prefix + 'leases'
+        self.queue_prefix = self.prefix + 'queue:'
+        self._add = client.register_script(_ADD)
+        self._take = client.register_script(_TAKE)
+        self._leased = {}
+        self._acks = []
+
+    def __contains__(self, url):
+        return bool(self.client.sismember(self.seen_key, fingerprint(url)))
+
+    def __len__(self):
+        return self.client.scard(self.seen_key)
+
+    def pending(self):
+        """Number of URLs waiting in Redis, for all nodes."""
+        return int(self.client.get(self.pending_key) or 0)
+
+    def filter_unseen(self, urls, max_redirect=None, parent=None,
+                      lastmod=None):
+        """Store the URLs not seen by any node as pending and return them.
+
+        parent and lastmod are not used.
+        """
+        urls = list(urls)
+        if not urls:
+            return []
+        args = [self.queue_prefix]
+        for url in urls:
+            args.extend((fingerprint(url), url_host(url),
+                         json.dumps([url, max_redirect])))
+        new = self._add(keys=[self.seen_key, self.hosts_key,
+                              self.pending_key, self.host_set_key],
+                        args=args)
+        return [urls[int(i)] for i in new]
+
+    def take(self, n):
+        """Lease up to n pending URLs and return (url, max_redirect)."""
+        if n <= 0:
+            return []
+        now = time.time()
+        entries = self._take(keys=[self.hosts_key, self.pending_key,
+                                   self.leases_key, self.host_set_key],
+                             args=[self.queue_prefix, n, now,
+                                   now + self.lease_time])
+        taken = []
+        for entry in entries:
+            url, max_redirect = json.loads(entry.decode('utf-8')
+                                           if isinstance(entry, bytes)
+                                           else entry)
+            self._leased[url] = entry
+            taken.append((url, max_redirect))
+        return taken
+
+    def done(self, url, data=None):
+        """Acknowledge a fetched URL so its lease is not handed out again."""
+        entry = self._leased.pop(url, None)
+        if entry is None:
+            return
+        self._acks.append(entry)
+        if len(self._acks) >= self.ack_batch:
+            self.checkpoint()
+
+    def checkpoint(self):
+        """Send the acknowledgements not sent yet."""
+        if self._acks:
+            acks, self._acks = self._acks, []
+            self.client.zrem(self.leases_key, *acks)
+
+    def leased(self):
+        """Number of URLs leased to some node and not acknowledged."""
+        return self.client.zcard(self.leases_key)
+
+    def clear(self):
+        """Delete every key of this crawl."""
+        hosts = self.client.lrange(self.hosts_key, 0, -1)
+        keys = [self.seen_key, self.hosts_key, self.host_set_key,
+                self.pending_key, self.leases_key]
+        keys.extend(self.queue_prefix + (host.decode('utf-8')
+                                         if isinstance(host, bytes) else host)
+                    for host in hosts)
+        self.client.delete(*keys)
+        self._leased.clear()
+        self._acks = []
+
+    def close(self):
+        self.checkpoint()
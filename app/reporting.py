@@ -1,5 +1,8 @@
 """Reporting subsystem for web crawler."""
 
+import bisect
+import json
+import os
 import time
 
 
@@ -12,60 +15,193 @@ class Stats:
     def add(self, key, count=1):
         self.stats[key] = self.stats.get(key, 0) + count
 
+    def merge(self, other):
+        for key, count in other.stats.items():
+            self.add(key, count)
+
     def report(self, file=None):
         for key, count in sorted(self.stats.items()):
             print('%10d' % count, key, file=file)
 
 
+def exponential_bounds(start, factor, count):
+    """Return count bucket upper bounds growing by factor from start."""
+    return [start * factor ** i for i in range(count)]
+
+
+class Histogram:
+    """Fixed-bucket histogram: constant memory whatever is added to it."""
+
+    __slots__ = ('bounds', 'counts', 'count', 'sum')
+
+    def __init__(self, bounds):
+        self.bounds = list(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0
+
+    def add(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def merge(self, other):
+        """Add the counts of a histogram with the same bounds."""
+        if other.bounds != self.bounds:
+            raise ValueError('cannot merge histograms with different bounds')
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.count += other.count
+        self.sum += other.sum
+
+    def percentile(self, p):
+        """Upper bound of the bucket holding the p-th percentile."""
+        if not self.count:
+            return 0
+        rank = p / 100.0 * self.count
+        seen = 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+    def report(self, name, file=None):
+        mean = self.sum / self.count if self.count else 0
+        print('%s: n=%d mean=%.3f p50<=%g p90<=%g p99<=%g' %
+              (name, self.count, mean, self.percentile(50),
+               self.percentile(90), self.percentile(99)), file=file)
+
+
+class JsonLog:
+    """Append JSON lines to a file, rotating it every max_bytes.
+
+    The rotation scheme is that of logging.handlers.RotatingFileHandler:
+    path.1 is the most recent full file, up to path.<backup_count>.
+    """
+
+    def __init__(self, path, max_bytes=64 * 1024 * 1024, backup_count=5):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.file = open(path, 'a')
+
+    def write(self, record):
+        line = json.dumps(record, default=repr) + '\n'
+        if self.max_bytes and self.file.tell() + len(line) > self.max_bytes:
+            self.rotate()
+        self.file.write(line)
+
+    def rotate(self):
+        self.file.close()
+        for i in range(self.backup_count - 1, 0, -1):
+            if os.path.exists('%s.%d' % (self.path, i)):
+                os.replace('%s.%d' % (self.path, i),
+                           '%s.%d' % (self.path, i + 1))
+        if self.backup_count:
+            os.replace(self.path, self.path + '.1')
+        self.file = open(self.path, 'w')
+
+    def close(self):
+        self.file.close()
+
+
+class StatsAggregator:
+    """Streaming summary of the FetchStatistics of a crawl.
+
+    Counters and histograms are updated as each statistic arrives, so
+    memory does not grow with the number of URLs and report() does not
+    depend on it either.  Per-URL records go to log (a JsonLog) if set.
+    """
+
+    def __init__(self, log=None):
+        self.log = log
+        self.done = 0
+        self.stats = Stats()
+        self.sizes = Histogram(exponential_bounds(1024, 2, 16))
+        self.links = Histogram(exponential_bounds(1, 2, 12))
+
+    def add(self, stat):
+        self.done += 1
+        count_statistic(stat, self.stats)
+        if stat.size:
+            self.sizes.add(stat.size)
+        if stat.num_urls:
+            self.links.add(stat.num_urls)
+        if self.log is not None:
+            self.log.write(stat._asdict())
+
+    def merge(self, other):
+        """Add the summary of another crawl (e.g. another process's)."""
+        self.done += other.done
+        self.stats.merge(other.stats)
+        self.sizes.merge(other.sizes)
+        self.links.merge(other.links)
+
+
 def report(crawler, file=None):
     """Print a report on all completed URLs."""
     t1 = crawler.t1 or time.time()
-    dt = t1 - crawler.t0
-    if dt and crawler.max_tasks:
-        speed = len(crawler.done) / dt / crawler.max_tasks
+    report_stats(crawler.stats, crawler.metrics.latency, t1 - crawler.t0,
+                 crawler.max_tasks, crawler.q.qsize(),
+                 resolver=crawler.resolver, robots=crawler.robots,
+                 sitemaps=crawler.sitemaps, concurrency=crawler.concurrency,
+                 file=file)
+
+
+def report_stats(stats, latency, dt, max_tasks=0, todo=0, resolver=None,
+                 robots=None, sitemaps=None, concurrency=None, file=None):
+    """Print a report from a StatsAggregator and latency histograms.
+
+    resolver, if given, is a dnscache.CachingResolver to report on,
+    robots a robots.RobotsCache, sitemaps a sitemaps.SitemapSeeder and
+    concurrency a concurrency.AimdController.
+    """
+    done = stats.done
+    if dt and max_tasks:
+        speed = done / dt / max_tasks
     else:
         speed = 0
-    stats = Stats()
     print('*** Report ***', file=file)
-    try:
-        show = list(crawler.done)
-        show.sort(key=lambda _stat: _stat.url)
-        for stat in show:
-            url_report(stat, stats, file=file)
-    except KeyboardInterrupt:
-        print('\nInterrupted', file=file)
-    print('Finished', len(crawler.done),
+    print('Finished', done,
           'urls in %.3f secs' % dt,
-          '(max_tasks=%d)' % crawler.max_tasks,
+          '(max_tasks=%d)' % max_tasks,
           '(%.3f urls/sec/task)' % speed,
           file=file)
-    stats.report(file=file)
-    print('Todo:', crawler.q.qsize(), file=file)
-    print('Done:', len(crawler.done), file=file)
+    stats.stats.report(file=file)
+    stats.sizes.report('Page bytes', file=file)
+    stats.links.report('Links per page', file=file)
+    for phase, histogram in sorted(latency.items()):
+        if histogram.count:
+            histogram.report('Seconds %s' % phase, file=file)
+    if resolver is not None:
+        resolver.report(file=file)
+    if robots is not None:
+        robots.report(file=file)
+    if sitemaps is not None:
+        sitemaps.report(file=file)
+    if concurrency is not None:
+        concurrency.report(file=file)
+    print('Todo:', todo, file=file)
+    print('Done:', done, file=file)
     print('Date:', time.ctime(), 'local time', file=file)
 
 
-def url_report(stat, stats, file=None):
-    """Print a report on the state for this URL.
-
-    Also update the Stats instance.
-    """
+def count_statistic(stat, stats):
+    """Update the Stats instance for the state of this URL."""
     if stat.exception:
         stats.add('fail')
         stats.add('fail_' + str(stat.exception.__class__.__name__))
-        print(stat.url, 'error', stat.exception, file=file)
     elif stat.next_url:
         stats.add('redirect')
-        print(stat.url, stat.status, 'redirect', stat.next_url,
-              file=file)
+    elif stat.robots_disallowed:
+        stats.add('robots_disallowed')
+    elif stat.duplicate_of:
+        stats.add('near_duplicate')
     elif stat.content_type == 'text/html':
         stats.add('html')
         stats.add('html_bytes', stat.size)
-        print(stat.url, stat.status,
-              stat.content_type, stat.encoding,
-              stat.size,
-              '%d/%d' % (stat.num_new_urls, stat.num_urls),
-              file=file)
+        if stat.unchanged:
+            stats.add('html_unchanged')
     else:
         if stat.status == 200:
             stats.add('other')
@@ -74,7 +210,3 @@ def url_report(stat, stats, file=None):
             stats.add('error')
             stats.add('error_bytes', stat.size)
             stats.add('status_%s' % stat.status)
-        print(stat.url, stat.status,
-              stat.content_type, stat.encoding,
-              stat.size,
-              file=file)
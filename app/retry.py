@@ -0,0 +1,73 @@
+#
+# Retry backoff policy
+#
+import asyncio
+import email.utils
+import random
+import time
+
+
+class RetryPolicy(object):
+    """Decide whether and when a failed fetch is tried again.
+
+    The delay before try n+1 is base_delay * factor * 2**n, capped at
+    max_delay, with "equal jitter": a random half of it is dropped so
+    retries of many URLs failing together spread out.  factor depends on
+    the HTTP status (only statuses in status_factors are retried) or on
+    the exception class (first matching entry of exception_factors,
+    1.0 otherwise).  A Retry-After header raises the delay to what the
+    server asked for, up to max_delay.
+    """
+
+    STATUS_FACTORS = {429: 4.0, 500: 1.0, 502: 1.0, 503: 2.0, 504: 1.0}
+    EXCEPTION_FACTORS = ((asyncio.TimeoutError, 2.0),)
+
+    def __init__(self, base_delay=1.0, max_delay=300.0,
+                 status_factors=None, exception_factors=None):
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        if status_factors is None:
+            status_factors = self.STATUS_FACTORS
+        if exception_factors is None:
+            exception_factors = self.EXCEPTION_FACTORS
+        self.status_factors = status_factors
+        self.exception_factors = exception_factors
+
+    def retry_status(self, status):
+        """Return True if a response with this status should be retried."""
+        return status in self.status_factors
+
+    def factor(self, status=None, exception=None):
+        if status is not None:
+            return self.status_factors.get(status, 1.0)
+        for exception_class, factor in self.exception_factors:
+            if isinstance(exception, exception_class):
+                return factor
+        return 1.0
+
+    def delay(self, tries, status=None, exception=None, retry_after=None):
+        """Seconds to wait before try number tries + 1."""
+        backoff = min(self.max_delay,
+                      self.base_delay * self.factor(status, exception) * 2 ** tries)
+        delay = backoff / 2 + random.uniform(0, backoff / 2)
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.max_delay))
+        return delay
+
+
+def parse_retry_after(value, now=None):
+    """Return the seconds a Retry-After header value asks to wait, or None."""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        date = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError, IndexError):
+        return None
+    if date is None:
+        return None
+    if now is None:
+        now = time.time()
+    return max(0.0, date.timestamp() - now)
@@ -0,0 +1,291 @@
+#
+# robots.txt fetching, caching and matching
+#
+import asyncio
+import collections
+import logging
+import re
+import time
+
+LOGGER = logging.getLogger(__name__)
+
+USER_AGENT = 'python_crawler'
+
+
+class RobotsUnavailable(Exception):
+    """The robots.txt of a site could not be fetched."""
+
+
+def split_url(url):
+    """Return (site, path) of an absolute URL: ('http://host:port', '/p?q').
+
+    The fragment is dropped.  Cheaper than urlsplit, which matters since
+    every link found is checked.
+    """
+    start = url.find('//')
+    start = start + 2 if start != -1 else 0
+    end = len(url)
+    for sep in '/?#':
+        i = url.find(sep, start, end)
+        if i != -1:
+            end = i
+    path = url[end:].split('#', 1)[0]
+    if not path.startswith('/'):
+        path = '/' + path
+    return url[:end].lower(), path
+
+
+def _rule_regex(pattern):
+    """Regex source matching the paths a robots.txt rule applies to."""
+    anchored = pattern.endswith('$')
+    if anchored:
+        pattern = pattern[:-1]
+    regex = '.*'.join(re.escape(part) for part in pattern.split('*'))
+    return regex + ('\\Z' if anchored else '')
+
+
+class RobotsRules(object):
+    """The Allow/Disallow rules of one robots.txt group, compiled.
+
+    As in RFC 9309 the longest matching rule decides and Allow wins a
+    tie.  The rules are sorted that way and joined into one regex with a
+    group per rule, so allowed() is a single match whatever the number
+    of rules: the first alternative that matches is the deciding rule.
+
+    unavailable marks the rules standing in for a robots.txt that could
+    not be fetched: they disallow everything, but only for now.
+    """
+
+    def __init__(self, rules=(), crawl_delay=None, sitemaps=(),
+                 unavailable=False):
+        # Disallow: with no path allows everything; it is no rule.
+        rules = [(path, allow) for path, allow in rules if path]
+        rules.sort(key=lambda rule: (-len(rule[0]), not rule[1]))
+        self.rules = rules
+        self.crawl_delay = crawl_delay
+        self.sitemaps = list(sitemaps)
+        self.unavailable = unavailable
+        self._allow = [None] + [allow for _, allow in rules]
+        self._match = None
+        if rules:
+            self._match = re.compile('|'.join(
+                '(%s)' % _rule_regex(path) for path, _ in rules)).match
+
+    def allowed(self, path):
+        """Return True if path (with its query) may be fetched."""
+        if self._match is None or path == '/robots.txt':
+            return True
+        match = self._match(path)
+        return match is None or self._allow[match.lastindex]
+
+
+ALLOW_ALL = RobotsRules()
+DISALLOW_ALL = RobotsRules([('/', False)])
+UNAVAILABLE = RobotsRules([('/', False)], unavailable=True)
+
+
+def parse_robots(text, user_agent=USER_AGENT):
+    """Return the RobotsRules robots.txt text sets for user_agent.
+
+    The group of the longest user-agent name found in user_agent's
+    product token applies (all the groups of that name, merged), else
+    the '*' group.  Sitemap lines are kept whatever the group.
+    """
+    token = user_agent.split('/', 1)[0].strip().lower()
+    groups = []
+    sitemaps = []
+    agents = rules = options = None
+    for line in text.splitlines():
+        line = line.split('#', 1)[0]
+        field, sep, value = line.partition(':')
+        if not sep:
+            continue
+        field = field.strip().lower()
+        value = value.strip()
+        if field == 'user-agent':
+            if agents is None or rules or options:
+                agents, rules, options = [], [], {}
+                groups.append((agents, rules, options))
+            agents.append(value.lower())
+        elif field == 'sitemap':
+            if value:
+                sitemaps.append(value)
+        elif agents is None:
+            continue
+        elif field in ('allow', 'disallow'):
+            rules.append((value, field == 'allow'))
+        elif field == 'crawl-delay':
+            try:
+                options['crawl_delay'] = float(value)
+            except ValueError:
+                pass
+    best = None
+    for agents, _, _ in groups:
+        for agent in agents:
+            if agent != '*' and agent in token:
+                if best is None or len(agent) > len(best):
+                    best = agent
+    if best is None:
+        best = '*'
+    selected = [group for group in groups if best in group[0]]
+    merged = []
+    crawl_delay = None
+    for _, rules, options in selected:
+        merged.extend(rules)
+        if crawl_delay is None:
+            crawl_delay = options.get('crawl_delay')
+    return RobotsRules(merged, crawl_delay, sitemaps)
+
+
+class RobotsCache(object):
+    """robots.txt rules of every site crawled, fetched once per site.
+
+    rules() fetches http(s)://host[:port]/robots.txt the first time a
+    site is asked for (concurrent callers share the fetch) and keeps the
+    result for ttl seconds.  Following RFC 9309, a missing robots.txt
+    (4xx but 429) allows everything, while a server error or a site that
+    cannot be reached gives UNAVAILABLE, for error_ttl seconds only: the
+    crawler puts the URLs of the site back until then, and gives them up
+    once max_failures fetches in a row have failed (gave_up()).
+    At most max_bytes of a robots.txt are parsed, at most max_size sites
+    are kept (least recently used out) and a Crawl-delay is capped at
+    max_crawl_delay.
+
+    allowed() only looks at the cache, so links can be tested without
+    waiting: a site not fetched yet, or whose robots.txt is unavailable,
+    is allowed until its rules are known.
+    """
+
+    def __init__(self, user_agent=USER_AGENT, ttl=24 * 3600.0,
+                 error_ttl=60.0, max_failures=3, max_size=10000,
+                 max_bytes=500 * 1024, max_crawl_delay=30.0, timeout=10.0,
+                 *, loop=None):
+        self.loop = loop or asyncio.get_event_loop()
+        self.user_agent = user_agent
+        self.ttl = ttl
+        self.error_ttl = error_ttl
+        self.max_failures = max_failures
+        self.max_size = max_size
+        self.max_bytes = max_bytes
+        self.max_crawl_delay = max_crawl_delay
+        self.timeout = timeout
+        self.cache = collections.OrderedDict()
+        self.pending = {}
+        self.failures = collections.OrderedDict()
+        self.fetched = 0
+        self.errors = 0
+        self.disallowed = 0
+
+    def _cached(self, site):
+        entry = self.cache.get(site)
+        if entry is None:
+            return None
+        expires, rules = entry
+        if expires <= time.monotonic():
+            del self.cache[site]
+            return None
+        self.cache.move_to_end(site)
+        return rules
+
+    def _store(self, site, rules, ttl):
+        self.cache[site] = (time.monotonic() + ttl, rules)
+        self.cache.move_to_end(site)
+        if len(self.cache) > self.max_size:
+            self.cache.popitem(last=False)
+
+    def _count_failure(self, site, rules):
+        if not rules.unavailable:
+            self.failures.pop(site, None)
+            return
+        self.failures[site] = self.failures.get(site, 0) + 1
+        self.failures.move_to_end(site)
+        if len(self.failures) > self.max_size:
+            self.failures.popitem(last=False)
+
+    def gave_up(self, url):
+        """True once the last max_failures robots.txt fetches failed."""
+        site, _ = split_url(url)
+        return self.failures.get(site, 0) >= self.max_failures
+
+    def allowed(self, url):
+        """Return False if the cached rules of url's site disallow it."""
+        site, path = split_url(url)
+        rules = self._cached(site)
+        return rules is None or rules.unavailable or rules.allowed(path)
+
+    def crawl_delay(self, rules):
+        """The Crawl-delay of rules, capped, or None."""
+        if rules.crawl_delay is None:
+            return None
+        return min(rules.crawl_delay, self.max_crawl_delay)
+
+    @asyncio.coroutine
+    def rules(self, url, session):
+        """Return the RobotsRules of url's site, fetching them if needed."""
+        site, _ = split_url(url)
+        rules = self._cached(site)
+        if rules is not None:
+            return rules
+        future = self.pending.get(site)
+        if future is None:
+            future = self.pending[site] = asyncio.Future(loop=self.loop)
+            try:
+                rules, ttl = yield from self._fetch(site, session)
+                self._store(site, rules, ttl)
+                self._count_failure(site, rules)
+                future.set_result(rules)
+            except Exception as e:
+                future.set_exception(e)
+            finally:
+                del self.pending[site]
+        return (yield from future)
+
+    @asyncio.coroutine
+    def _fetch(self, site, session):
+        url = site + '/robots.txt'
+        self.fetched += 1
+        try:
+            response = yield from asyncio.wait_for(
+                session.get(url), self.timeout, loop=self.loop)
+            try:
+                status = response.status
+                if status == 200:
+                    body = yield from asyncio.wait_for(
+                        self._read(response), self.timeout, loop=self.loop)
+            finally:
+                response.close()
+        except (asyncio.CancelledError, GeneratorExit):
+            raise
+        except Exception as e:
+            LOGGER.warning('fetching %r failed: %r', url, e)
+            self.errors += 1
+            return UNAVAILABLE, self.error_ttl
+        if status == 200:
+            rules = parse_robots(body.decode('utf-8', 'replace'),
+                                 self.user_agent)
+            LOGGER.info('%r: %d rules, crawl-delay %r', url,
+                        len(rules.rules), rules.crawl_delay)
+            return rules, self.ttl
+        if 400 <= status < 500 and status != 429:
+            return ALLOW_ALL, self.ttl
+        LOGGER.warning('fetching %r returned %r', url, status)
+        self.errors += 1
+        return UNAVAILABLE, self.error_ttl
+
+    @asyncio.coroutine
+    def _read(self, response):
+        chunks = []
+        size = 0
+        while size < self.max_bytes:
+            chunk = yield from response.content.read(self.max_bytes - size)
+            if not chunk:
+                break
+            chunks.append(chunk)
+            size += len(chunk)
+        return b''.join(chunks)
+
+    def report(self, file=None):
+        print('robots.txt: %d fetched, %d failed, %d URLs disallowed, '
+              '%d cached' % (self.fetched, self.errors, self.disallowed,
+                             len(self.cache)),
+              file=file)
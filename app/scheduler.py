@@ -0,0 +1,210 @@
+#
+# Per-host politeness scheduler
+#
+import asyncio
+import collections
+import heapq
+import time
+import urllib.parse
+
+
+def url_host(url):
+    """Return the lowercased host[:port] the scheduler groups a URL under."""
+    return urllib.parse.urlparse(url).netloc.lower()
+
+
+class _HostState(object):
+    """Pending URLs and pacing state of one host."""
+
+    __slots__ = ('queue', 'active', 'next_time', 'in_heap')
+
+    def __init__(self):
+        self.queue = collections.deque()
+        self.active = 0
+        self.next_time = 0.0
+        self.in_heap = False
+
+
+class HostScheduler(object):
+    """A queue of (url, ...) items that hands out URLs host by host.
+
+    Every host has its own FIFO of pending items, a limit on the number of
+    items handed out and not yet released (max_per_host, or what
+    set_limit() gave the host), and a minimum delay between two
+    hand-outs (min_delay, or longer for hosts given one with set_delay(),
+    e.g. from their robots.txt Crawl-delay).  Hosts that have pending
+    items and a free slot sit on a ready-heap ordered by the time they
+    may next be fetched, so get() always returns an item of a host that
+    can be fetched now.
+
+    The interface mirrors asyncio.Queue (put_nowait, get, task_done, join,
+    qsize, empty) with two additions: release(url) must be called once the
+    fetch of an item is finished, to give the slot back to its host, and
+    put_later(item, delay) parks an item on a time-ordered heap until it
+    is due, e.g. to retry a failed fetch without holding a worker.
+    """
+
+    def __init__(self, max_per_host=3, min_delay=0.0, *, loop=None):
+        self.loop = loop or asyncio.get_event_loop()
+        self.max_per_host = max_per_host
+        self.min_delay = min_delay
+        self._hosts = {}
+        self._delays = {}
+        self._limits = {}
+        self._ready = []
+        self._delayed = []
+        self._seq = 0
+        self._size = 0
+        self._getters = collections.deque()
+        self._unfinished = 0
+        self._finished = asyncio.Event(loop=self.loop)
+        self._finished.set()
+
+    def qsize(self):
+        """Number of items waiting to be handed out, delayed ones included."""
+        return self._size + len(self._delayed)
+
+    def delayed(self):
+        """Number of items put with put_later() that are not due yet."""
+        return len(self._delayed)
+
+    def empty(self):
+        return not self.qsize()
+
+    def idle(self):
+        """True if every item put has been marked done."""
+        return not self._unfinished
+
+    def hosts(self):
+        """Number of hosts the scheduler currently tracks."""
+        return len(self._hosts)
+
+    def set_delay(self, host, delay):
+        """Space the hand-outs of host by delay seconds, min_delay at least."""
+        if delay > self.min_delay:
+            self._delays[host] = delay
+        else:
+            self._delays.pop(host, None)
+
+    def set_limit(self, host, limit):
+        """Let host have limit items handed out at once."""
+        self._limits[host] = limit
+        state = self._hosts.get(host)
+        if (state is not None and state.queue and not state.in_heap and
+                state.active < limit):
+            self._push(host, state)
+            self._wakeup()
+
+    def limit(self, host):
+        """Number of items of host that may be handed out at once."""
+        return self._limits.get(host, self.max_per_host)
+
+    def _push(self, host, state):
+        self._seq += 1
+        state.in_heap = True
+        heapq.heappush(self._ready, (state.next_time, self._seq, host))
+
+    def _wakeup(self):
+        while self._getters:
+            getter = self._getters.popleft()
+            if not getter.done():
+                getter.set_result(None)
+                return
+
+    def put_nowait(self, item):
+        """Add an item; item[0] must be its URL."""
+        self._unfinished += 1
+        self._finished.clear()
+        self._enqueue(item)
+
+    def put_later(self, item, delay):
+        """Add an item that may not be handed out for delay seconds."""
+        self._unfinished += 1
+        self._finished.clear()
+        self._seq += 1
+        heapq.heappush(self._delayed,
+                       (time.monotonic() + delay, self._seq, item))
+        self._wakeup()
+
+    def _promote(self, now):
+        while self._delayed and self._delayed[0][0] <= now:
+            _, _, item = heapq.heappop(self._delayed)
+            self._enqueue(item)
+
+    def _enqueue(self, item):
+        host = url_host(item[0])
+        state = self._hosts.get(host)
+        if state is None:
+            state = self._hosts[host] = _HostState()
+        state.queue.append(item)
+        self._size += 1
+        if not state.in_heap and state.active < self.limit(host):
+            self._push(host, state)
+        self._wakeup()
+
+    def get_nowait(self):
+        """Return an item of a host that may be fetched now, or None."""
+        now = time.monotonic()
+        self._promote(now)
+        while self._ready and self._ready[0][0] <= now:
+            _, _, host = heapq.heappop(self._ready)
+            state = self._hosts[host]
+            state.in_heap = False
+            limit = self.limit(host)
+            if not state.queue or state.active >= limit:
+                continue
+            item = state.queue.popleft()
+            self._size -= 1
+            state.active += 1
+            state.next_time = now + self._delays.get(host, self.min_delay)
+            if state.queue and state.active < limit:
+                self._push(host, state)
+            return item
+        return None
+
+    @asyncio.coroutine
+    def get(self):
+        """Wait until some host may be fetched and return its next item."""
+        while True:
+            item = self.get_nowait()
+            if item is not None:
+                return item
+            due = [heap[0][0] for heap in (self._ready, self._delayed) if heap]
+            timeout = None
+            if due:
+                timeout = max(0, min(due) - time.monotonic())
+            getter = asyncio.Future(loop=self.loop)
+            self._getters.append(getter)
+            try:
+                yield from asyncio.wait([getter], timeout=timeout,
+                                        loop=self.loop)
+            finally:
+                if not getter.done():
+                    getter.cancel()
+
+    def release(self, url):
+        """Give back the slot taken by the item of this URL."""
+        host = url_host(url)
+        state = self._hosts.get(host)
+        if state is None:
+            return
+        state.active -= 1
+        if state.queue and state.active < self.limit(host):
+            if not state.in_heap:
+                self._push(host, state)
+                self._wakeup()
+        elif not state.active and state.next_time <= time.monotonic():
+            del self._hosts[host]
+
+    def task_done(self):
+        if self._unfinished <= 0:
+            raise ValueError('task_done() called too many times')
+        self._unfinished -= 1
+        if not self._unfinished:
+            self._finished.set()
+
+    @asyncio.coroutine
+    def join(self):
+        """Block until every item put has been marked done."""
+        if self._unfinished:
+            yield from self._finished.wait()
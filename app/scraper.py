@@ -1,6 +1,46 @@
 from pyquery import PyQuery as pq
+from pyquery.cssselectpatch import JQueryTranslator
+from lxml import etree, html as lxml_html
+import functools
+import logging
 import urllib.parse
 
+LOGGER = logging.getLogger(__name__)
+
+# pyquery's translator, so jQuery extensions such as :eq() keep working.
+_translator = JQueryTranslator(xhtml=False)
+
+@functools.lru_cache(maxsize=4096)
+def compile_selector(css):
+    """Compile a css selector into an XPath callable on an lxml tree."""
+    xpath = _translator.css_to_xpath(css.replace('[@', '['),
+                                     'descendant-or-self::')
+    return etree.XPath(xpath)
+
+def compile_selectors(css_selectors):
+    """Compile a {info_type: [css selector]} dict, dropping invalid ones.
+
+    The result is cached by content, invalid selectors included, so a
+    site's selectors are compiled (and their errors logged) once per
+    process however many of its pages are scraped.  Do not modify it.
+    """
+    return _compile_selectors(tuple((info_type, tuple(selectors))
+                                    for info_type, selectors
+                                    in css_selectors.items()))
+
+@functools.lru_cache(maxsize=1024)
+def _compile_selectors(css_selectors):
+    compiled = {}
+    for info_type, selectors in css_selectors:
+        xpaths = []
+        for selector in selectors:
+            try:
+                xpaths.append(compile_selector(selector))
+            except Exception as e:
+                LOGGER.error('Invalid css %r: %r', selector, e)
+        compiled[info_type] = xpaths
+    return compiled
+
 class NoValidCssError(Exception):
     def __init__(self, value):
         self.value = value
@@ -8,10 +48,18 @@ class NoValidCssError(Exception):
         return repr(self.value)
 
 class Scraper(object):
+    """Extract data from pages with per-site css selectors.
+
+    The selectors are compiled to XPath when the Scraper is created
+    (compile_selectors caches them per process), and pages are queried
+    as lxml trees.
+    """
 
     def __init__(self, data):
         self.data = data
-        
+        for css_selectors in data.values():
+            compile_selectors(css_selectors)
+
     def find(self,f, lst):
         """ Reurn the first elem that evaluates to truth with function f"""
         for i in lst:
@@ -21,20 +69,21 @@ class Scraper(object):
         #LOGGER.error('Invalid css: %s')
         return None # None of the css_selectors was found on the html
 
-    def extract(self,info_type, q):
+    def extract(self,info_type, elements):
         """ Extract link or text dependig on data type"""
-        if not q:
+        if not elements:
             return None
         if info_type == 'image_css':
-            return [e.attr['src'] for e in q.items()]
+            return [e.get('src') for e in elements]
         else:
-            return [e.text() for e in q.items()]
+            return [pq(e).text() for e in elements]
 
-    def get_data(self, pyquery_tree, css_selectors):
-        """ Query the page with the css_selfelectors dict using pyquery"""
+    def get_data(self, tree, css_selectors):
+        """ Query the lxml tree with the css_selectors dict"""
         try:
-            css_rules = {info_type : self.extract(info_type, self.find(pyquery_tree, selectors)) 
-                         for info_type, selectors in css_selectors.items()}
+            compiled = compile_selectors(css_selectors)
+            css_rules = {info_type : self.extract(info_type, self.find(lambda xpath: xpath(tree), xpaths))
+                         for info_type, xpaths in compiled.items()}
         except Exception as e:
             print(e)
             return {'error': None}
@@ -57,11 +106,17 @@ class Scraper(object):
             if found:
                 return found
 
-    def scrape(self, url, html):
-        tree = pq(html)
+    def selectors_for(self, url):
+        """Return the css selectors of the site url belongs to, or None."""
         parts = urllib.parse.urlparse(url)
         root_url, port = urllib.parse.splitport(parts.netloc)
-        css_selectors = self.find_css_selectors(root_url)
+        return self.find_css_selectors(root_url)
+
+    def scrape(self, url, html):
+        """Scrape a page given as HTML text or as a parsed lxml tree."""
+        css_selectors = self.selectors_for(url)
         if not css_selectors:
             return {'error':None}
-        return self.get_data(tree, css_selectors)
+        if isinstance(html, (str, bytes)):
+            html = lxml_html.fromstring(html)
+        return self.get_data(html, css_selectors)
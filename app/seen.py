@@ -0,0 +1,164 @@
+#
+# Memory-bounded seen-URL stores
+#
+# Both stores share one interface: 'url in store', len(store), add(url),
+# update(urls) and filter_unseen(urls), which returns the URLs not seen
+# before (in order, without duplicates) and marks them seen.
+#
+from array import array
+import bisect
+import hashlib
+import heapq
+import math
+
+
+def _digest(url):
+    return hashlib.md5(url.encode('utf-8', 'surrogatepass')).digest()
+
+
+def fingerprint(url):
+    """Return a 64-bit fingerprint of a URL."""
+    return int.from_bytes(_digest(url)[:8], 'little')
+
+
+class FingerprintSet(object):
+    """Exact set of URLs stored as 64-bit fingerprints.
+
+    Fingerprints live in a sorted array('Q') (8 bytes per URL) searched
+    with bisect.  New fingerprints go to a small set first and are merged
+    into the array once that set grows past 1/16th of the array, so the
+    amortized insert cost stays low.
+    """
+
+    def __init__(self, min_merge=4096):
+        self.min_merge = min_merge
+        self._sorted = array('Q')
+        self._recent = set()
+
+    def __len__(self):
+        return len(self._sorted) + len(self._recent)
+
+    def _contains_fp(self, fp):
+        if fp in self._recent:
+            return True
+        i = bisect.bisect_left(self._sorted, fp)
+        return i < len(self._sorted) and self._sorted[i] == fp
+
+    def __contains__(self, url):
+        return self._contains_fp(fingerprint(url))
+
+    def _add_fp(self, fp):
+        self._recent.add(fp)
+        if len(self._recent) > max(self.min_merge, len(self._sorted) >> 4):
+            self._merge()
+
+    def _merge(self):
+        self._sorted = array('Q', heapq.merge(self._sorted,
+                                              sorted(self._recent)))
+        self._recent = set()
+
+    def add(self, url):
+        fp = fingerprint(url)
+        if not self._contains_fp(fp):
+            self._add_fp(fp)
+
+    def update(self, urls):
+        self.filter_unseen(urls)
+
+    def filter_unseen(self, urls):
+        new_urls = []
+        for url in urls:
+            fp = fingerprint(url)
+            if not self._contains_fp(fp):
+                self._add_fp(fp)
+                new_urls.append(url)
+        return new_urls
+
+
+class BloomFilter(object):
+    """Fixed-size Bloom filter for a given capacity and error rate."""
+
+    def __init__(self, capacity, error_rate):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.num_bits = max(8, int(math.ceil(
+            -capacity * math.log(error_rate) / (math.log(2) ** 2))))
+        self.num_hashes = max(1, int(round(
+            self.num_bits / capacity * math.log(2))))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+        self.count = 0
+
+    def _positions(self, digest):
+        # Kirsch-Mitzenmacher double hashing over the two digest halves.
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.num_bits
+                for i in range(self.num_hashes)]
+
+    def contains(self, digest):
+        bits = self.bits
+        for pos in self._positions(digest):
+            if not bits[pos >> 3] & (1 << (pos & 7)):
+                return False
+        return True
+
+    def add(self, digest):
+        bits = self.bits
+        for pos in self._positions(digest):
+            bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+
+class ScalableBloomFilter(object):
+    """Bloom filter that grows to keep its false-positive rate bounded.
+
+    A new filter, 'growth' times larger and with an error rate multiplied
+    by 'tightening', is added whenever the current one is full, so the
+    overall false-positive rate stays below error_rate / (1 - tightening).
+    A false positive makes the crawler skip a URL it never fetched.
+    """
+
+    def __init__(self, error_rate=0.001, initial_capacity=100000,
+                 growth=2, tightening=0.5):
+        self.error_rate = error_rate
+        self.growth = growth
+        self.tightening = tightening
+        self.filters = [BloomFilter(initial_capacity,
+                                    error_rate * (1 - tightening))]
+
+    def __len__(self):
+        return sum(f.count for f in self.filters)
+
+    def _contains_digest(self, digest):
+        for f in self.filters:
+            if f.contains(digest):
+                return True
+        return False
+
+    def __contains__(self, url):
+        return self._contains_digest(_digest(url))
+
+    def _add_digest(self, digest):
+        last = self.filters[-1]
+        if last.count >= last.capacity:
+            last = BloomFilter(last.capacity * self.growth,
+                               last.error_rate * self.tightening)
+            self.filters.append(last)
+        last.add(digest)
+
+    def add(self, url):
+        digest = _digest(url)
+        if not self._contains_digest(digest):
+            self._add_digest(digest)
+
+    def update(self, urls):
+        self.filter_unseen(urls)
+
+    def filter_unseen(self, urls):
+        new_urls = []
+        for url in urls:
+            digest = _digest(url)
+            if not self._contains_digest(digest):
+                self._add_digest(digest)
+                new_urls.append(url)
+        return new_urls
@@ -0,0 +1,275 @@
+#
+# Multi-process crawling with hosts partitioned between shards
+#
+import asyncio
+import logging
+import multiprocessing
+import queue
+import time
+import zlib
+try:
+    from app.scheduler import url_host
+    import app.reporting as reporting
+    import app.seen as seen
+except ImportError:
+    from scheduler import url_host
+    import reporting
+    import seen
+
+LOGGER = logging.getLogger(__name__)
+
+# Put in an inbox by the coordinator to stop a shard.
+STOP = None
+
+
+def shard_of(url, shards):
+    """Return the index of the shard owning url's host.
+
+    crc32 rather than hash(): it must agree between processes, and str
+    hashes are randomized per process.
+    """
+    return zlib.crc32(url_host(url).encode('utf-8')) % shards
+
+
+class Shard(object):
+    """The part of a crawl one process owns, and its links to the others.
+
+    A crawler given a Shard keeps the URLs whose host maps to index and
+    hands every other URL to keep_own(); those are sent in batches of
+    batch_size (or every poll_interval) to the inbox of the shard owning
+    them, which filters them through its own seen set.  A URL is only
+    forwarded the first time it is found: the URLs sent are kept in a
+    seen.FingerprintSet, so the traffic grows with the number of
+    distinct URLs rather than of links.
+
+    run() replaces the crawler's q.join(): it feeds the URLs arriving in
+    this shard's inbox to the crawler and reports to the coordinator,
+    through control, whether the shard is idle along with the number of
+    URLs it sent and received, until the coordinator puts STOP in the
+    inbox.
+    """
+
+    def __init__(self, index, count, inboxes, control, batch_size=500,
+                 poll_interval=0.05, *, loop=None):
+        self.loop = loop or asyncio.get_event_loop()
+        self.index = index
+        self.count = count
+        self.inboxes = inboxes
+        self.control = control
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.outbox = [[] for _ in range(count)]
+        self.forwarded = seen.FingerprintSet()
+        self.sent = 0
+        self.received = 0
+        self.reports = 0
+
+    def owns(self, url):
+        return shard_of(url, self.count) == self.index
+
+    def keep_own(self, urls, max_redirect):
+        """Return the URLs this shard owns and forward the others."""
+        own = []
+        for url in urls:
+            target = shard_of(url, self.count)
+            if target == self.index:
+                own.append(url)
+                continue
+            if url in self.forwarded:
+                continue
+            self.forwarded.add(url)
+            batch = self.outbox[target]
+            batch.append((url, max_redirect))
+            if len(batch) >= self.batch_size:
+                self.flush(target)
+        return own
+
+    def flush(self, target=None):
+        """Send the buffered URLs of target, or of every shard."""
+        targets = range(self.count) if target is None else [target]
+        for target in targets:
+            batch = self.outbox[target]
+            if batch:
+                self.outbox[target] = []
+                self.inboxes[target].put(batch)
+                self.sent += len(batch)
+
+    def _receive(self):
+        try:
+            return self.inboxes[self.index].get(timeout=self.poll_interval)
+        except queue.Empty:
+            return []
+
+    def report(self, crawler):
+        self.reports += 1
+        idle = crawler.q.idle() and not any(self.outbox)
+        self.control.put(('status', self.index, self.reports, idle,
+                          self.sent, self.received))
+
+    @asyncio.coroutine
+    def run(self, crawler):
+        """Crawl until the coordinator detects global completion."""
+        while True:
+            self.flush()
+            self.report(crawler)
+            batch = yield from self.loop.run_in_executor(None, self._receive)
+            if batch is STOP:
+                return
+            self.received += len(batch)
+            by_redirect = {}
+            for url, max_redirect in batch:
+                by_redirect.setdefault(max_redirect, []).append(url)
+            for max_redirect, urls in by_redirect.items():
+                crawler.add_urls(urls, max_redirect)
+            if batch:
+                # Let the workers pick up what arrived before reporting.
+                yield from asyncio.sleep(0, loop=self.loop)
+
+
+class Termination(object):
+    """Detect that all shards are idle with no URLs in transit.
+
+    A single round of status reports is not enough: a shard may report
+    idle and then receive a batch sent by a shard that reports later, so
+    the totals balance while work is going on.  Following the
+    four-counter method, the crawl is over only when every shard has
+    reported idle twice in a row with the same counters and the sent and
+    received totals are equal.
+    """
+
+    def __init__(self, count):
+        self.count = count
+        self.status = {}
+        self.snapshot = None
+
+    def update(self, index, seq, idle, sent, received):
+        """Record one status report; return True once the crawl is over."""
+        self.status[index] = (seq, idle, sent, received)
+        if len(self.status) < self.count:
+            return False
+        if not self._quiet(self.status):
+            self.snapshot = None
+            return False
+        if self.snapshot is None:
+            self.snapshot = dict(self.status)
+            return False
+        for index, (seq, idle, sent, received) in self.status.items():
+            old_seq, _, old_sent, old_received = self.snapshot[index]
+            if (sent, received) != (old_sent, old_received):
+                self.snapshot = dict(self.status)
+                return False
+            if seq == old_seq:
+                return False
+        return True
+
+    @staticmethod
+    def _quiet(status):
+        sent = received = 0
+        for _, idle, s, r in status.values():
+            if not idle:
+                return False
+            sent += s
+            received += r
+        return sent == received
+
+
+def run_shard(index, count, inboxes, control, make_crawler):
+    """Process entry point: crawl shard index of count.
+
+    make_crawler(loop=, shard=) builds the Crawler; when it is done its
+    stats and metrics are sent to the coordinator.
+    """
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    shard = Shard(index, count, inboxes, control, loop=loop)
+    crawler = make_crawler(loop=loop, shard=shard)
+    try:
+        loop.run_until_complete(crawler.crawl())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        # URLs still in transit are only left after an interrupt; do not
+        # wait for shards that are gone to read them.
+        for inbox in inboxes:
+            inbox.cancel_join_thread()
+        stats, log = crawler.stats, crawler.stats.log
+        stats.log = None
+        control.put(('stats', index, stats, crawler.metrics,
+                     crawler.t0, crawler.t1 or time.time()))
+        crawler.close()
+        if log is not None:
+            log.close()
+        if crawler.page_cache is not None:
+            crawler.page_cache.close()
+        loop.stop()
+        loop.run_forever()
+        loop.close()
+
+
+def crawl(count, make_crawler, file=None):
+    """Crawl with count processes and print the merged report.
+
+    make_crawler must be picklable (e.g. a functools.partial of a module
+    level function) and is called in each process as described in
+    run_shard().
+    """
+    inboxes = [multiprocessing.Queue() for _ in range(count)]
+    control = multiprocessing.Queue()
+    processes = [multiprocessing.Process(
+        target=run_shard, args=(i, count, inboxes, control, make_crawler))
+        for i in range(count)]
+    for process in processes:
+        process.start()
+    termination = Termination(count)
+    results = {}
+    stopping = False
+    try:
+        while len(results) < count:
+            try:
+                message = control.get(timeout=1.0)
+            except queue.Empty:
+                if any(not process.is_alive()
+                       for i, process in enumerate(processes)
+                       if i not in results):
+                    LOGGER.error('a crawler process died')
+                    break
+                continue
+            except KeyboardInterrupt:
+                if stopping:
+                    raise
+                message = ('interrupted',)
+            if message[0] == 'stats':
+                results[message[1]] = message[2:]
+            elif not stopping and (message[0] == 'interrupted' or
+                                   termination.update(*message[1:])):
+                stopping = True
+                for inbox in inboxes:
+                    inbox.put(STOP)
+    finally:
+        for inbox in inboxes:
+            inbox.cancel_join_thread()
+        for process in processes:
+            process.join(5)
+            if process.is_alive():
+                process.terminate()
+    report(results.values(), file=file)
+    return results
+
+
+def report(results, file=None):
+    """Print the merged report of (stats, metrics, t0, t1) results."""
+    results = list(results)
+    if not results:
+        return
+    stats = reporting.StatsAggregator()
+    latency = {}
+    for shard_stats, shard_metrics, _, _ in results:
+        stats.merge(shard_stats)
+        for phase, histogram in shard_metrics.latency.items():
+            if phase in latency:
+                latency[phase].merge(histogram)
+            else:
+                latency[phase] = histogram
+    t0 = min(result[2] for result in results)
+    t1 = max(result[3] for result in results)
+    reporting.report_stats(stats, latency, t1 - t0, file=file)
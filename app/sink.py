@@ -0,0 +1,119 @@
+#
+# Scraped data handlers
+#
+import asyncio
+import json
+import logging
+
+LOGGER = logging.getLogger(__name__)
+
+
+class DataHandler(object):
+    """Receives the data scraped from each page (see Crawler.work)."""
+
+    @asyncio.coroutine
+    def handle(self, root, url, data):
+        raise NotImplementedError('You need to define a handle method!')
+
+    @asyncio.coroutine
+    def close(self):
+        pass
+
+
+class RedisDataHandler(DataHandler):
+    """Push scraped records to the Redis list '<root>:product_info'.
+
+    Records are JSON encoded and buffered; the buffer is flushed with one
+    pipelined MULTI/EXEC of RPUSHes (one per list) when it holds
+    batch_size records or every flush_interval seconds.  Only one flush
+    runs at a time: a worker whose record fills the buffer while Redis is
+    still busy with the previous flush waits for it, which keeps workers
+    from outrunning Redis.
+
+    The records of a flush that fails are put back in front of the
+    buffer, to go with the next flush, unless that makes more than
+    max_buffered records: then they are dropped and counted in lost.
+
+    connection is an asyncio_redis Connection (or Pool) that is not used
+    for blocking commands.
+    """
+
+    def __init__(self, connection, batch_size=100, flush_interval=1.0,
+                 max_buffered=100000, *, loop=None):
+        self.loop = loop or asyncio.get_event_loop()
+        self.connection = connection
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_buffered = max_buffered
+        self.buffer = {}
+        self.pending = 0
+        self.pushed = 0
+        self.lost = 0
+        self._lock = asyncio.Lock(loop=self.loop)
+        self._timer = None
+
+    @asyncio.coroutine
+    def handle(self, root, url, data):
+        record = dict(data, url=url)
+        self.buffer.setdefault(root + ':product_info', []).append(
+            json.dumps(record))
+        self.pending += 1
+        if self._timer is None:
+            self._timer = asyncio.Task(self._flush_periodically(),
+                                       loop=self.loop)
+        if self.pending >= self.batch_size:
+            yield from self.flush()
+
+    @asyncio.coroutine
+    def _flush_periodically(self):
+        while True:
+            yield from asyncio.sleep(self.flush_interval, loop=self.loop)
+            if self.pending:
+                try:
+                    yield from self.flush()
+                except Exception as e:
+                    LOGGER.error('flushing scraped data failed: %r', e)
+
+    @asyncio.coroutine
+    def flush(self):
+        """Push every buffered record in one round-trip."""
+        with (yield from self._lock):
+            if not self.pending:
+                return
+            buffer, count = self.buffer, self.pending
+            self.buffer, self.pending = {}, 0
+            pushed = False
+            try:
+                transaction = yield from self.connection.multi()
+                futures = []
+                for key, values in buffer.items():
+                    futures.append((yield from transaction.rpush(key, values)))
+                yield from transaction.exec()
+                for future in futures:
+                    yield from future
+                pushed = True
+            finally:
+                if not pushed:
+                    self._restore(buffer, count)
+            self.pushed += count
+            LOGGER.debug('pushed %i records to %i lists', count, len(buffer))
+
+    def _restore(self, buffer, count):
+        """Put the records of a failed flush back in front of the buffer."""
+        if self.pending + count > self.max_buffered:
+            self.lost += count
+            LOGGER.error('dropped %i scraped records (%i lost so far)',
+                         count, self.lost)
+            return
+        for key, values in buffer.items():
+            values.extend(self.buffer.get(key, ()))
+            self.buffer[key] = values
+        self.pending += count
+
+    @asyncio.coroutine
+    def close(self):
+        """Flush what is left and stop the flush timer."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        yield from self.flush()
@@ -0,0 +1,233 @@
+#
+# Seeding a crawl from the sitemaps of its sites
+#
+import asyncio
+import calendar
+import collections
+import logging
+import re
+import zlib
+from lxml import etree
+try:
+    import app.robots as robots
+except ImportError:
+    import robots
+
+LOGGER = logging.getLogger(__name__)
+
+SitemapEntry = collections.namedtuple('SitemapEntry',
+                                      ['is_index', 'loc', 'lastmod'])
+
+_W3C_DATETIME = re.compile(
+    r'(\d{4})(?:-(\d\d)(?:-(\d\d)'
+    r'(?:[T ](\d\d):(\d\d)(?::(\d\d)(?:\.\d+)?)?'
+    r'(Z|[+-]\d\d:?\d\d)?)?)?)?$')
+
+
+def parse_lastmod(text):
+    """Return a W3C datetime (sitemap lastmod) as a POSIX timestamp.
+
+    Dates without a time zone are taken as UTC.  Returns None for text
+    that is not a W3C datetime.
+    """
+    if not text:
+        return None
+    match = _W3C_DATETIME.match(text.strip())
+    if match is None:
+        return None
+    year, month, day, hour, minute, second, zone = match.groups()
+    try:
+        timestamp = calendar.timegm((int(year), int(month or 1),
+                                     int(day or 1), int(hour or 0),
+                                     int(minute or 0), int(second or 0)))
+    except (ValueError, OverflowError):
+        return None
+    if zone and zone != 'Z':
+        offset = (int(zone[1:3]) * 60 + int(zone[-2:])) * 60
+        timestamp += -offset if zone[0] == '+' else offset
+    return float(timestamp)
+
+
+def _localname(tag):
+    return tag.rpartition('}')[2]
+
+
+class SitemapParser(object):
+    """Incremental parser of a sitemap or sitemap index.
+
+    feed() takes the body chunk by chunk as it is downloaded and returns
+    the SitemapEntry's completed so far; close() returns the last ones.
+    A gzipped body (by its magic number) is decompressed on the fly.
+    Every <url> or <sitemap> element is dropped from the tree once read,
+    so memory does not grow with the size of the sitemap.  ValueError is
+    raised once more than max_bytes of XML are fed.
+    """
+
+    def __init__(self, max_bytes=50 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._decompressor = None
+        self._started = False
+        self._parser = etree.XMLPullParser(events=('end',),
+                                           resolve_entities=False,
+                                           no_network=True)
+
+    def feed(self, data):
+        if not self._started:
+            if not data:
+                return []
+            self._started = True
+            if data[:2] == b'\x1f\x8b':
+                self._decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        if self._decompressor is not None:
+            data = self._decompressor.decompress(
+                data, self.max_bytes - self.size + 1)
+        self._parse(data)
+        return list(self._entries())
+
+    def close(self):
+        if self._decompressor is not None:
+            self._parse(self._decompressor.flush())
+        if self._started:
+            self._parser.close()
+        return list(self._entries())
+
+    def _parse(self, data):
+        self.size += len(data)
+        if self.size > self.max_bytes:
+            raise ValueError('sitemap larger than %d bytes' % self.max_bytes)
+        self._parser.feed(data)
+
+    def _entries(self):
+        for _, element in self._parser.read_events():
+            if not isinstance(element.tag, str):
+                continue
+            name = _localname(element.tag)
+            if name not in ('url', 'sitemap'):
+                continue
+            loc = lastmod = None
+            for child in element:
+                if not isinstance(child.tag, str):
+                    continue
+                child_name = _localname(child.tag)
+                if child_name == 'loc':
+                    loc = (child.text or '').strip()
+                elif child_name == 'lastmod':
+                    lastmod = parse_lastmod(child.text)
+            element.clear()
+            while element.getprevious() is not None:
+                del element.getparent()[0]
+            if loc:
+                yield SitemapEntry(name == 'sitemap', loc, lastmod)
+
+
+class SitemapSeeder(object):
+    """Find the sitemaps of a site and hand their URLs to the crawler.
+
+    The sitemaps are those listed in the site's robots.txt, or
+    /sitemap.xml if it lists none.  Sitemap indexes are followed, up to
+    max_sitemaps sitemaps per site.  Bodies are parsed as they are
+    downloaded (see SitemapParser) and the URLs handed to add() in
+    batches of batch_size (url, lastmod) pairs, up to max_urls per site.
+    """
+
+    def __init__(self, max_sitemaps=100, max_urls=1000000,
+                 max_bytes=50 * 1024 * 1024, batch_size=1000, timeout=30.0,
+                 chunk_size=64 * 1024, *, loop=None):
+        self.loop = loop or asyncio.get_event_loop()
+        self.max_sitemaps = max_sitemaps
+        self.max_urls = max_urls
+        self.max_bytes = max_bytes
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self.chunk_size = chunk_size
+        self.robots = None
+        self.seeded = set()
+        self.sitemaps = 0
+        self.urls = 0
+        self.errors = 0
+
+    @asyncio.coroutine
+    def seed(self, root, session, add, robots_cache=None):
+        """Feed add() the URLs of the sitemaps of root's site, once per site.
+
+        robots_cache is the robots.RobotsCache the sitemaps are looked
+        up in; the seeder keeps one of its own if none is given.
+        """
+        site, _ = robots.split_url(root)
+        if site in self.seeded:
+            return
+        self.seeded.add(site)
+        if robots_cache is None:
+            if self.robots is None:
+                self.robots = robots.RobotsCache(loop=self.loop)
+            robots_cache = self.robots
+        rules = yield from robots_cache.rules(root, session)
+        queue = collections.deque(rules.sitemaps or [site + '/sitemap.xml'])
+        listed = set(queue)
+        fetched = urls = 0
+        while queue and fetched < self.max_sitemaps and urls < self.max_urls:
+            url = queue.popleft()
+            fetched += 1
+            children = []
+            urls += yield from self.fetch(url, session, add, children,
+                                          self.max_urls - urls)
+            for child in children:
+                if child not in listed:
+                    listed.add(child)
+                    queue.append(child)
+        LOGGER.info('%d URLs in %d sitemaps of %r', urls, fetched, site)
+
+    @asyncio.coroutine
+    def fetch(self, url, session, add, children, max_urls):
+        """Stream one sitemap; return the number of URLs given to add()."""
+        self.sitemaps += 1
+        count = 0
+        batch = []
+        parser = SitemapParser(self.max_bytes)
+        try:
+            response = yield from asyncio.wait_for(
+                session.get(url), self.timeout, loop=self.loop)
+            try:
+                if response.status != 200:
+                    LOGGER.warning('sitemap %r returned %r', url,
+                                   response.status)
+                    self.errors += 1
+                    return 0
+                done = False
+                while not done:
+                    chunk = yield from asyncio.wait_for(
+                        response.content.read(self.chunk_size), self.timeout,
+                        loop=self.loop)
+                    done = not chunk
+                    entries = (parser.close() if done else
+                               parser.feed(bytes(chunk)))
+                    for entry in entries:
+                        if entry.is_index:
+                            children.append(entry.loc)
+                        elif count < max_urls:
+                            batch.append((entry.loc, entry.lastmod))
+                            count += 1
+                            if len(batch) >= self.batch_size:
+                                add(batch)
+                                batch = []
+                    if count >= max_urls:
+                        break
+                if batch:
+                    add(batch)
+                    batch = []
+            finally:
+                response.close()
+        except (asyncio.CancelledError, GeneratorExit):
+            raise
+        except Exception as e:
+            LOGGER.warning('reading sitemap %r failed: %r', url, e)
+            self.errors += 1
+            if batch:
+                add(batch)
+        self.urls += count
+        return count
+
+    def report(self, file=None):
+        print('Sitemaps: %d fetched, %d failed, %d URLs' %
+              (self.sitemaps, self.errors, self.urls), file=file)
@@ -3,6 +3,7 @@
 #
 import urllib.parse
 import re
+from collections import OrderedDict
 
 def lenient_host(host):
     parts = host.split('.')[-2:]
@@ -51,7 +52,12 @@ def verify_headers(response):
         encoding = pdict.get('charset', 'utf-8')
         return content_type in ('text/html', 'application/xml')
 
-def url_allowed(url, root_domains, exclude=None, strict=True):
+def url_allowed(url, root_domains, exclude=None, strict=True, robots=None):
+    """Check if a URL should be crawled.
+
+    robots, if given, is a robots.RobotsCache whose cached rules the URL
+    must be allowed by.
+    """
     if exclude and re.search(exclude, url):
         return False
     parts = urllib.parse.urlparse(url)
@@ -62,4 +68,67 @@ def url_allowed(url, root_domains, exclude=None, strict=True):
     if not host_okay(host, root_domains, strict):
         #LOGGER.debug('skipping non-root host in %r', url)
         return False
+    if robots is not None and not robots.allowed(url):
+        return False
     return True
+
+def _split_netloc(url):
+    """Return the netloc of an http(s) URL, or None for other schemes."""
+    head = url[:8].lower()
+    if head.startswith('http://'):
+        start = 7
+    elif head == 'https://':
+        start = 8
+    else:
+        return None
+    end = len(url)
+    for sep in '/?#':
+        i = url.find(sep, start, end)
+        if i != -1:
+            end = i
+    return url[start:end]
+
+class UrlFilter(object):
+    """URL admission test built once per crawler.
+
+    Same test as url_allowed, but the exclude pattern is compiled once,
+    the host is sliced out of the URL without a full urlparse, and the
+    host decision is kept in an LRU cache of cache_size entries, so
+    admitting a URL costs a regex search and a dict lookup (plus, with
+    robots, one match of the compiled robots.txt rules of its host).
+    """
+
+    def __init__(self, root_domains, exclude=None, strict=True,
+                 cache_size=1024, robots=None):
+        self.root_domains = root_domains
+        self.exclude = re.compile(exclude) if exclude else None
+        self.strict = strict
+        self.robots = robots
+        self.cache_size = cache_size
+        self._hosts = OrderedDict()
+
+    def netloc_allowed(self, netloc):
+        try:
+            allowed = self._hosts[netloc]
+        except KeyError:
+            host, port = urllib.parse.splitport(netloc.rpartition('@')[2])
+            allowed = bool(host) and host_okay(host, self.root_domains,
+                                               self.strict)
+            self._hosts[netloc] = allowed
+            if len(self._hosts) > self.cache_size:
+                self._hosts.popitem(last=False)
+        else:
+            self._hosts.move_to_end(netloc)
+        return allowed
+
+    def allowed(self, url):
+        if self.exclude and self.exclude.search(url):
+            return False
+        netloc = _split_netloc(url)
+        if netloc is None or not self.netloc_allowed(netloc):
+            return False
+        return self.robots is None or self.robots.allowed(url)
+
+    def filter(self, urls):
+        """Return the allowed URLs, in order."""
+        return [url for url in urls if self.allowed(url)]
@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+"""End-to-end crawler benchmark against a synthetic local site.
+
+The site (see site.SyntheticSite) runs in a child process, so the CPU
+time and peak RSS measured are those of the crawler alone.  Run from
+the top of the repository:
+
+    python -m benchmarks.crawl_bench --pages 2000 --latency 0.01 -o out.json
+
+and compare the JSON results of two revisions.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import json
+import logging
+import math
+import multiprocessing
+import platform
+import resource
+import sys
+import time
+import app.concurrency as concurrency
+import app.crawling as crawling
+from app.retry import RetryPolicy
+from benchmarks.site import SyntheticSite
+
+ARGS = argparse.ArgumentParser(description='Crawler benchmark')
+ARGS.add_argument(
+    '--pages', action='store', type=int, metavar='N',
+    default=1000, help='Pages of the synthetic site')
+ARGS.add_argument(
+    '--fanout', action='store', type=int, metavar='N',
+    default=10, help='Links per page')
+ARGS.add_argument(
+    '--body_size', action='store', type=int, metavar='BYTES',
+    default=16 * 1024, help='Size of a page body')
+ARGS.add_argument(
+    '--latency', action='store', type=float, metavar='SECONDS',
+    default=0.0, help='Mean response latency of the site')
+ARGS.add_argument(
+    '--error_rate', action='store', type=float, metavar='P',
+    default=0.0, help='Fraction of responses that are 500 errors')
+ARGS.add_argument(
+    '--hosts', action='store', type=int, metavar='N',
+    default=4, help='Hosts (local ports) the pages are spread across')
+ARGS.add_argument(
+    '--seed', action='store', type=int,
+    default=0, help='Seed of the site generator')
+ARGS.add_argument(
+    '--max_tasks', action='store', type=int, metavar='N',
+    default=100, help='Crawler tasks')
+ARGS.add_argument(
+    '--max_connections_per_host', action='store', type=int, metavar='N',
+    default=3, help='Crawler connections per host')
+ARGS.add_argument(
+    '--adaptive', action='store_true',
+    default=False, help='Tune the concurrency of each host (AIMD)')
+ARGS.add_argument(
+    '--retry_base_delay', action='store', type=float, metavar='SECONDS',
+    default=0.01, help='Crawler retry backoff base')
+ARGS.add_argument(
+    '-o', '--output', action='store', metavar='PATH',
+    help='Write the JSON results to PATH (default: stdout)')
+
+SITE_OPTIONS = ('pages', 'fanout', 'body_size', 'latency', 'error_rate',
+                'hosts', 'seed')
+CRAWLER_OPTIONS = ('max_tasks', 'max_connections_per_host', 'adaptive',
+                   'retry_base_delay')
+
+
+class TimedCrawler(crawling.Crawler):
+    """Crawler keeping the duration of every fetch (and try)."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.latencies = []
+
+    @asyncio.coroutine
+    def fetch(self, url, max_redirect, tries=0):
+        t0 = time.monotonic()
+        try:
+            return (yield from super().fetch(url, max_redirect, tries))
+        finally:
+            self.latencies.append(time.monotonic() - t0)
+
+
+def percentile(values, p):
+    """Nearest-rank p-th percentile of a sorted list."""
+    if not values:
+        return 0.0
+    rank = max(1, math.ceil(p / 100.0 * len(values)))
+    return values[rank - 1]
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process, in MiB."""
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on macOS, kilobytes elsewhere.
+    return rss / (1024.0 * 1024 if sys.platform == 'darwin' else 1024)
+
+
+def serve(options, conn):
+    """Child process: serve a SyntheticSite until conn is closed."""
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    site = SyntheticSite(loop=loop, **options)
+    loop.run_until_complete(site.start())
+    conn.send(site.roots())
+    done = asyncio.Event(loop=loop)
+    loop.add_reader(conn.fileno(), done.set)
+    loop.run_until_complete(done.wait())
+    loop.run_until_complete(site.close())
+    conn.send({'requests': site.requests, 'errors': site.errors})
+    loop.close()
+
+
+@asyncio.coroutine
+def crawl(roots, options, *, loop):
+    controller = None
+    if options.get('adaptive'):
+        controller = concurrency.AimdController(
+            initial=options['max_connections_per_host'])
+    crawler = TimedCrawler(
+        roots,
+        max_tasks=options['max_tasks'],
+        max_connections_per_host=options['max_connections_per_host'],
+        retry_policy=RetryPolicy(base_delay=options['retry_base_delay'],
+                                 max_delay=1.0),
+        concurrency=controller,
+        loop=loop)
+    try:
+        yield from crawler.crawl()
+    finally:
+        crawler.close()
+    return crawler
+
+
+def results(crawler, seconds, cpu_seconds):
+    latencies = sorted(crawler.latencies)
+    errors = sum(1 for stat in crawler.done
+                 if stat.exception or (stat.status or 0) >= 400)
+    pages = crawler.metrics.pages
+    return {
+        'pages': pages,
+        'urls': len(crawler.done),
+        'fetches': len(latencies),
+        'errors': errors,
+        'seconds': seconds,
+        'pages_per_second': pages / seconds if seconds else 0.0,
+        'latency': {
+            'mean': sum(latencies) / len(latencies) if latencies else 0.0,
+            'p50': percentile(latencies, 50),
+            'p99': percentile(latencies, 99),
+            'max': latencies[-1] if latencies else 0.0,
+        },
+        'cpu_seconds': cpu_seconds,
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def run(options):
+    """Crawl a synthetic site in a child process; return the results."""
+    site_options = {name: options[name] for name in SITE_OPTIONS}
+    conn, child_conn = multiprocessing.Pipe()
+    server = multiprocessing.Process(target=serve,
+                                     args=(site_options, child_conn))
+    server.start()
+    try:
+        roots = conn.recv()
+        loop = asyncio.new_event_loop()
+        try:
+            t0 = time.monotonic()
+            cpu0 = time.process_time()
+            crawler = loop.run_until_complete(crawl(roots, options,
+                                                    loop=loop))
+            cpu_seconds = time.process_time() - cpu0
+            seconds = time.monotonic() - t0
+        finally:
+            loop.close()
+        conn.send(None)
+        site = conn.recv()
+    finally:
+        server.join(10)
+        if server.is_alive():
+            server.terminate()
+    return {
+        'benchmark': 'crawl',
+        'python': platform.python_version(),
+        'options': options,
+        'site': site,
+        'results': results(crawler, seconds, cpu_seconds),
+    }
+
+
+def main():
+    args = ARGS.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+    options = {name: getattr(args, name)
+               for name in SITE_OPTIONS + CRAWLER_OPTIONS}
+    # Keep stdout for the JSON.
+    with contextlib.redirect_stdout(sys.stderr):
+        report = run(options)
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""Benchmark link extraction: links.extract_links against lxml.
+
+The lxml path is what parsing.parse_page did before links.py: build
+the tree, make_links_absolute() and walk iterlinks().  Both run over
+the HTML fixtures of unit_tests/resources (or the files given):
+
+    python -m benchmarks.links_bench -o links.json
+"""
+
+import argparse
+import glob
+import json
+import os
+import platform
+import time
+from lxml import html
+import app.links as links
+
+RESOURCES = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'unit_tests', 'resources')
+
+ARGS = argparse.ArgumentParser(description='Link extraction benchmark')
+ARGS.add_argument(
+    'pages', nargs='*', metavar='HTML',
+    help='HTML files (default: the fixtures of unit_tests/resources)')
+ARGS.add_argument(
+    '--repeat', action='store', type=int, metavar='N',
+    default=200, help='Extractions per page and method')
+ARGS.add_argument(
+    '-o', '--output', action='store', metavar='PATH',
+    help='Write the JSON results to PATH (default: stdout)')
+
+BASE_URL = 'http://shop.example/category/page.html'
+
+
+def lxml_links(page, base_url):
+    tree = html.fromstring(page)
+    tree.make_links_absolute(base_url)
+    return [link[2] for link in tree.iterlinks()]
+
+
+def extractor_links(page, base_url):
+    return links.extract_links(page, base_url)
+
+
+METHODS = (('lxml', lxml_links), ('extractor', extractor_links))
+
+
+def timed(function, page, repeat):
+    """Best of 3 runs of repeat calls, in seconds per call."""
+    best = None
+    for _ in range(3):
+        t0 = time.perf_counter()
+        for _ in range(repeat):
+            function(page, BASE_URL)
+        per_call = (time.perf_counter() - t0) / repeat
+        best = per_call if best is None else min(best, per_call)
+    return best
+
+
+def run(paths, repeat):
+    results = {}
+    for path in paths:
+        with open(path, 'rb') as f:
+            page = f.read()
+        result = {'bytes': len(page)}
+        for name, function in METHODS:
+            result[name] = {'seconds': timed(function, page, repeat),
+                            'links': len(function(page, BASE_URL))}
+        result['speedup'] = (result['lxml']['seconds'] /
+                             result['extractor']['seconds'])
+        results[os.path.basename(path)] = result
+    return {
+        'benchmark': 'links',
+        'python': platform.python_version(),
+        'repeat': repeat,
+        'pages': results,
+    }
+
+
+def main():
+    args = ARGS.parse_args()
+    paths = args.pages or sorted(glob.glob(os.path.join(RESOURCES, '*.html')))
+    text = json.dumps(run(paths, args.repeat), indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+#
+# Synthetic web site for the crawler benchmarks
+#
+import asyncio
+import random
+import socket
+from aiohttp import web
+
+WORDS = ('oak table chair sofa walnut lamp shelf cushion linen rug mirror '
+         'drawer bench stool frame basket vase curtain desk bed').split()
+
+
+def find_unused_port():
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    s.bind(('127.0.0.1', 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+
+class SyntheticSite(object):
+    """A site of pages pages served by hosts local servers (one port each).
+
+    Page i lives at /p/<i> on host i % hosts, so a crawl sees hosts
+    distinct netlocs.  It links to fanout pages: its children in a tree
+    rooted at page 0 (so every page is reachable), then random pages.
+    Bodies are padded with text to body_size bytes.  Each response waits
+    latency seconds, +/- 50%, and fails with a 500 with probability
+    error_rate.  Pages and latencies are drawn from seed, so two sites
+    with the same arguments serve the same pages.
+    """
+
+    def __init__(self, pages=1000, fanout=10, body_size=16 * 1024,
+                 latency=0.0, error_rate=0.0, hosts=4, seed=0, *, loop=None):
+        self.loop = loop or asyncio.get_event_loop()
+        self.pages = pages
+        self.fanout = fanout
+        self.body_size = body_size
+        self.latency = latency
+        self.error_rate = error_rate
+        self.hosts = hosts
+        self.seed = seed
+        self.rng = random.Random(seed)
+        self.ports = []
+        self.requests = 0
+        self.errors = 0
+        self._servers = []
+        self._handlers = []
+
+    def url(self, i):
+        return 'http://127.0.0.1:%d/p/%d' % (self.ports[i % self.hosts], i)
+
+    def roots(self):
+        """URLs to start a crawl from: page 0, and the home of every host."""
+        return [self.url(0)] + ['http://127.0.0.1:%d/' % port
+                                for port in self.ports[1:]]
+
+    def links(self, i):
+        rng = random.Random(self.seed * 1000003 + i)
+        links = [child for child in range(i * self.fanout + 1,
+                                          (i + 1) * self.fanout + 1)
+                 if child < self.pages]
+        while len(links) < self.fanout:
+            links.append(rng.randrange(self.pages))
+        return links
+
+    def body(self, i):
+        rng = random.Random(self.seed * 1000003 + i)
+        parts = ['<!DOCTYPE html><html><head><title>Page %d</title></head>'
+                 '<body><h1>Page %d</h1><ul>' % (i, i)]
+        parts.extend('<li><a href="%s">page %d</a></li>' % (self.url(j), j)
+                     for j in self.links(i))
+        parts.append('</ul><p>')
+        size = sum(len(part) for part in parts)
+        while size < self.body_size:
+            word = rng.choice(WORDS) + ' '
+            parts.append(word)
+            size += len(word)
+        parts.append('</p></body></html>')
+        return ''.join(parts).encode('utf-8')
+
+    @asyncio.coroutine
+    def wait(self):
+        if self.latency:
+            yield from asyncio.sleep(
+                self.latency * self.rng.uniform(0.5, 1.5), loop=self.loop)
+
+    @asyncio.coroutine
+    def page(self, request):
+        self.requests += 1
+        yield from self.wait()
+        if self.rng.random() < self.error_rate:
+            self.errors += 1
+            return web.Response(status=500, body=b'synthetic error')
+        try:
+            i = int(request.match_info['page'])
+        except ValueError:
+            raise web.HTTPNotFound()
+        if not 0 <= i < self.pages:
+            raise web.HTTPNotFound()
+        return web.Response(body=self.body(i), headers=[
+            ('CONTENT-TYPE', 'text/html; charset=utf-8')])
+
+    @asyncio.coroutine
+    def home(self, request):
+        self.requests += 1
+        yield from self.wait()
+        # Hosts other than the first one link back into the tree.
+        return web.Response(
+            body=('<a href="%s">start</a>' % self.url(0)).encode('utf-8'),
+            headers=[('CONTENT-TYPE', 'text/html; charset=utf-8')])
+
+    @asyncio.coroutine
+    def start(self):
+        """Start one server per host."""
+        for _ in range(self.hosts):
+            port = find_unused_port()
+            app = web.Application(loop=self.loop)
+            app.router.add_route('GET', '/p/{page}', self.page)
+            app.router.add_route('GET', '/', self.home)
+            handler = app.make_handler()
+            server = yield from self.loop.create_server(handler, '127.0.0.1',
+                                                        port)
+            self.ports.append(port)
+            self._handlers.append(handler)
+            self._servers.append(server)
+
+    @asyncio.coroutine
+    def close(self):
+        for handler in self._handlers:
+            yield from handler.finish_connections()
+        for server in self._servers:
+            server.close()
+            yield from server.wait_closed()
@@ -0,0 +1,59 @@
+import asyncio
+import unittest
+from benchmarks import crawl_bench
+from benchmarks.site import SyntheticSite
+
+
+class TestCrawlBenchmark(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(None)
+        self.addCleanup(self.loop.close)
+
+    def start_site(self, **kwargs):
+        site = SyntheticSite(loop=self.loop, **kwargs)
+        self.loop.run_until_complete(site.start())
+        self.addCleanup(lambda: self.loop.run_until_complete(site.close()))
+        return site
+
+    def test_site(self):
+        site = SyntheticSite(pages=50, fanout=3, body_size=1000, hosts=2,
+                             loop=self.loop)
+        site.ports = [1, 2]
+        self.assertEqual([1, 2, 3], site.links(0))
+        self.assertEqual(3, len(site.links(49)))
+        self.assertEqual(site.links(49), site.links(49))
+        body = site.body(1)
+        self.assertGreaterEqual(len(body), 1000)
+        self.assertIn(b'href="http://127.0.0.1:1/p/4"', body)
+        self.assertIn(b'href="http://127.0.0.1:2/p/5"', body)
+
+    def test_crawl(self):
+        site = self.start_site(pages=40, fanout=4, body_size=512, hosts=3,
+                               error_rate=0.1)
+        options = {'max_tasks': 10, 'max_connections_per_host': 3,
+                   'retry_base_delay': 0.001}
+        crawler = self.loop.run_until_complete(
+            crawl_bench.crawl(site.roots(), options, loop=self.loop))
+        results = crawl_bench.results(crawler, 1.0, 0.5)
+        # The pages and the home pages of the two other hosts.
+        self.assertEqual(42, results['pages'])
+        self.assertEqual(site.requests, results['fetches'])
+        self.assertEqual(42 + site.errors, results['fetches'])
+        self.assertEqual(42.0, results['pages_per_second'])
+        self.assertLessEqual(results['latency']['p50'],
+                             results['latency']['p99'])
+        self.assertGreater(results['peak_rss_mb'], 0)
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(50, crawl_bench.percentile(values, 50))
+        self.assertEqual(99, crawl_bench.percentile(values, 99))
+        self.assertEqual(100, crawl_bench.percentile(values, 100))
+        self.assertEqual(7, crawl_bench.percentile([7], 99))
+        self.assertEqual(0.0, crawl_bench.percentile([], 50))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+import unittest
+import app.canonical as canonical
+
+
+class TestCanonicalizer(unittest.TestCase):
+
+    def test_canonicalize(self):
+        c = canonical.Canonicalizer()
+        self.assertEqual('http://shop.example/',
+                         c.canonicalize('HTTP://Shop.Example:80'))
+        self.assertEqual('https://shop.example:8443/a',
+                         c.canonicalize('https://shop.example:8443/a#top'))
+        self.assertEqual('http://shop.example/p?a=1&b=2',
+                         c.canonicalize('http://shop.example/p?b=2&a=1'
+                                        '&utm_source=mail&PHPSESSID=x'))
+        self.assertEqual('http://shop.example/cat/',
+                         c.canonicalize('http://shop.example/cat/index.php'))
+        self.assertEqual('http://shop.example/cart',
+                         c.canonicalize('http://shop.example/cart'
+                                        ';jsessionid=0A1B'))
+        self.assertEqual('mailto:a@shop.example',
+                         c.canonicalize('mailto:a@shop.example'))
+        self.assertEqual({'http://shop.example/p?a=1'},
+                         c.canonicalize_all(['http://shop.example/p?a=1',
+                                             'http://shop.example/p?a=1&sid=2']))
+
+    def test_rules(self):
+        c = canonical.Canonicalizer({'drop_params': ['sort'],
+                                     'keep_params': ['utm_source'],
+                                     'index_pages': []})
+        self.assertEqual('http://shop.example/index.html?utm_source=home',
+                         c.canonicalize('http://shop.example/index.html'
+                                        '?sort=price&utm_source=home'))
+        # ref often names the product: kept unless dropped explicitly.
+        self.assertEqual('http://shop.example/p?ref=42',
+                         canonical.Canonicalizer().canonicalize(
+                             'http://shop.example/p?ref=42'))
+        c = canonical.Canonicalizer({'drop_params': ['ref']})
+        self.assertEqual('http://shop.example/p',
+                         c.canonicalize('http://shop.example/p?ref=42'))
+
+    def test_cache_size(self):
+        c = canonical.Canonicalizer(cache_size=2)
+        for i in range(5):
+            c.canonicalize('http://shop.example/%d' % i)
+        self.assertEqual(2, len(c._cache))
+
+    def test_learn(self):
+        c = canonical.Canonicalizer(min_evidence=2)
+        url = 'http://shop.example/p?id=1&view=%d'
+        c.observe(c.canonicalize(url % 0), 'd1')
+        c.observe(c.canonicalize(url % 1), 'd1')
+        self.assertEqual(url % 2, c.canonicalize(url % 2))
+        c.observe(c.canonicalize(url % 2), 'd1')
+        self.assertEqual({'shop.example': {'view'}}, c.learnt)
+        self.assertEqual('http://shop.example/p?id=1',
+                         c.canonicalize(url % 3))
+        # id changes the page: never learnt.
+        c.observe('http://shop.example/p?id=2', 'd2')
+        c.observe('http://shop.example/p?id=3', 'd3')
+        c.observe('http://shop.example/p?id=4', 'd2')
+        self.assertEqual({'view'}, c.learnt['shop.example'])
+
+    def test_no_learning(self):
+        c = canonical.Canonicalizer(learn=False, min_evidence=1)
+        c.observe('http://shop.example/p?view=1', 'd1')
+        c.observe('http://shop.example/p?view=2', 'd1')
+        self.assertEqual({}, c.learnt)
+
+
+if __name__ == '__main__':
+    unittest.main()
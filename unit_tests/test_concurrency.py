@@ -0,0 +1,80 @@
+import asyncio
+import unittest
+import app.concurrency as concurrency
+import app.scheduler as scheduler
+
+
+class TestAimdController(unittest.TestCase):
+
+    def test_additive_increase(self):
+        c = concurrency.AimdController(initial=2, max_limit=4)
+        self.assertEqual(2, c.limit('a'))
+        # About one more per round of limit fetches.
+        limits = [c.observe('a', 0.1, 200) for _ in range(5)]
+        self.assertEqual([2, 2, 3, 3, 3], limits)
+        for _ in range(20):
+            c.observe('a', 0.1, 200)
+        self.assertEqual(4, c.limit('a'))
+        self.assertEqual(2, c.increases)
+
+    def test_multiplicative_decrease(self):
+        c = concurrency.AimdController(initial=8, min_limit=1)
+        for _ in range(8):
+            c.observe('a', 0.1, 200)
+        self.assertEqual(4, c.observe('a', None, error=asyncio.TimeoutError()))
+        # The other fetches already in flight do not count.
+        self.assertEqual(4, c.observe('a', 0.1, 429))
+        for _ in range(3):
+            self.assertEqual(4, c.observe('a', 0.1, 503))
+        self.assertEqual(2, c.observe('a', 0.1, 503))
+        for _ in range(10):
+            c.observe('a', None, error=OSError())
+        self.assertEqual(1, c.limit('a'))
+        self.assertEqual(4, c.decreases)
+        self.assertEqual({'a': 1}, c.limits())
+
+    def test_latency(self):
+        c = concurrency.AimdController(initial=4, window=10,
+                                       latency_factor=3.0)
+        for _ in range(10):
+            c.observe('a', 0.1, 200)
+        # One slow response in ten is below the 90th percentile.
+        before = c.observe('a', 1.0, 200)
+        self.assertGreater(before, 4)
+        self.assertEqual(before // 2, c.observe('a', 1.0, 200))
+
+    def test_max_hosts(self):
+        c = concurrency.AimdController(max_hosts=2)
+        for host in 'abc':
+            c.observe(host, 0.1, 200)
+        self.assertEqual(['b', 'c'], list(c.hosts))
+
+
+class TestSchedulerLimits(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(None)
+        self.addCleanup(self.loop.close)
+
+    def test_set_limit(self):
+        q = scheduler.HostScheduler(max_per_host=1, loop=self.loop)
+        for i in range(3):
+            q.put_nowait(('http://a/%d' % i,))
+        self.assertEqual(('http://a/0',), q.get_nowait())
+        self.assertIsNone(q.get_nowait())
+        q.set_limit('a', 3)
+        self.assertEqual(3, q.limit('a'))
+        self.assertEqual(('http://a/1',), q.get_nowait())
+        self.assertEqual(('http://a/2',), q.get_nowait())
+        q.set_limit('a', 1)
+        q.put_nowait(('http://a/3',))
+        q.release('http://a/0')
+        q.release('http://a/1')
+        self.assertIsNone(q.get_nowait())
+        q.release('http://a/2')
+        self.assertEqual(('http://a/3',), q.get_nowait())
+
+
+if __name__ == '__main__':
+    unittest.main()
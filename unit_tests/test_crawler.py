@@ -11,6 +11,8 @@ from aiohttp import ClientError, web
 sys.path.append(os.path.dirname(__file__)+'../app')
 import app.crawling as crawling
 import app.verify as verify
+import app.reporting as reporting
+from app.retry import RetryPolicy, parse_retry_after
 
 @contextmanager
 def capture_logging():
@@ -128,7 +130,7 @@ class TestBaseCrawling(unittest.TestCase):
 
     @asyncio.coroutine
     def send_fetch(self, url, crawler):
-        web_page,url,content_type,encoding = yield from crawler.fetch(url, 2)
+        web_page,url,content_type,encoding,size = yield from crawler.fetch(url, 2)
         return web_page
 
     def test_fetch(self):
@@ -139,7 +141,7 @@ class TestBaseCrawling(unittest.TestCase):
         r = loop.run_until_complete(self.send_fetch(self.app_url+'/hello', self.crawler))
         web_page = r
         self.assertTrue(web_page)
-        self.assertIn('html', web_page)
+        self.assertIn(b'html', web_page)
 
     def test_parse_links(self):
         loop = self.loop
@@ -159,6 +161,107 @@ class TestBaseCrawling(unittest.TestCase):
                         num_new_urls=1)
         self.assertStat(1, url=self.app_url + '/foo', status=404)
 
+    def test_parse_workers(self):
+        home = self.add_page('/', ['/foo', '/bar'])
+        self.add_page('/foo', ['/bar'])
+        self.add_page('/bar', ['/'])
+        self.create_crawler([home], parse_workers=2)
+        self.crawl()
+        self.assertDoneCount(3)
+        self.assertStat(url=home, num_urls=2, num_new_urls=2)
+
+    def test_shared_session(self):
+        import aiohttp
+        home = self.add_page('/', ['/foo'])
+        self.add_page('/foo', ['/'])
+        session = aiohttp.ClientSession(loop=self.loop)
+        self.addCleanup(session.close)
+        self.create_crawler([home], session=session)
+        self.crawl()
+        self.crawler.close()
+        self.assertFalse(session.closed)
+        self.create_crawler([home], session=session)
+        self.crawl()
+        self.assertDoneCount(2)
+
+    def test_data_handler(self):
+        from app.scraper import Scraper
+        import app.sink as sink
+        handled = []
+
+        class Handler(sink.DataHandler):
+            @asyncio.coroutine
+            def handle(self, root, url, data):
+                handled.append((url, data))
+
+        home = self.add_page('/', ['/product'])
+        self.add_page('/product', body=b'<p class="price">12</p>')
+        scraper = Scraper({'http://127.0.0.1': {'prix_css': ['.price']}})
+        self.create_crawler([home], scraper=scraper, data_handler=Handler())
+        self.crawl()
+        self.assertDoneCount(2)
+        # The listing page found nothing, so it is not sent.
+        self.assertEqual([(self.app_url + '/product', {'prix_css': ['12']})],
+                         handled)
+
+    def test_keep_done(self):
+        home = self.add_page('/', ['/foo'])
+        self.create_crawler([home], keep_done=False)
+        self.crawl()
+        self.assertDoneCount(0)
+        self.assertEqual(2, self.crawler.stats.done)
+        self.assertEqual(1, self.crawler.stats.stats.stats['status_404'])
+        out = io.StringIO()
+        crawling.reporting.report(self.crawler, file=out)
+        self.assertIn('Done: 2', out.getvalue())
+
+    def test_dns_cache(self):
+        self.add_page('/', ['/foo'])
+        self.add_page('/foo', ['/'])
+        self.create_crawler(['http://localhost:%d/' % self.port])
+        self.crawl()
+        self.assertDoneCount(2)
+        # The second page may reuse the connection of the first.
+        self.assertEqual(1, self.crawler.resolver.misses)
+        self.assertEqual(1, len(self.crawler.resolver.cache))
+        out = io.StringIO()
+        reporting.report(self.crawler, file=out)
+        self.assertIn('DNS cache: ', out.getvalue())
+
+    def test_metrics(self):
+        import app.metrics as metrics
+        home = self.add_page('/', ['/foo'])
+        self.add_page('/foo', ['/'])
+        self.create_crawler([home])
+        self.crawl()
+        latency = self.crawler.metrics.latency
+        self.assertEqual(2, latency['ttfb'].count)
+        self.assertEqual(2, latency['body'].count)
+        self.assertEqual(2, latency['parse'].count)
+        self.assertEqual(0, latency['scrape'].count)
+        self.assertEqual(2, self.crawler.metrics.pages)
+        self.assertEqual(0, self.crawler.metrics.in_flight)
+
+        port = self._find_unused_port()
+        server = self.loop.run_until_complete(metrics.start_server(
+            self.crawler.metrics, [self.crawler], '127.0.0.1', port,
+            loop=self.loop))
+        self.addCleanup(server.close)
+
+        @asyncio.coroutine
+        def get():
+            response = yield from self.crawler.session.get(
+                'http://127.0.0.1:%d/metrics' % port)
+            text = yield from response.text()
+            return text
+
+        text = self.loop.run_until_complete(get())
+        self.assertIn('crawler_phase_seconds_count{phase="ttfb"} 2', text)
+        self.assertIn('crawler_phase_seconds_bucket{phase="parse",le="+Inf"} 2',
+                      text)
+        self.assertIn('crawler_queue_depth 0', text)
+        self.assertIn('crawler_pages_total 2', text)
+
     def test_link_cycle(self):
         # foo and bar link to each other.
         url = self.add_page('/foo', ['/bar'])
@@ -202,6 +305,29 @@ class TestBaseCrawling(unittest.TestCase):
         self.assertTrue(verify.url_allowed("http://example.com", crawler.root_domains, exclude=crawler.exclude))
         self.assertFalse(verify.url_allowed("http://example.com/pattern", crawler.root_domains, exclude=crawler.exclude))
 
+    def test_url_filter(self):
+        crawler = crawling.Crawler(['http://example.com'],
+                                   exclude=r'.*pattern', loop=self.loop)
+        self.addCleanup(crawler.close)
+        urls = ['http://example.com/a',
+                'HTTPS://www.example.com:8080/b?c#d',
+                'http://example.com/pattern',
+                'http://foo.example.com/',
+                'ftp://example.com/',
+                'http://127.0.0.1/']
+        self.assertEqual(urls[:2], crawler.url_filter.filter(urls))
+        for url in urls:
+            self.assertEqual(verify.url_allowed(url, crawler.root_domains,
+                                                exclude=crawler.exclude),
+                             crawler.url_filter.allowed(url), url)
+
+    def test_url_filter_cache(self):
+        url_filter = verify.UrlFilter({'a'}, cache_size=2)
+        self.assertTrue(url_filter.allowed('http://a/'))
+        self.assertFalse(url_filter.allowed('http://b/'))
+        self.assertFalse(url_filter.allowed('http://c/'))
+        self.assertEqual(['b', 'c'], list(url_filter._hosts))
+
     def test_roots(self):
         crawler = crawling.Crawler(['http://a', 'http://b', 'not-a-host'],
                                    loop=self.loop)
@@ -301,6 +427,288 @@ class TestBaseCrawling(unittest.TestCase):
         self.assertEqual(2, max_tasks)
         self.assertDoneCount(4)
 
+    def test_max_connections_per_host(self):
+        n_tasks = 0
+        max_tasks = 0
+
+        @asyncio.coroutine
+        def handler(_):
+            nonlocal n_tasks, max_tasks
+            n_tasks += 1
+            max_tasks = max(n_tasks, max_tasks)
+            yield from asyncio.sleep(0.01, loop=self.loop)
+            n_tasks -= 1
+            return web.Response(body=b'')
+
+        urls = ['/0', '/1', '/2']
+        for url in urls:
+            self.add_handler(url, handler)
+        home = self.add_page('/', urls)
+        self.create_crawler([home], max_tasks=10, max_connections_per_host=1)
+        self.crawl()
+        self.assertEqual(1, max_tasks)
+        self.assertDoneCount(4)
+
+    def test_host_delay(self):
+        urls = ['/0', '/1']
+        for url in urls:
+            self.add_page(url, ['/'])
+        home = self.add_page('/', urls)
+        self.create_crawler([home], host_delay=0.05)
+        t0 = time.time()
+        self.crawl()
+        self.assertGreaterEqual(time.time() - t0, 0.1)
+        self.assertDoneCount(3)
+
+    def test_frontier_resume(self):
+        import shutil
+        import tempfile
+        import app.frontier as frontier
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        path = os.path.join(tmpdir, 'frontier.db')
+
+        home = self.add_page('/', ['/foo'])
+        self.add_page('/foo', ['/'])
+        url_frontier = frontier.SqliteFrontier(path)
+        self.create_crawler([home], frontier=url_frontier)
+        self.crawl()
+        url_frontier.close()
+        self.assertDoneCount(2)
+
+        # Everything was fetched: a resumed crawl has nothing left to do.
+        url_frontier = frontier.SqliteFrontier(path, resume=True)
+        self.addCleanup(url_frontier.close)
+        self.create_crawler([home], frontier=url_frontier)
+        self.crawl()
+        self.assertDoneCount(0)
+
+    def test_shared_frontier_waits_for_leases(self):
+        import redis
+        import app.redis_frontier as redis_frontier
+        client = redis.StrictRedis(
+            host=os.environ.get('REDIS_HOST', 'localhost'),
+            port=int(os.environ.get('REDIS_PORT', 6379)), db=15)
+        try:
+            client.ping()
+        except redis.ConnectionError:
+            self.skipTest('no redis-server')
+        name = 'test-crawler-%d' % os.getpid()
+        other = redis_frontier.RedisFrontier(client, name, ack_batch=1)
+        self.addCleanup(other.clear)
+        home = self.add_page('/', ['/foo'])
+        self.add_page('/foo', ['/'])
+        # Another node holds the only URL when this one starts.
+        other.filter_unseen([home], 5)
+        other.take(1)
+        self.create_crawler([home], frontier=redis_frontier.RedisFrontier(
+            client, name), frontier_poll=0.01)
+
+        @asyncio.coroutine
+        def other_node():
+            yield from asyncio.sleep(0.05, loop=self.loop)
+            other.filter_unseen([self.app_url + '/foo'], 5)
+            other.done(home)
+
+        self.loop.run_until_complete(asyncio.gather(
+            self.crawler.crawl(), other_node(), loop=self.loop))
+        self.assertEqual([self.app_url + '/foo'],
+                         [stat.url for stat in self.crawler.done])
+        self.assertEqual(0, other.leased())
+
+    def test_page_cache(self):
+        import shutil
+        import tempfile
+        import app.pagecache as pagecache
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        page_cache = pagecache.PageCache(os.path.join(tmpdir, 'pages.db'))
+        self.addCleanup(page_cache.close)
+        conditional = []
+
+        @asyncio.coroutine
+        def home_handler(req):
+            conditional.append(req.headers.get('If-None-Match'))
+            if req.headers.get('If-None-Match') == '"v1"':
+                return web.Response(status=304)
+            return web.Response(body=b'<a href="/foo"></a>', headers={
+                'CONTENT-TYPE': 'text/html', 'ETAG': '"v1"'})
+
+        self.add_handler('/', home_handler)
+        home = self.app_url + '/'
+        self.add_page('/foo', ['/', '/bar'])
+        self.add_page('/bar', ['/'])
+        self.create_crawler([home], page_cache=page_cache)
+        self.crawl()
+        self.assertDoneCount(3)
+        self.assertEqual(3, len(page_cache))
+
+        # Nothing changed: / answers 304, /foo and /bar hash the same, and
+        # the links stored for them are followed without parsing.
+        self.create_crawler([home], page_cache=page_cache)
+        self.crawl()
+        self.assertDoneCount(3)
+        self.assertEqual([None, '"v1"'], conditional)
+        self.assertTrue(all(stat.unchanged for stat in self.crawler.done))
+        self.assertStat(0, url=home, num_urls=1, num_new_urls=1)
+        self.assertEqual(0, self.crawler.metrics.latency['parse'].count)
+        self.assertEqual(3, self.crawler.stats.stats.stats['html_unchanged'])
+
+    def test_near_duplicates(self):
+        import app.neardup as neardup
+        text = ('<p>The oak dining table seats six and comes with a walnut '
+                'finish and a five year warranty.</p>')
+        home = self.add_page('/', ['/table?sort=1', '/table?sort=2'])
+        self.add_page('/table', body=(text + '<a href="/"></a>').encode())
+        self.create_crawler([home],
+                            near_duplicates=neardup.SimHashIndex(3))
+        self.crawl()
+        self.assertDoneCount(3)
+        duplicates = [stat for stat in self.crawler.done if stat.duplicate_of]
+        self.assertEqual(1, len(duplicates))
+        self.assertIn(duplicates[0].duplicate_of,
+                      {self.app_url + '/table?sort=1',
+                       self.app_url + '/table?sort=2'})
+        self.assertEqual(2, self.crawler.metrics.latency['parse'].count)
+        self.assertEqual(1, self.crawler.stats.stats.stats['near_duplicate'])
+
+    def test_canonical_urls(self):
+        home = self.add_page('/', ['/a?utm_source=mail', '/a#reviews',
+                                   '/b?y=2&x=1', '/b?x=1&y=2&sid=9'])
+        self.add_page('/a', ['/'])
+        self.add_page('/b', ['/a'])
+        self.create_crawler([home])
+        self.crawl()
+        self.assertDoneCount(3)
+        self.assertEqual({home, self.app_url + '/a',
+                          self.app_url + '/b?x=1&y=2'},
+                         {stat.url for stat in self.crawler.done})
+
+    def test_robots(self):
+        import app.robots as robots
+        self.add_page('/robots.txt', body=b'User-agent: *\nDisallow: /private'
+                      b'\nCrawl-delay: 0.01\n', content_type='text/plain')
+        home = self.add_page('/', ['/private/x', '/ok'])
+        self.add_page('/ok', ['/'])
+        self.add_page('/private/start', ['/private/y'])
+        self.create_crawler([home, self.app_url + '/private/start'],
+                            robots=robots.RobotsCache(loop=self.loop))
+        self.crawl()
+        self.assertDoneCount(3)
+        disallowed = [stat.url for stat in self.crawler.done
+                      if stat.robots_disallowed]
+        self.assertEqual([self.app_url + '/private/start'], disallowed)
+        self.assertNotIn(self.app_url + '/private/x', self.crawler.seen_urls)
+        self.assertEqual(1, self.crawler.robots.fetched)
+        self.assertEqual(0.01, self.crawler.q._delays['127.0.0.1:%d' %
+                                                      self.port])
+        self.assertEqual(1, self.crawler.stats.stats.stats['robots_disallowed'])
+
+    def test_robots_unavailable(self):
+        import app.robots as robots
+        responses = [503]
+
+        @asyncio.coroutine
+        def handler(req):
+            status = responses.pop() if responses else 404
+            return web.Response(status=status, body=b'')
+
+        self.add_handler('/robots.txt', handler)
+        home = self.add_page('/', ['/ok'])
+        self.add_page('/ok', ['/'])
+        self.create_crawler([home], robots=robots.RobotsCache(
+            error_ttl=0.05, loop=self.loop))
+        self.crawl()
+        self.assertEqual(2, self.crawler.robots.fetched)
+        self.assertEqual([home, self.app_url + '/ok'],
+                         sorted(stat.url for stat in self.crawler.done))
+        self.assertFalse(any(stat.robots_disallowed
+                             for stat in self.crawler.done))
+
+    def test_robots_given_up(self):
+        import app.robots as robots
+
+        @asyncio.coroutine
+        def handler(req):
+            return web.Response(status=503, body=b'')
+
+        self.add_handler('/robots.txt', handler)
+        home = self.add_page('/')
+        self.create_crawler([home], max_tries=1, robots=robots.RobotsCache(
+            error_ttl=0.01, max_failures=3, loop=self.loop))
+        self.crawl()
+        # The robots.txt is not limited by the tries of the page.
+        self.assertEqual(3, self.crawler.robots.fetched)
+        self.assertDoneCount(1)
+        self.assertIsInstance(self.crawler.done[0].exception,
+                              robots.RobotsUnavailable)
+
+    def test_sitemaps(self):
+        import app.sitemaps as sitemaps
+        self.add_page('/robots.txt', body=('Sitemap: %s/sitemap.xml\n' %
+                                           self.app_url).encode(),
+                      content_type='text/plain')
+        self.add_page('/sitemap.xml', body=(
+            '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">'
+            '<url><loc>{0}/p/1</loc><lastmod>2010-01-01</lastmod></url>'
+            '<url><loc>{0}/p/2</loc><lastmod>2020-01-01</lastmod></url>'
+            '<url><loc>http://other.example/p/3</loc></url>'
+            '</urlset>').format(self.app_url).encode(),
+            content_type='application/xml')
+        home = self.add_page('/', body=b'<p>Home</p>')
+        self.add_page('/p/1', ['/'])
+        self.add_page('/p/2', ['/'])
+        self.create_crawler([home], max_tasks=1,
+                            sitemaps=sitemaps.SitemapSeeder(loop=self.loop))
+        self.crawl()
+        self.assertEqual([home, self.app_url + '/p/2', self.app_url + '/p/1'],
+                         [stat.url for stat in self.crawler.done])
+        self.assertEqual(1, self.crawler.sitemaps.sitemaps)
+        self.assertEqual(3, self.crawler.sitemaps.urls)
+
+    def test_adaptive_concurrency(self):
+        import app.concurrency as concurrency
+        import app.metrics as metrics
+
+        @asyncio.coroutine
+        def slow(req):
+            yield from asyncio.sleep(0.5, loop=self.loop)
+            return web.Response(body=b'<a href="/"></a>')
+
+        home = self.add_page('/', ['/slow', '/fast'])
+        self.add_page('/fast', ['/'])
+        self.add_handler('/slow', slow)
+        controller = concurrency.AimdController(initial=2)
+        self.create_crawler([home], concurrency=controller, timeout=0.1,
+                            max_tries=1)
+        self.crawl()
+        self.assertDoneCount(3)
+        slow_stat, = [stat for stat in self.crawler.done
+                      if stat.url == self.app_url + '/slow']
+        self.assertIsInstance(slow_stat.exception, asyncio.TimeoutError)
+        host = '127.0.0.1:%d' % self.port
+        self.assertEqual(controller.limit(host), self.crawler.q.limit(host))
+        # Two responses; the timeout counts as an error, without latency.
+        self.assertEqual(2, controller.hosts[host].observed)
+        out = io.StringIO()
+        reporting.report(self.crawler, file=out)
+        self.assertIn('Concurrency: 1 hosts', out.getvalue())
+        self.assertIn('crawler_host_concurrency{host="%s"} %d'
+                      % (host, controller.limit(host)),
+                      metrics.render(self.crawler.metrics, [self.crawler]))
+
+    def test_priority_frontier(self):
+        import app.frontier as frontier
+        home = self.add_page('/', ['/about', '/panier', '/p/1234.html'])
+        for path in ('/about', '/panier', '/p/1234.html'):
+            self.add_page(path, ['/'])
+        self.create_crawler([home], max_tasks=1, frontier_buffer=1,
+                            frontier=frontier.PriorityFrontier())
+        self.crawl()
+        self.assertEqual([home] + [self.app_url + path for path in
+                                   ('/p/1234.html', '/about', '/panier')],
+                         [stat.url for stat in self.crawler.done])
+
     def test_max_tries(self):
         n_tries = 0
 
@@ -313,8 +721,9 @@ class TestBaseCrawling(unittest.TestCase):
             return web.Response(body=b'')
 
         self.add_handler('/', handler)
+        fast = RetryPolicy(base_delay=0.001)
         with capture_logging() as messages:
-            self.create_crawler([self.app_url])
+            self.create_crawler([self.app_url], retry_policy=fast)
             self.crawl()
         self.assertDoneCount(1)
         self.assertStat(status=200)
@@ -323,7 +732,7 @@ class TestBaseCrawling(unittest.TestCase):
 
         n_tries = 0
         with capture_logging() as messages:
-            self.create_crawler([self.app_url], max_tries=1)
+            self.create_crawler([self.app_url], max_tries=1, retry_policy=fast)
             self.crawl()
         self.assertDoneCount(1)
         self.assertStat(status=None)
@@ -331,6 +740,91 @@ class TestBaseCrawling(unittest.TestCase):
         self.assertIsInstance(stat.exception, ClientError)
         self.assertIn('failed after 1 tries', messages)
 
+    def test_frontier_retry(self):
+        import shutil
+        import tempfile
+        import app.frontier as frontier
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        done = []
+
+        class Frontier(frontier.SqliteFrontier):
+            def done(self, url, data=None):
+                done.append(url)
+                super().done(url, data)
+
+        n_tries = 0
+
+        @asyncio.coroutine
+        def handler(req):
+            nonlocal n_tries
+            n_tries += 1
+            if n_tries == 1:
+                return web.Response(status=503, body=b'')
+            return web.Response(body=b'<a href="/"></a>')
+
+        home = self.add_page('/', ['/foo'])
+        self.add_handler('/foo', handler)
+        url_frontier = Frontier(os.path.join(tmpdir, 'frontier.db'))
+        self.addCleanup(url_frontier.close)
+        self.create_crawler([home], frontier=url_frontier,
+                            retry_policy=RetryPolicy(base_delay=0.001))
+        self.crawl()
+        self.assertEqual(2, n_tries)
+        # Not done while its second try was waiting.
+        self.assertEqual([home, self.app_url + '/foo'], done)
+
+    def test_retry_status(self):
+        n_tries = 0
+
+        @asyncio.coroutine
+        def handler(req):
+            nonlocal n_tries
+            n_tries += 1
+            if n_tries == 1:
+                return web.Response(status=503, body=b'',
+                                    headers={'Retry-After': '0'})
+            return web.Response(body=b'')
+
+        self.add_handler('/', handler)
+        self.create_crawler([self.app_url],
+                            retry_policy=RetryPolicy(base_delay=0.001))
+        self.crawl()
+        self.assertEqual(2, n_tries)
+        self.assertDoneCount(1)
+        self.assertStat(status=200)
+
+        n_tries = 0
+        self.create_crawler([self.app_url], max_tries=1)
+        self.crawl()
+        self.assertDoneCount(1)
+        self.assertStat(status=503)
+
+    def test_retry_policy(self):
+        policy = RetryPolicy(base_delay=1.0, max_delay=10.0)
+        for tries in range(3):
+            delay = policy.delay(tries)
+            self.assertTrue(2 ** tries / 2 <= delay <= 2 ** tries, delay)
+        self.assertTrue(5.0 <= policy.delay(20) <= 10.0)
+        self.assertGreaterEqual(policy.delay(0, status=429), 2.0)
+        self.assertGreaterEqual(policy.delay(0, retry_after=5), 5)
+        self.assertLessEqual(policy.delay(0, retry_after=500), 10.0)
+        self.assertEqual(120, parse_retry_after('120'))
+        self.assertEqual(60, parse_retry_after(
+            'Thu, 01 Jan 1970 00:02:00 GMT', now=60))
+        self.assertIsNone(parse_retry_after('soon'))
+
+    def test_declared_encoding(self):
+        body = ('<html><head><meta charset="windows-1252"></head><body>'
+                '<a href="/caf\xe9">caf\xe9 \u20ac</a></body></html>')
+        home = self.add_page('/', body=body.encode('cp1252'),
+                             content_type='text/html')
+        self.add_page('/caf%C3%A9')
+        self.create_crawler([home])
+        self.crawl()
+        self.assertStat(url=home, encoding='cp1252', num_new_urls=1)
+        self.assertIn(self.app_url + '/caf\xe9', self.crawler.seen_urls)
+
     # def test_encoding(self):
     #     def test_charset(charset, encoding):
     #         if charset:
@@ -347,6 +841,37 @@ class TestBaseCrawling(unittest.TestCase):
     #     test_charset('utf-8', 'utf-8')
     #     test_charset('ascii', 'ascii')
 
+    def test_size(self):
+        body = '<a href="/foo"></a>'.encode('utf-8') * 100
+        home = self.add_page('/', body=body)
+        self.create_crawler([home], max_body_size=len(body))
+        self.crawl()
+        self.assertStat(url=home, size=len(body), num_urls=1)
+
+    def test_max_body_size(self):
+        body = '<a href="/foo"></a>'.encode('utf-8') * 100
+        home = self.add_page('/', body=body)
+        self.create_crawler([home], max_body_size=len(body) - 1)
+        self.crawl()
+        self.assertDoneCount(1)
+        self.assertStat(url=home, status=200, num_urls=0)
+        self.assertIsInstance(self.crawler.done[0].exception,
+                              crawling.BodyTooLarge)
+
+    def test_read_error(self):
+        home = self.add_page()
+        self.create_crawler([home])
+
+        @asyncio.coroutine
+        def read_body(response):
+            raise ValueError('bad body')
+
+        self.crawler.read_body = read_body
+        self.crawl()
+        self.assertDoneCount(1)
+        self.assertStat(url=home, num_urls=0)
+        self.assertIsInstance(self.crawler.done[0].exception, ValueError)
+
     def test_content_type(self):
         self.add_page(content_type='foo')
         self.create_crawler([self.app_url])
@@ -363,10 +888,10 @@ class TestBaseCrawling(unittest.TestCase):
         self.assertStat(0, content_type='application/xml', num_urls=1)
         self.assertStat(1, url=self.app_url + '/')
 
-        self.add_page('/image', content_type='image')
+        self.add_page('/image', body=b'\x89PNG' * 10, content_type='image')
         self.create_crawler([self.app_url + '/image'])
         self.crawl()
-        self.assertStat(content_type='image', num_urls=0)
+        self.assertStat(content_type='image', num_urls=0, size=40)
 
     def test_non_http(self):
         body = '<a href="ftp://example.com">'.encode('utf-8')
@@ -0,0 +1,68 @@
+import asyncio
+import os
+import sys
+import unittest
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'app'))
+import crawl
+from unit_tests.test_sink import FakeConnection
+
+
+class TestDaemon(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(None)
+        self.addCleanup(self.loop.close)
+        self.connection = FakeConnection(self.loop)
+
+    def test_pop_jobs(self):
+        self.connection.push(crawl.JOB_QUEUE, ['a', 'b', 'c'])
+        values = self.loop.run_until_complete(
+            crawl.pop_jobs(self.connection, 5))
+        # One BLPOP, then the rest in one MULTI/EXEC.
+        self.assertEqual(['a', 'b', 'c'], values)
+        self.assertEqual(2, len(self.connection.round_trips))
+        self.connection.push(crawl.JOB_QUEUE, ['d', 'e'])
+        values = self.loop.run_until_complete(
+            crawl.pop_jobs(self.connection, 1))
+        self.assertEqual(['d'], values)
+        self.assertEqual(3, len(self.connection.round_trips))
+
+    def test_run_jobs(self):
+        running = set()
+        done = []
+        most = 0
+
+        @asyncio.coroutine
+        def job(value):
+            nonlocal most
+            running.add(value)
+            most = max(most, len(running))
+            yield from asyncio.sleep(0.01, loop=self.loop)
+            running.discard(value)
+            done.append(value)
+            if value == 'bad':
+                raise ValueError(value)
+
+        @asyncio.coroutine
+        def go():
+            task = asyncio.Task(crawl.run_jobs(self.connection, job, 3, 2,
+                                               loop=self.loop),
+                                loop=self.loop)
+            self.connection.push(crawl.JOB_QUEUE, ['bad'] + list(range(6)))
+            while len(done) < 7:
+                yield from asyncio.sleep(0.005, loop=self.loop)
+            # A slow job is cancelled with the daemon.
+            self.connection.push(crawl.JOB_QUEUE, ['last'])
+            yield from asyncio.sleep(0.001, loop=self.loop)
+            task.cancel()
+            yield from asyncio.wait([task], loop=self.loop)
+
+        self.loop.run_until_complete(go())
+        self.assertEqual(3, most)
+        self.assertEqual({'bad'} | set(range(6)), set(done))
+        self.assertEqual(set(), running - {'last'})
+
+
+if __name__ == '__main__':
+    unittest.main()
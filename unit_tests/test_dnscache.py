@@ -0,0 +1,122 @@
+import asyncio
+import socket
+import unittest
+import app.dnscache as dnscache
+
+
+class FakeResolver(object):
+    """Answers with one record per name, or fails for names in errors."""
+
+    def __init__(self, loop, ttl=None, errors=()):
+        self.loop = loop
+        self.ttl = ttl
+        self.errors = errors
+        self.lookups = []
+
+    @asyncio.coroutine
+    def resolve(self, host, port=0, family=socket.AF_INET):
+        self.lookups.append(host)
+        yield from asyncio.sleep(0.01, loop=self.loop)
+        if host in self.errors:
+            raise socket.gaierror(-2, 'Name or service not known')
+        return [{'hostname': host, 'host': '10.0.0.1', 'port': port,
+                 'family': family, 'proto': 0,
+                 'flags': socket.AI_NUMERICHOST, 'ttl': self.ttl}]
+
+    @asyncio.coroutine
+    def close(self):
+        pass
+
+
+class TestCachingResolver(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(None)
+        self.addCleanup(self.loop.close)
+
+    def make(self, ttl=None, errors=(), **kwargs):
+        self.fake = FakeResolver(self.loop, ttl, errors)
+        return dnscache.CachingResolver(self.fake, loop=self.loop, **kwargs)
+
+    def resolve(self, resolver, host, port=80):
+        return self.loop.run_until_complete(
+            resolver.resolve(host, port, family=0))
+
+    def test_cache(self):
+        resolver = self.make()
+        self.assertEqual('10.0.0.1', self.resolve(resolver, 'a')[0]['host'])
+        self.resolve(resolver, 'a')
+        self.resolve(resolver, 'b')
+        self.assertEqual(['a', 'b'], self.fake.lookups)
+        self.assertEqual(1, resolver.hits)
+        self.assertEqual(2, resolver.misses)
+
+    def test_record_ttl(self):
+        resolver = self.make(ttl=0)
+        self.resolve(resolver, 'a')
+        self.resolve(resolver, 'a')
+        self.assertEqual(['a', 'a'], self.fake.lookups)
+        resolver = self.make(ttl=3600, max_ttl=0.01)
+        self.resolve(resolver, 'a')
+        self.loop.run_until_complete(asyncio.sleep(0.02, loop=self.loop))
+        self.resolve(resolver, 'a')
+        self.assertEqual(['a', 'a'], self.fake.lookups)
+
+    def test_negative_cache(self):
+        resolver = self.make(errors=('dead',))
+        for _ in range(3):
+            with self.assertRaises(OSError):
+                self.resolve(resolver, 'dead')
+        self.assertEqual(['dead'], self.fake.lookups)
+        self.assertEqual(2, resolver.negative_hits)
+
+    def test_concurrent_lookups(self):
+        resolver = self.make()
+        results = self.loop.run_until_complete(asyncio.gather(
+            *[resolver.resolve('a', 80, family=0) for _ in range(5)],
+            loop=self.loop))
+        self.assertEqual(5, len(results))
+        self.assertEqual(['a'], self.fake.lookups)
+
+    def test_cancelled_lookup(self):
+        resolver = self.make()
+        with self.assertRaises(asyncio.TimeoutError):
+            self.loop.run_until_complete(asyncio.wait_for(
+                resolver.resolve('a', 80, family=0), 0.001, loop=self.loop))
+        self.assertEqual('10.0.0.1', self.resolve(resolver, 'a')[0]['host'])
+        self.assertEqual(['a'], self.fake.lookups)
+        self.assertEqual({}, resolver.pending)
+
+    def test_prefetch(self):
+        resolver = self.make(family=0)
+        resolver.prefetch_urls(['http://a/1', 'http://a/2', 'https://b/',
+                                'mailto:x@c'])
+        resolver.prefetch_urls(['http://a/3'])
+        self.assertEqual(2, resolver.prefetches)
+        self.loop.run_until_complete(asyncio.sleep(0.05, loop=self.loop))
+        self.assertEqual(['a', 'b'], sorted(self.fake.lookups))
+        self.resolve(resolver, 'b', 443)
+        self.assertEqual(1, resolver.hits)
+        self.assertEqual(0, resolver.misses)
+        # close() cancels the prefetches in progress.
+        resolver.prefetch('c', 80)
+        self.loop.run_until_complete(resolver.close())
+        self.assertEqual(2, len(resolver.cache))
+
+    def test_max_size(self):
+        resolver = self.make(max_size=2)
+        for host in ('a', 'b', 'a', 'c', 'a', 'b'):
+            self.resolve(resolver, host)
+        self.assertEqual(['a', 'b', 'c', 'b'], self.fake.lookups)
+
+    def test_url_address(self):
+        self.assertEqual(('a.com', 80), dnscache.url_address('http://A.com/x'))
+        self.assertEqual(('a.com', 443), dnscache.url_address('https://a.com'))
+        self.assertEqual(('a.com', 8080),
+                         dnscache.url_address('http://a.com:8080/'))
+        self.assertIsNone(dnscache.url_address('ftp://a.com/'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -9,7 +9,8 @@ import socket
 import unittest
 from aiohttp import ClientError, web
 sys.path.append(os.path.dirname(__file__)+'../app')
-from app.scraper import Scraper
+from app.scraper import Scraper, compile_selectors
+from lxml import html as lxml_html
 import json
 
 def fix_url(url):
@@ -104,3 +105,26 @@ class TestDataExtractor(unittest.TestCase):
         name = 'Fauteuil Galaxy blanc'
         bc = None
         self._assert_data(data, price, img_link, name, bc)
+
+    def test_scrape_lxml_tree(self):
+        f = get_file_handle('le-narguile.html')
+        html = f[1]
+        f[0].close()
+        url = 'http://www.le-narguile.com/media/catalog/product/cache/6/image/'
+        self.assertEqual(self.s.scrape(url, html),
+                         self.s.scrape(url, lxml_html.fromstring(html)))
+
+    def test_compile_selectors(self):
+        compiled = compile_selectors({'nom_css': ['h1:eq(0)', '>>>', 'h2']})
+        self.assertEqual(2, len(compiled['nom_css']))
+        tree = lxml_html.fromstring('<div><h1>a</h1><h1>b</h1></div>')
+        self.assertEqual(['a'], [e.text for e in compiled['nom_css'][0](tree)])
+
+    def test_compile_selectors_cached(self):
+        selectors = {'prix_css': ['<<<', '.price']}
+        with self.assertLogs('app.scraper') as logs:
+            compiled = compile_selectors(selectors)
+            self.assertIs(compiled, compile_selectors(dict(selectors)))
+            compile_selectors({'prix_css': ['<<<']})
+        # The invalid selector is reported once per selectors dict.
+        self.assertEqual(2, len(logs.output))
@@ -0,0 +1,133 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+import app.frontier as frontier
+
+
+class TestSqliteFrontier(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.path = os.path.join(self.tmpdir, 'frontier.db')
+
+    def open(self, resume=False):
+        f = frontier.SqliteFrontier(self.path, resume=resume)
+        self.addCleanup(f.db.close)
+        return f
+
+    def test_filter_unseen(self):
+        f = self.open()
+        self.assertEqual(['http://a/1', 'http://a/2'],
+                         f.filter_unseen(['http://a/1', 'http://a/2'], 3))
+        self.assertEqual(['http://a/3'],
+                         f.filter_unseen(['http://a/2', 'http://a/3'], 3))
+        self.assertIn('http://a/1', f)
+        self.assertNotIn('http://a/4', f)
+        self.assertEqual(3, len(f))
+        self.assertEqual(3, f.pending())
+
+    def test_take_in_order(self):
+        f = self.open()
+        f.filter_unseen(['http://a/1', 'http://a/2', 'http://a/3'], 3)
+        self.assertEqual([('http://a/1', 3), ('http://a/2', 3)], f.take(2))
+        self.assertEqual([('http://a/3', 3)], f.take(2))
+        self.assertEqual([], f.take(2))
+        self.assertEqual(0, f.pending())
+
+    def test_resume(self):
+        f = self.open()
+        f.filter_unseen(['http://a/1', 'http://a/2', 'http://a/3'], 3)
+        f.take(2)
+        f.done('http://a/1')
+        f.close()
+
+        f = self.open(resume=True)
+        self.assertEqual(3, len(f))
+        self.assertEqual(2, f.pending())
+        self.assertEqual(['http://a/2', 'http://a/3'],
+                         [url for url, _ in f.take(10)])
+        self.assertEqual([], f.filter_unseen(['http://a/1'], 3))
+
+    def test_no_resume_discards(self):
+        f = self.open()
+        f.filter_unseen(['http://a/1'], 3)
+        f.close()
+        f = self.open()
+        self.assertEqual(0, len(f))
+
+
+class TestPriorityFrontier(unittest.TestCase):
+
+    def test_scorer(self):
+        scorer = frontier.UrlScorer()
+        product = scorer.score('http://a/produits/chaise-1234.html', 2)
+        self.assertGreater(product, scorer.score('http://a/about', 2))
+        self.assertGreater(scorer.score('http://a/about', 1),
+                           scorer.score('http://a/about', 2))
+        self.assertLess(scorer.score('http://a/panier', 1),
+                        scorer.score('http://a/about', 1))
+        self.assertLess(scorer.score('http://a/c/chaises?sort=price', 1),
+                        scorer.score('http://a/c/chaises', 1))
+
+    def test_feedback(self):
+        scorer = frontier.UrlScorer(min_samples=2)
+        before = scorer.score('http://a/meubles/x', 1)
+        for i in range(3):
+            scorer.feedback('http://a/meubles/%d' % i, True)
+            scorer.feedback('http://a/blog/%d' % i, False)
+        self.assertGreater(scorer.score('http://a/meubles/x', 1), before)
+        self.assertLess(scorer.score('http://a/blog/x', 1), before)
+        self.assertEqual(0.5, scorer.yield_rate('http://b/meubles/x'))
+
+    def test_take_best_first(self):
+        f = frontier.PriorityFrontier()
+        self.assertEqual(['http://a/'], f.filter_unseen(['http://a/']))
+        self.assertEqual([('http://a/', None)], f.take(5))
+        f.filter_unseen(['http://a/about', 'http://a/p/1234.html',
+                         'http://a/panier', 'http://a/'], 5,
+                        parent='http://a/')
+        self.assertEqual(3, f.pending())
+        self.assertEqual(['http://a/p/1234.html', 'http://a/about',
+                          'http://a/panier'],
+                         [url for url, _ in f.take(5)])
+        self.assertEqual(1, f.depths['http://a/about'])
+        f.done('http://a/about')
+        self.assertNotIn('http://a/about', f.depths)
+        self.assertIn('http://a/about', f)
+        self.assertEqual(4, len(f))
+
+    def test_lastmod(self):
+        f = frontier.PriorityFrontier()
+        now = time.time()
+        f.filter_unseen(['http://a/old', 'http://a/unknown', 'http://a/new'],
+                        lastmod={'http://a/old': now - 365 * 24 * 3600,
+                                 'http://a/new': now - 3600})
+        self.assertEqual(['http://a/new', 'http://a/old', 'http://a/unknown'],
+                         [url for url, _ in f.take(5)])
+
+    def test_eviction(self):
+        f = frontier.PriorityFrontier(max_size=2)
+        f.filter_unseen(['http://a/about', 'http://a/p/1234.html',
+                         'http://a/panier', 'http://a/p/5678.html'])
+        self.assertEqual(2, f.pending())
+        self.assertEqual(2, f.evicted)
+        self.assertEqual(['http://a/p/1234.html', 'http://a/p/5678.html'],
+                         [url for url, _ in f.take(5)])
+        self.assertEqual(0, f.pending())
+        self.assertEqual([], f.take(5))
+
+    def test_done_feeds_scorer(self):
+        f = frontier.PriorityFrontier(frontier.UrlScorer(min_samples=1))
+        f.filter_unseen(['http://a/x/1'])
+        f.take(1)
+        f.done('http://a/x/1', {'prix_css': '10', 'error': None})
+        self.assertEqual({'a/x': [1, 1]}, f.scorer.prefixes)
+        self.assertFalse(frontier.has_data({'prix_css': None,
+                                            'error': None}))
+
+
+if __name__ == '__main__':
+    unittest.main()
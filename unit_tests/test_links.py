@@ -0,0 +1,75 @@
+import os
+import unittest
+from lxml import html
+import app.links as links
+
+RESOURCES = os.path.join(os.path.dirname(__file__), 'resources')
+
+BASE = 'http://shop.example/cat/page.html'
+
+
+class TestExtractLinks(unittest.TestCase):
+
+    def test_links(self):
+        page = (b'<html><head>'
+                b'<link rel="stylesheet" href="/style.css">'
+                b'<link rel="Next" href="page2.html">'
+                b'<script src="/app.js"></script></head>'
+                b'<body><A HREF="/a">A</A>'
+                b'<a href=b title="x > y">B</a>'
+                b"<a class='c' href='c?x=1&amp;y=2'>C</a>"
+                b'<a href="http://other.example/d"><img src="/i.png"></a>'
+                b'<a name="anchor">no href</a>'
+                b'</body></html>')
+        self.assertEqual(['http://shop.example/cat/page2.html',
+                          'http://shop.example/a',
+                          'http://shop.example/cat/b',
+                          'http://shop.example/cat/c?x=1&y=2',
+                          'http://other.example/d'],
+                         links.extract_links(page, BASE))
+
+    def test_quote_in_unquoted_value(self):
+        page = (b"<a href=/p1 title=l'article>A</a> <a href=/p2>B</a> "
+                b"<a href=/p3 title=l'autre>C</a> <a href=/p4>D</a>"
+                b"<a href=/p5'x>E</a>")
+        self.assertEqual(['http://s/p1', 'http://s/p2', 'http://s/p3',
+                          'http://s/p4', "http://s/p5'x"],
+                         links.extract_links(page, 'http://s/'))
+
+    def test_base(self):
+        page = (b'<a href="a">A</a>'
+                b'<base href="http://cdn.example/dir/">'
+                b'<base href="http://ignored.example/">')
+        self.assertEqual(['http://cdn.example/dir/a'],
+                         links.extract_links(page, BASE))
+
+    def test_skipped(self):
+        page = (b'<!-- <a href="/commented">x</a> -->'
+                b'<script>var s = \'<a href="/scripted">\';</script>'
+                b'<STYLE>a[href="/styled"] {}</STYLE>'
+                b'<abbr href="/abbr">x</abbr>'
+                b'<a href="/kept">kept</a>')
+        self.assertEqual(['http://shop.example/kept'],
+                         links.extract_links(page, BASE))
+
+    def test_encoding(self):
+        page = '<a href="/caf\xe9">caf\xe9</a>'
+        expected = ['http://shop.example/caf\xe9']
+        self.assertEqual(expected, links.extract_links(page, BASE))
+        self.assertEqual(expected,
+                         links.extract_links(page.encode('latin-1'), BASE,
+                                             'latin-1'))
+
+    def test_against_lxml(self):
+        with open(os.path.join(RESOURCES, 'le-narguile.html'), 'rb') as f:
+            page = f.read()
+        tree = html.fromstring(page)
+        tree.make_links_absolute(BASE)
+        expected = set(link for element, attribute, link, _
+                       in tree.iterlinks()
+                       if element.tag == 'a' and attribute == 'href')
+        self.assertEqual(expected, set(links.extract_links(page, BASE)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+import random
+import unittest
+import app.neardup as neardup
+
+TEXT = ('The oak dining table seats six and comes with a walnut finish, '
+        'solid legs and a five year warranty on every joint and surface. '
+        'Delivery takes two weeks and assembly is free in most cities.')
+
+
+class TestNearDuplicates(unittest.TestCase):
+
+    def test_features_ignore_markup(self):
+        a = neardup.page_features('<p>%s</p><a href="/x?s=1">go</a>' % TEXT)
+        b = neardup.page_features(
+            '<div class="x"><script>var s = 2;</script>%s<a href="/x?s=2">'
+            'go</a></div>' % TEXT)
+        self.assertEqual(a, b)
+
+    def test_simhash(self):
+        a = neardup.simhash(neardup.page_features(TEXT))
+        b = neardup.simhash(neardup.page_features(
+            TEXT.replace('two weeks', 'three weeks')))
+        c = neardup.simhash(neardup.page_features(
+            'A completely different page about garden chairs, parasols, '
+            'cushions and outdoor lighting for summer evenings.'))
+        self.assertEqual(a, neardup.simhash(neardup.page_features(TEXT)))
+        self.assertLess(neardup.distance(a, b), neardup.distance(a, c))
+        self.assertGreater(neardup.distance(a, c), 10)
+
+    def test_index_finds_every_close_value(self):
+        rng = random.Random(1)
+        index = neardup.SimHashIndex(max_distance=3)
+        values = [rng.getrandbits(64) for _ in range(200)]
+        for i, value in enumerate(values):
+            index.add(value, i)
+        for i, value in enumerate(values):
+            flipped = value
+            for bit in rng.sample(range(64), 3):
+                flipped ^= 1 << bit
+            self.assertEqual(i, index.find(flipped))
+        self.assertIsNone(index.find(values[0] ^ 0xff))
+
+    def test_check(self):
+        index = neardup.SimHashIndex(max_distance=3)
+        self.assertIsNone(index.check(TEXT, 'http://a/1'))
+        self.assertEqual('http://a/1', index.check(TEXT, 'http://a/1?s=2'))
+        # Too short to compare.
+        self.assertIsNone(index.check('<a href="/">home</a>', 'http://a/2'))
+        self.assertIsNone(index.check('<a href="/">home</a>', 'http://a/3'))
+        self.assertEqual(1, index.pages)
+        self.assertEqual(1, index.duplicates)
+        with self.assertRaises(ValueError):
+            neardup.SimHashIndex(max_distance=16)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+import os
+import shutil
+import tempfile
+import unittest
+import app.pagecache as pagecache
+
+
+class TestPageCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.path = os.path.join(self.tmpdir, 'pages.db')
+
+    def test_store_and_reopen(self):
+        cache = pagecache.PageCache(self.path)
+        digest = pagecache.content_hash(b'<html></html>')
+        cache.fetched('http://a/', '"x"', None, digest, 'text/html', 'utf-8')
+        self.assertIsNone(cache.get('http://a/'))
+        cache.parsed('http://a/', {'http://a/2', 'http://a/1'}, {'prix': '1'})
+        # parsed() without fetched() first stores nothing.
+        cache.parsed('http://b/', set(), None)
+        cache.close()
+
+        cache = pagecache.PageCache(self.path)
+        self.addCleanup(cache.close)
+        self.assertEqual(1, len(cache))
+        page = cache.get('http://a/')
+        self.assertEqual(digest, page.digest)
+        self.assertEqual(['http://a/1', 'http://a/2'], page.links)
+        self.assertEqual({'prix': '1'}, page.data)
+        self.assertEqual({'If-None-Match': '"x"'}, page.conditional_headers())
+
+    def test_unchanged(self):
+        cache = pagecache.PageCache(self.path)
+        self.addCleanup(cache.close)
+        cache.fetched('http://a/', None, 'Mon, 01 Jan 2018 00:00:00 GMT',
+                      'd', 'text/html', 'utf-8')
+        cache.parsed('http://a/', [], None)
+        cache.unchanged('http://a/', '"y"', None)
+        page = cache.get('http://a/')
+        self.assertEqual({'If-None-Match': '"y"',
+                          'If-Modified-Since': 'Mon, 01 Jan 2018 00:00:00 GMT'},
+                         page.conditional_headers())
+        self.assertIsNone(page.data)
+
+
+if __name__ == '__main__':
+    unittest.main()
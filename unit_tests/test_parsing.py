@@ -0,0 +1,50 @@
+import codecs
+import unittest
+import app.parsing as parsing
+
+PAGE = ('<html><head><title>Caf\xe9</title></head><body>'
+        '<p class="price">12 €</p><a href="/caf\xe9">go</a></body></html>')
+
+
+class TestParsing(unittest.TestCase):
+
+    def test_detect_encoding(self):
+        detect = parsing.detect_encoding
+        self.assertEqual('utf-8', detect(b'<p>x</p>'))
+        self.assertEqual('cp1252', detect(b'<p>x</p>', 'ISO-8859-1'))
+        self.assertEqual('shift_jis', detect(
+            b'<meta charset="Shift_JIS"><p>x</p>', 'bogus'))
+        self.assertEqual('euc_kr', detect(
+            b'<META HTTP-EQUIV="Content-Type" '
+            b'CONTENT="text/html; charset=euc-kr">'))
+        self.assertEqual('koi8-r', detect(
+            b'<?xml version="1.0" encoding="KOI8-R"?><urlset/>'))
+        self.assertEqual('utf-8', detect(b'<meta charset="utf-16">'))
+        self.assertEqual('utf-16-le', detect(
+            codecs.BOM_UTF16_LE + '<p>x</p>'.encode('utf-16-le'), 'utf-8'))
+        late = b' ' * parsing.SNIFF_SIZE + b'<meta charset="koi8-r">'
+        self.assertEqual('utf-8', detect(late))
+
+    def test_parse_page(self):
+        selectors = {'price_css': ['.price']}
+        for encoding in ('utf-8', 'cp1252', 'utf-16'):
+            urls, data, timings = parsing.parse_page(
+                PAGE.encode(encoding), 'http://shop.example/', selectors,
+                encoding)
+            self.assertEqual(['http://shop.example/caf\xe9'], urls)
+            self.assertEqual({'price_css': ['12 €']}, data)
+        urls, data, timings = parsing.parse_page(PAGE, 'http://shop.example/')
+        self.assertEqual(['http://shop.example/caf\xe9'], urls)
+        self.assertIsNone(data)
+        self.assertEqual({'parse', 'scrape'}, set(timings))
+
+    def test_parse_tree_mislabelled(self):
+        # cp1252 bytes sent as UTF-8 are decoded with replacement.
+        tree = parsing.parse_tree(PAGE.encode('cp1252'), 'utf-8')
+        self.assertEqual('Caf�', tree.findtext('.//title'))
+        tree = parsing.parse_tree(PAGE.encode('cp1252'), 'cp1252')
+        self.assertEqual('Caf\xe9', tree.findtext('.//title'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+import os
+import unittest
+import redis
+import app.redis_frontier as redis_frontier
+
+REDIS_HOST = os.environ.get('REDIS_HOST', 'localhost')
+REDIS_PORT = int(os.environ.get('REDIS_PORT', 6379))
+
+
+class TestRedisFrontier(unittest.TestCase):
+    """Needs a redis-server; database 15 of it is used."""
+
+    def setUp(self):
+        self.client = redis.StrictRedis(host=REDIS_HOST, port=REDIS_PORT,
+                                        db=15)
+        try:
+            self.client.ping()
+        except redis.ConnectionError:
+            self.skipTest('no redis-server on %s:%d' % (REDIS_HOST,
+                                                         REDIS_PORT))
+        self.name = 'test-%d' % os.getpid()
+
+    def open(self, **kwargs):
+        f = redis_frontier.RedisFrontier(self.client, self.name, **kwargs)
+        self.addCleanup(f.clear)
+        return f
+
+    def test_filter_unseen(self):
+        f = self.open()
+        self.assertEqual(['http://a/1', 'http://b/1'],
+                         f.filter_unseen(['http://a/1', 'http://b/1'], 3))
+        self.assertEqual(['http://a/2'],
+                         f.filter_unseen(['http://a/1', 'http://a/2'], 3))
+        self.assertIn('http://a/1', f)
+        self.assertNotIn('http://a/3', f)
+        self.assertEqual(3, len(f))
+        self.assertEqual(3, f.pending())
+
+    def test_take_round_robin(self):
+        f = self.open()
+        f.filter_unseen(['http://a/1', 'http://a/2', 'http://a/3',
+                         'http://b/1'], 3)
+        taken = f.take(2)
+        self.assertEqual({'http://a/1', 'http://b/1'},
+                         {url for url, _ in taken})
+        self.assertEqual(3, taken[0][1])
+        self.assertEqual([('http://a/2', 3), ('http://a/3', 3)], f.take(5))
+        self.assertEqual([], f.take(5))
+        self.assertEqual(0, f.pending())
+        self.assertEqual(4, f.leased())
+
+    def test_take_after_host_emptied(self):
+        f = self.open()
+        f.filter_unseen(['http://a/1'])
+        self.assertEqual([('http://a/1', None)], f.take(1))
+        # a is still listed, with an empty queue: it is not listed twice.
+        f.filter_unseen(['http://a/2', 'http://b/1'])
+        self.assertEqual({'http://a/2', 'http://b/1'},
+                         {url for url, _ in f.take(10)})
+        f.filter_unseen(['http://a/3'])
+        self.assertEqual([('http://a/3', None)], f.take(10))
+        self.assertEqual(0, f.pending())
+
+    def test_nodes_share_seen_set(self):
+        node1 = self.open()
+        node2 = self.open()
+        self.assertEqual(['http://a/1'], node1.filter_unseen(['http://a/1']))
+        self.assertEqual(['http://a/2'],
+                         node2.filter_unseen(['http://a/1', 'http://a/2']))
+        self.assertEqual([('http://a/1', None)], node2.take(1))
+        self.assertEqual([('http://a/2', None)], node1.take(1))
+        self.assertEqual([], node1.take(1))
+
+    def test_ack_and_expired_lease(self):
+        node1 = self.open(lease_time=0, ack_batch=1)
+        node2 = self.open()
+        node1.filter_unseen(['http://a/1', 'http://a/2'], 3)
+        node1.take(2)
+        node1.done('http://a/1')
+        self.assertEqual(1, node1.leased())
+        # node1 never acknowledged http://a/2 and its lease has expired.
+        self.assertEqual([('http://a/2', 3)], node2.take(5))
+        node2.done('http://a/2')
+        node2.close()
+        self.assertEqual(0, node2.leased())
+
+
+if __name__ == '__main__':
+    unittest.main()
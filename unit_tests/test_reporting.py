@@ -0,0 +1,54 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+import app.reporting as reporting
+from app.crawling import FetchStatistic
+
+
+class TestReporting(unittest.TestCase):
+
+    def test_histogram(self):
+        histogram = reporting.Histogram([1, 2, 4, 8])
+        for value in (1, 1, 2, 3, 7, 100):
+            histogram.add(value)
+        self.assertEqual([2, 1, 1, 1, 1], histogram.counts)
+        self.assertEqual(1, histogram.percentile(30))
+        self.assertEqual(4, histogram.percentile(65))
+        self.assertEqual(float('inf'), histogram.percentile(100))
+
+    def test_aggregator(self):
+        stats = reporting.StatsAggregator()
+        stats.add(FetchStatistic(url='http://a/', status=200, size=2000,
+                                 content_type='text/html', num_urls=3))
+        stats.add(FetchStatistic(url='http://a/x', status=404, size=0))
+        stats.add(FetchStatistic(url='http://a/y', next_url='http://a/',
+                                 status=302, size=0))
+        stats.add(FetchStatistic(url='http://a/z', exception=OSError()))
+        self.assertEqual(4, stats.done)
+        self.assertEqual({'html': 1, 'html_bytes': 2000, 'error': 1,
+                          'error_bytes': 0, 'status_404': 1, 'redirect': 1,
+                          'fail': 1, 'fail_OSError': 1}, stats.stats.stats)
+        self.assertEqual(1, stats.sizes.count)
+        self.assertEqual(1, stats.links.count)
+
+    def test_json_log(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        path = os.path.join(tmpdir, 'stats.jsonl')
+        log = reporting.JsonLog(path, max_bytes=200, backup_count=2)
+        stats = reporting.StatsAggregator(log=log)
+        for i in range(10):
+            stats.add(FetchStatistic(url='http://a/%d' % i, status=200,
+                                     exception=OSError('x')))
+        log.close()
+        self.assertEqual(['stats.jsonl', 'stats.jsonl.1', 'stats.jsonl.2'],
+                         sorted(os.listdir(tmpdir)))
+        with open(path) as f:
+            records = [json.loads(line) for line in f]
+        self.assertEqual('http://a/9', records[-1]['url'])
+        self.assertIn('OSError', records[-1]['exception'])
+
+if __name__ == '__main__':
+    unittest.main()
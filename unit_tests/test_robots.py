@@ -0,0 +1,183 @@
+import asyncio
+import unittest
+import app.robots as robots
+
+ROBOTS = """
+# Shop robots.txt
+User-agent: *
+Disallow: /cart
+Disallow: /search
+Allow: /search/help
+Disallow: /*.pdf$
+Disallow: /*?sort=
+Crawl-delay: 2
+
+User-agent: python_crawler
+User-agent: otherbot
+Disallow: /private
+Crawl-delay: 0.5
+
+Sitemap: https://shop.example/sitemap.xml
+"""
+
+
+class FakeContent(object):
+
+    def __init__(self, body):
+        self.body = body
+
+    @asyncio.coroutine
+    def read(self, n=-1):
+        chunk, self.body = self.body[:n], self.body[n:]
+        return chunk
+
+
+class FakeResponse(object):
+
+    def __init__(self, status, body=b''):
+        self.status = status
+        self.content = FakeContent(body)
+
+    def close(self):
+        pass
+
+
+class FakeSession(object):
+    """Answers robots.txt requests from a dict of URL -> (status, body)."""
+
+    def __init__(self, loop, pages):
+        self.loop = loop
+        self.pages = pages
+        self.requests = []
+
+    @asyncio.coroutine
+    def get(self, url):
+        self.requests.append(url)
+        yield from asyncio.sleep(0.01, loop=self.loop)
+        answer = self.pages.get(url)
+        if answer is None:
+            raise OSError('connection refused')
+        return FakeResponse(*answer)
+
+
+class TestRobotsRules(unittest.TestCase):
+
+    def test_split_url(self):
+        self.assertEqual(('http://shop.example:8080', '/a/b?c=d'),
+                         robots.split_url('HTTP://Shop.Example:8080/a/b?c=d#e'))
+        self.assertEqual(('https://shop.example', '/'),
+                         robots.split_url('https://shop.example'))
+        self.assertEqual(('https://shop.example', '/?q=1'),
+                         robots.split_url('https://shop.example?q=1'))
+
+    def test_star_group(self):
+        rules = robots.parse_robots(ROBOTS, 'somebot/1.0')
+        self.assertEqual(2, rules.crawl_delay)
+        self.assertEqual(['https://shop.example/sitemap.xml'], rules.sitemaps)
+        self.assertTrue(rules.allowed('/'))
+        self.assertTrue(rules.allowed('/private'))
+        self.assertFalse(rules.allowed('/cart'))
+        self.assertFalse(rules.allowed('/cart/add?id=1'))
+        self.assertFalse(rules.allowed('/search?q=chair'))
+        self.assertTrue(rules.allowed('/search/help'))
+        self.assertFalse(rules.allowed('/docs/manual.pdf'))
+        self.assertTrue(rules.allowed('/docs/manual.pdf?download=1'))
+        self.assertFalse(rules.allowed('/chairs?sort=price&page=2'))
+        self.assertTrue(rules.allowed('/robots.txt'))
+
+    def test_own_group(self):
+        rules = robots.parse_robots(ROBOTS, 'python_crawler/1.0')
+        self.assertEqual(0.5, rules.crawl_delay)
+        self.assertFalse(rules.allowed('/private/x'))
+        self.assertTrue(rules.allowed('/cart'))
+
+    def test_longest_rule_wins(self):
+        rules = robots.RobotsRules([('/p', False), ('/p/', True),
+                                    ('/p/x', False), ('/p/x', True)])
+        self.assertFalse(rules.allowed('/pa'))
+        self.assertTrue(rules.allowed('/p/a'))
+        # Allow wins a tie.
+        self.assertTrue(rules.allowed('/p/x'))
+        self.assertTrue(robots.RobotsRules([('', False)]).allowed('/a'))
+        self.assertFalse(robots.DISALLOW_ALL.allowed('/a'))
+        self.assertTrue(robots.ALLOW_ALL.allowed('/a'))
+
+    def test_empty(self):
+        rules = robots.parse_robots('', 'python_crawler')
+        self.assertTrue(rules.allowed('/anything'))
+        self.assertIsNone(rules.crawl_delay)
+
+
+class TestRobotsCache(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(None)
+        self.addCleanup(self.loop.close)
+        self.session = FakeSession(self.loop, {
+            'http://shop.example/robots.txt': (200, ROBOTS.encode('utf-8')),
+            'http://missing.example/robots.txt': (404, b''),
+            'http://broken.example/robots.txt': (503, b''),
+        })
+
+    def rules(self, cache, url):
+        return self.loop.run_until_complete(cache.rules(url, self.session))
+
+    def test_fetch_once(self):
+        cache = robots.RobotsCache(max_crawl_delay=0.2, loop=self.loop)
+        self.assertTrue(cache.allowed('http://shop.example/private'))
+        both = self.loop.run_until_complete(asyncio.gather(
+            cache.rules('http://shop.example/a', self.session),
+            cache.rules('http://SHOP.example/b', self.session),
+            loop=self.loop))
+        self.assertIs(both[0], both[1])
+        self.assertEqual(['http://shop.example/robots.txt'],
+                         self.session.requests)
+        self.assertFalse(cache.allowed('http://shop.example/private'))
+        self.assertTrue(cache.allowed('http://shop.example/cart'))
+        self.assertEqual(0.2, cache.crawl_delay(both[0]))
+        self.rules(cache, 'http://shop.example/c')
+        self.assertEqual(1, cache.fetched)
+
+    def test_failures(self):
+        cache = robots.RobotsCache(loop=self.loop)
+        self.assertIs(robots.ALLOW_ALL,
+                      self.rules(cache, 'http://missing.example/a'))
+        self.assertIs(robots.UNAVAILABLE,
+                      self.rules(cache, 'http://broken.example/a'))
+        self.assertIs(robots.UNAVAILABLE,
+                      self.rules(cache, 'http://down.example/a'))
+        self.assertEqual(2, cache.errors)
+        self.assertFalse(robots.UNAVAILABLE.allowed('/a'))
+        # Links are kept; the fetch puts them back until the rules come.
+        self.assertTrue(cache.allowed('http://down.example/a'))
+
+    def test_gave_up(self):
+        cache = robots.RobotsCache(error_ttl=0, max_failures=2,
+                                   loop=self.loop)
+        self.rules(cache, 'http://down.example/a')
+        self.assertFalse(cache.gave_up('http://down.example/b'))
+        self.rules(cache, 'http://down.example/a')
+        self.assertTrue(cache.gave_up('http://down.example/b'))
+        self.assertFalse(cache.gave_up('http://missing.example/a'))
+
+    def test_expiry(self):
+        cache = robots.RobotsCache(ttl=0.05, error_ttl=0.01, max_size=1,
+                                   loop=self.loop)
+        self.rules(cache, 'http://missing.example/a')
+        self.rules(cache, 'http://broken.example/a')
+        self.assertEqual(['http://broken.example'], list(cache.cache))
+        self.loop.run_until_complete(asyncio.sleep(0.02, loop=self.loop))
+        self.assertTrue(cache.allowed('http://broken.example/a'))
+        self.assertEqual(0, len(cache.cache))
+
+    def test_max_bytes(self):
+        cache = robots.RobotsCache(max_bytes=49, loop=self.loop)
+        rules = self.rules(cache, 'http://shop.example/')
+        # Only the first rules were read.
+        self.assertFalse(rules.allowed('/cart'))
+        self.assertTrue(rules.allowed('/search'))
+
+
+if __name__ == '__main__':
+    unittest.main()
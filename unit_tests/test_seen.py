@@ -0,0 +1,53 @@
+import unittest
+import app.seen as seen
+
+
+class SeenStoreTests(object):
+
+    def test_filter_unseen(self):
+        store = self.create()
+        self.assertEqual(['http://a/1', 'http://a/2'],
+                         store.filter_unseen(['http://a/1', 'http://a/2',
+                                              'http://a/1']))
+        self.assertEqual(['http://a/3'],
+                         store.filter_unseen(['http://a/2', 'http://a/3']))
+        self.assertIn('http://a/1', store)
+        self.assertNotIn('http://a/4', store)
+        self.assertEqual(3, len(store))
+
+    def test_many(self):
+        store = self.create()
+        urls = ['http://a/%d' % i for i in range(20000)]
+        store.update(urls[:10000])
+        self.assertGreaterEqual(len(store), 9950)
+        for url in urls[:10000]:
+            self.assertIn(url, store)
+        new_urls = store.filter_unseen(urls)
+        self.assertGreaterEqual(len(new_urls), 9950)
+        self.assertTrue(set(new_urls) <= set(urls[10000:]))
+
+
+class TestFingerprintSet(SeenStoreTests, unittest.TestCase):
+
+    def create(self):
+        return seen.FingerprintSet(min_merge=100)
+
+    def test_exact(self):
+        store = self.create()
+        urls = ['http://a/%d' % i for i in range(5000)]
+        self.assertEqual(urls, store.filter_unseen(urls))
+        self.assertEqual([], store.filter_unseen(urls))
+
+
+class TestScalableBloomFilter(SeenStoreTests, unittest.TestCase):
+
+    def create(self):
+        return seen.ScalableBloomFilter(error_rate=0.001, initial_capacity=1000)
+
+    def test_grows(self):
+        store = self.create()
+        store.update('http://a/%d' % i for i in range(5000))
+        self.assertGreater(len(store.filters), 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,141 @@
+import asyncio
+import functools
+import io
+import queue
+import socket
+import threading
+import unittest
+from aiohttp import web
+import app.crawling as crawling
+import app.reporting as reporting
+import app.sharding as sharding
+from app.crawling import FetchStatistic
+
+
+def make_crawler(roots, *, loop, shard):
+    return crawling.Crawler(roots, max_tasks=2, loop=loop, shard=shard)
+
+
+class TestSharding(unittest.TestCase):
+
+    def test_shard_of(self):
+        urls = ['http://host%d.example.com/page' % i for i in range(100)]
+        shards = [sharding.shard_of(url, 4) for url in urls]
+        self.assertEqual(set(range(4)), set(shards))
+        self.assertEqual(shards, [sharding.shard_of(url, 4) for url in urls])
+        self.assertEqual(sharding.shard_of('http://Host1.example.com/a', 4),
+                         sharding.shard_of('http://host1.example.com/b', 4))
+
+    def test_keep_own(self):
+        inboxes = [queue.Queue() for _ in range(3)]
+        shard = sharding.Shard(0, 3, inboxes, queue.Queue(), batch_size=2,
+                               loop=object())
+        urls = ['http://host%d.example.com/' % i for i in range(30)]
+        own = shard.keep_own(urls, 5)
+        self.assertEqual([url for url in urls
+                          if sharding.shard_of(url, 3) == 0], own)
+        # URLs found again are not forwarded again.
+        self.assertEqual(own + own, shard.keep_own(urls + urls, 5))
+        shard.flush()
+        forwarded = []
+        for target in (1, 2):
+            while not inboxes[target].empty():
+                batch = inboxes[target].get()
+                self.assertLessEqual(len(batch), 2)
+                for url, max_redirect in batch:
+                    self.assertEqual(target, sharding.shard_of(url, 3))
+                    self.assertEqual(5, max_redirect)
+                    forwarded.append(url)
+        self.assertTrue(inboxes[0].empty())
+        self.assertEqual(len(urls) - len(own), len(forwarded))
+        self.assertEqual(len(forwarded), shard.sent)
+
+    def test_termination(self):
+        termination = sharding.Termination(2)
+        # Shard 0 idle, shard 1 busy.
+        self.assertFalse(termination.update(0, 1, True, 0, 0))
+        self.assertFalse(termination.update(1, 1, False, 1, 0))
+        # Totals balance, but shard 0 reported before receiving the URL.
+        self.assertFalse(termination.update(1, 2, True, 1, 1))
+        self.assertFalse(termination.update(0, 2, False, 1, 1))
+        self.assertFalse(termination.update(0, 3, True, 1, 1))
+        # Shard 1 has reported again since, with the same counters, but
+        # shard 0 has not.
+        self.assertFalse(termination.update(1, 3, True, 1, 1))
+        self.assertTrue(termination.update(0, 4, True, 1, 1))
+
+    def test_termination_in_transit(self):
+        termination = sharding.Termination(2)
+        for seq in range(1, 4):
+            self.assertFalse(termination.update(0, seq, True, 2, 0))
+            self.assertFalse(termination.update(1, seq, True, 0, 1))
+
+    def test_merge(self):
+        a = reporting.StatsAggregator()
+        b = reporting.StatsAggregator()
+        a.add(FetchStatistic(url='http://a/', status=200, size=2000,
+                             content_type='text/html', num_urls=3))
+        b.add(FetchStatistic(url='http://b/', status=200, size=3000,
+                             content_type='text/html', num_urls=1))
+        b.add(FetchStatistic(url='http://b/x', exception=OSError()))
+        a.merge(b)
+        self.assertEqual(3, a.done)
+        self.assertEqual(5000, a.stats.stats['html_bytes'])
+        self.assertEqual(1, a.stats.stats['fail'])
+        self.assertEqual(2, a.sizes.count)
+        self.assertEqual(2, a.links.count)
+        with self.assertRaises(ValueError):
+            a.sizes.merge(a.links)
+
+
+class TestShardedCrawl(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        s.bind(('127.0.0.1', 0))
+        self.port = s.getsockname()[1]
+        s.close()
+        app = web.Application(loop=self.loop)
+
+        @asyncio.coroutine
+        def page(request):
+            # Every page links to a few pages of both hosts.
+            n = int(request.match_info['n'])
+            links = ''.join(
+                '<a href="http://%s:%d/%d">x</a>' % (host, self.port, i)
+                for host in ('127.0.0.1', 'localhost')
+                for i in range(n, min(n + 3, 20)))
+            return web.Response(body=links.encode(),
+                                content_type='text/html')
+
+        app.router.add_route('GET', '/{n}', page)
+        handler = app.make_handler()
+        self.server = self.loop.run_until_complete(
+            self.loop.create_server(handler, '127.0.0.1', self.port))
+        self.thread = threading.Thread(target=self.loop.run_forever)
+        self.thread.start()
+
+        def stop():
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join()
+            self.server.close()
+            self.loop.run_until_complete(handler.finish_connections())
+            self.loop.close()
+        self.addCleanup(stop)
+
+    def test_crawl(self):
+        roots = {'http://127.0.0.1:%d/0' % self.port,
+                 'http://localhost:%d/0' % self.port}
+        out = io.StringIO()
+        results = sharding.crawl(
+            2, functools.partial(make_crawler, roots), file=out)
+        self.assertEqual({0, 1}, set(results))
+        # 20 pages on each host, each fetched once by its owner.
+        self.assertEqual(40, sum(stats.done
+                                 for stats, _, _, _ in results.values()))
+        self.assertIn('Done: 40', out.getvalue())
+
+
+if __name__ == '__main__':
+    unittest.main()
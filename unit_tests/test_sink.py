@@ -0,0 +1,177 @@
+import asyncio
+import collections
+import json
+import unittest
+import app.sink as sink
+
+
+BlpopReply = collections.namedtuple('BlpopReply', ['list_name', 'value'])
+
+
+class FakeTransaction:
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.commands = []
+
+    def _queue(self, *command):
+        # Like asyncio_redis, queue the command and return a future of
+        # its reply, set by exec().
+        future = asyncio.Future(loop=self.connection.loop)
+        self.commands.append((command, future))
+        return future
+
+    def rpush(self, key, values):
+        yield from ()
+        return self._queue('rpush', key, list(values))
+
+    def lpop(self, key):
+        yield from ()
+        return self._queue('lpop', key)
+
+    @asyncio.coroutine
+    def exec(self):
+        if self.connection.failures:
+            self.connection.failures -= 1
+            raise ConnectionError('redis is down')
+        self.connection.round_trips.append(
+            [command for command, _ in self.commands])
+        for (name, key, *args), future in self.commands:
+            if name == 'rpush':
+                future.set_result(self.connection.push(key, *args))
+            else:
+                future.set_result(self.connection.pop(key))
+
+
+class FakeConnection:
+    """Redis lists behind an asyncio_redis-like connection.
+
+    round_trips has the commands of every round-trip to Redis, and the
+    next failures MULTI/EXECs raise ConnectionError.
+    """
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.lists = collections.defaultdict(collections.deque)
+        self.round_trips = []
+        self.failures = 0
+        self.pushed = asyncio.Event(loop=loop)
+
+    def push(self, key, values):
+        """RPUSH values to key without a round-trip."""
+        self.lists[key].extend(values)
+        self.pushed.set()
+        return len(self.lists[key])
+
+    def pop(self, key):
+        """LPOP key without a round-trip."""
+        values = self.lists[key]
+        return values.popleft() if values else None
+
+    @asyncio.coroutine
+    def blpop(self, keys, timeout=0):
+        while True:
+            for key in keys:
+                if self.lists[key]:
+                    self.round_trips.append([('blpop', key)])
+                    return BlpopReply(key, self.pop(key))
+            self.pushed.clear()
+            yield from self.pushed.wait()
+
+    @asyncio.coroutine
+    def multi(self):
+        return FakeTransaction(self)
+
+
+class TestRedisDataHandler(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(None)
+        self.addCleanup(self.loop.close)
+        self.connection = FakeConnection(self.loop)
+
+    def test_batch(self):
+        handler = sink.RedisDataHandler(self.connection, batch_size=3,
+                                        flush_interval=60, loop=self.loop)
+
+        @asyncio.coroutine
+        def go():
+            for i in range(4):
+                yield from handler.handle('http://a', 'http://a/%d' % i,
+                                          {'nom_css': [str(i)]})
+            self.assertEqual(1, len(self.connection.round_trips))
+            yield from handler.close()
+
+        self.loop.run_until_complete(go())
+        self.assertEqual(2, len(self.connection.round_trips))
+        _, key, values = self.connection.round_trips[0][0]
+        self.assertEqual('http://a:product_info', key)
+        self.assertEqual({'nom_css': ['0'], 'url': 'http://a/0'},
+                         json.loads(values[0]))
+        self.assertEqual(4, handler.pushed)
+
+    def test_interval(self):
+        handler = sink.RedisDataHandler(self.connection, batch_size=100,
+                                        flush_interval=0.01, loop=self.loop)
+
+        @asyncio.coroutine
+        def go():
+            yield from handler.handle('http://a', 'http://a/', {})
+            yield from handler.handle('http://b', 'http://b/', {})
+            yield from asyncio.sleep(0.05, loop=self.loop)
+            self.assertEqual(1, len(self.connection.round_trips))
+            self.assertEqual(2, len(self.connection.round_trips[0]))
+            yield from handler.close()
+
+        self.loop.run_until_complete(go())
+
+    def test_failed_flush(self):
+        handler = sink.RedisDataHandler(self.connection, batch_size=100,
+                                        flush_interval=60, max_buffered=2,
+                                        loop=self.loop)
+        self.connection.failures = 2
+
+        @asyncio.coroutine
+        def go():
+            yield from handler.handle('http://a', 'http://a/0', {})
+            with self.assertRaises(ConnectionError):
+                yield from handler.flush()
+            # Put back, in front of what came since.
+            yield from handler.handle('http://a', 'http://a/1', {})
+            self.assertEqual(2, handler.pending)
+            yield from handler.handle('http://a', 'http://a/2', {})
+            with self.assertRaises(ConnectionError):
+                yield from handler.flush()
+            # Over max_buffered once put back: dropped.
+            self.assertEqual(3, handler.lost)
+            yield from handler.handle('http://a', 'http://a/3', {})
+            yield from handler.close()
+
+        self.loop.run_until_complete(go())
+        _, key, values = self.connection.round_trips[0][0]
+        self.assertEqual(['http://a/3'],
+                         [json.loads(value)['url'] for value in values])
+        self.assertEqual(1, handler.pushed)
+
+    def test_restore_order(self):
+        handler = sink.RedisDataHandler(self.connection, batch_size=100,
+                                        flush_interval=60, loop=self.loop)
+        self.connection.failures = 1
+
+        @asyncio.coroutine
+        def go():
+            yield from handler.handle('http://a', 'http://a/0', {})
+            with self.assertRaises(ConnectionError):
+                yield from handler.flush()
+            yield from handler.handle('http://a', 'http://a/1', {})
+            yield from handler.close()
+
+        self.loop.run_until_complete(go())
+        _, key, values = self.connection.round_trips[0][0]
+        self.assertEqual(['http://a/0', 'http://a/1'],
+                         [json.loads(value)['url'] for value in values])
+        self.assertEqual(0, handler.lost)
+
+if __name__ == '__main__':
+    unittest.main()
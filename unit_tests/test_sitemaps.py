@@ -0,0 +1,139 @@
+import asyncio
+import gzip
+import unittest
+import app.sitemaps as sitemaps
+from unit_tests.test_robots import FakeSession
+
+NS = 'xmlns="http://www.sitemaps.org/schemas/sitemap/0.9"'
+
+
+def urlset(urls):
+    return ('<?xml version="1.0" encoding="UTF-8"?><urlset %s>%s</urlset>' % (
+        NS, ''.join('<url><loc>%s</loc>%s</url>' % (
+            url, '<lastmod>%s</lastmod>' % lastmod if lastmod else '')
+            for url, lastmod in urls))).encode('utf-8')
+
+
+def sitemap_index(locs):
+    return ('<sitemapindex %s>%s</sitemapindex>' % (
+        NS, ''.join('<sitemap><loc>%s</loc></sitemap>' % loc
+                    for loc in locs))).encode('utf-8')
+
+
+class TestSitemapParser(unittest.TestCase):
+
+    def feed(self, body, chunk_size=7, **kwargs):
+        parser = sitemaps.SitemapParser(**kwargs)
+        entries = []
+        for i in range(0, len(body), chunk_size):
+            entries.extend(parser.feed(body[i:i + chunk_size]))
+        entries.extend(parser.close())
+        return entries
+
+    def test_parse_lastmod(self):
+        self.assertEqual(1262304000.0, sitemaps.parse_lastmod('2010-01-01'))
+        self.assertEqual(1262304000.0 + 3600,
+                         sitemaps.parse_lastmod('2010-01-01T02:00+01:00'))
+        self.assertEqual(1262304000.0 + 30,
+                         sitemaps.parse_lastmod(' 2010-01-01T00:00:30.5Z '))
+        self.assertEqual(1262304000.0, sitemaps.parse_lastmod('2010'))
+        self.assertIsNone(sitemaps.parse_lastmod('yesterday'))
+        self.assertIsNone(sitemaps.parse_lastmod('2010-13-01'))
+        self.assertIsNone(sitemaps.parse_lastmod(None))
+
+    def test_urlset(self):
+        body = urlset([('http://a/1', '2010-01-01'), ('http://a/2', None)])
+        self.assertEqual(
+            [sitemaps.SitemapEntry(False, 'http://a/1', 1262304000.0),
+             sitemaps.SitemapEntry(False, 'http://a/2', None)],
+            self.feed(body))
+
+    def test_gzipped_index(self):
+        body = gzip.compress(sitemap_index(['http://a/s1.xml.gz',
+                                            'http://a/s2.xml']))
+        self.assertEqual(
+            [sitemaps.SitemapEntry(True, 'http://a/s1.xml.gz', None),
+             sitemaps.SitemapEntry(True, 'http://a/s2.xml', None)],
+            self.feed(body))
+
+    def test_constant_memory(self):
+        parser = sitemaps.SitemapParser()
+        parser.feed(('<urlset %s>' % NS).encode('utf-8'))
+        for i in range(1000):
+            entries = parser.feed(
+                ('<url><loc>http://a/%d</loc></url>' % i).encode('utf-8'))
+            self.assertEqual(1, len(entries))
+        parser.feed(b'</urlset>')
+        # The <url> elements read were dropped from the tree.
+        self.assertLessEqual(len(parser._parser.close()), 1)
+
+    def test_max_bytes(self):
+        body = gzip.compress(urlset([('http://a/%d' % i, None)
+                                     for i in range(100)]))
+        with self.assertRaises(ValueError):
+            self.feed(body, max_bytes=1000)
+
+
+class TestSitemapSeeder(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(None)
+        self.addCleanup(self.loop.close)
+
+    def seed(self, pages, root='http://shop.example/', **kwargs):
+        session = FakeSession(self.loop, pages)
+        seeder = sitemaps.SitemapSeeder(loop=self.loop, **kwargs)
+        batches = []
+        self.loop.run_until_complete(seeder.seed(root, session,
+                                                 batches.append))
+        # Once per site.
+        self.loop.run_until_complete(seeder.seed(root, session,
+                                                 batches.append))
+        return seeder, session, batches
+
+    def test_robots_and_index(self):
+        seeder, session, batches = self.seed({
+            'http://shop.example/robots.txt': (
+                200, b'Sitemap: http://shop.example/index.xml\n'),
+            'http://shop.example/index.xml': (
+                200, sitemap_index(['http://shop.example/s1.xml.gz',
+                                    'http://shop.example/s2.xml',
+                                    'http://shop.example/s1.xml.gz'])),
+            'http://shop.example/s1.xml.gz': (
+                200, gzip.compress(urlset([('http://shop.example/p/1',
+                                            '2010-01-01')]))),
+            'http://shop.example/s2.xml': (404, b''),
+        })
+        self.assertEqual([[('http://shop.example/p/1', 1262304000.0)]],
+                         batches)
+        self.assertEqual(['http://shop.example/robots.txt',
+                          'http://shop.example/index.xml',
+                          'http://shop.example/s1.xml.gz',
+                          'http://shop.example/s2.xml'], session.requests)
+        self.assertEqual(3, seeder.sitemaps)
+        self.assertEqual(1, seeder.errors)
+        self.assertEqual(1, seeder.urls)
+
+    def test_default_sitemap_and_limits(self):
+        seeder, session, batches = self.seed({
+            'http://shop.example/robots.txt': (404, b''),
+            'http://shop.example/sitemap.xml': (
+                200, urlset([('http://shop.example/%d' % i, None)
+                             for i in range(25)])),
+        }, batch_size=10, max_urls=22, chunk_size=100)
+        self.assertEqual([10, 10, 2], [len(batch) for batch in batches])
+        self.assertEqual(22, seeder.urls)
+
+    def test_broken_xml(self):
+        seeder, session, batches = self.seed({
+            'http://shop.example/robots.txt': (404, b''),
+            'http://shop.example/sitemap.xml': (
+                200, urlset([('http://shop.example/1', None)])[:-5]),
+        })
+        self.assertEqual([[('http://shop.example/1', None)]], batches)
+        self.assertEqual(1, seeder.errors)
+
+
+if __name__ == '__main__':
+    unittest.main()